@@ -8,6 +8,7 @@ import errno
 from os.path import join
 from os.path import dirname
 
+from kitten import bench
 from kitten import conf
 from kitten import db
 from kitten import node
@@ -70,6 +71,7 @@ def main():
     executors = {
         'server': server.setup_parser(subparsers),
         'node': node.setup_parser(subparsers),
+        'bench': bench.setup_parser(subparsers),
     }
 
     # Parse the current command line.
@@ -91,8 +93,9 @@ def main():
     db.setup_core(ns)
 
     # If the server is not already running and we're not trying to modify it,
-    # start one in the background.
-    if not server.is_running(ns) and ns.command != 'server':
+    # start one in the background. Benchmarks load whatever servers they are
+    # pointed at and should not spawn one of their own.
+    if not server.is_running(ns) and ns.command not in ('server', 'bench'):
         logging.info('Server not running. Starting in background.')
         sub.Popen([sys.argv[0], 'server'], stdout=sub.PIPE, stderr=sub.PIPE)
 
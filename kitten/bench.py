@@ -0,0 +1,348 @@
+import json
+import math
+import time
+import random
+import logbook
+import zmq.green as zmq
+
+import gevent
+from gevent.pool import Group
+
+from kitten import conf
+from kitten.client import KittenClient
+from kitten.pool import SocketPool
+from kitten.request import RequestError
+from kitten.util import AutoParadigmMixin
+
+PERCENTILES = (
+    ('p50', 50),
+    ('p90', 90),
+    ('p99', 99),
+    ('p999', 99.9),
+)
+
+
+def parse_mix(mix):
+    """
+    Parse a request mix like 'node.ping:3,node.sync'
+
+    Returns a list of (paradigm, method, weight) tuples. The weight defaults
+    to 1.
+
+    """
+
+    ret = []
+    for item in mix.split(','):
+        item = item.strip()
+        if not item:
+            continue
+
+        call, _, weight = item.partition(':')
+        paradigm, _, method = call.partition('.')
+        if not paradigm or not method:
+            raise ValueError(
+                "Bad mix item '{0}'; expected paradigm.method[:weight]".format(
+                    item
+                )
+            )
+
+        ret.append((paradigm, method, int(weight or 1)))
+
+    if not ret:
+        raise ValueError('Empty request mix')
+
+    return ret
+
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of already sorted values
+
+    """
+
+    if not values:
+        return None
+
+    rank = int(math.ceil(p * len(values) / 100.0)) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+class Bench(AutoParadigmMixin):
+    """
+    Load generator for kitten servers
+
+    Runs `clients` concurrent clients that send requests picked from `mix` to
+    random `addresses` until `duration` seconds have passed or `requests`
+    requests have been sent. The queue depth of every server is sampled over
+    heartbeats every `interval` seconds while the load runs.
+
+    Latencies are the round trips the client sees, i.e. until the server has
+    acknowledged the request. Timed out requests are counted, not retried.
+
+    """
+
+    log = logbook.Logger('Bench')
+
+    def __init__(self, addresses, mix, clients=None, duration=None,
+                 requests=None, interval=None):
+        self.addresses = list(addresses)
+        self.mix = mix
+        self.clients = conf.BENCH_CLIENTS if clients is None else clients
+        self.duration = conf.BENCH_DURATION if duration is None else duration
+        self.requests = requests
+        self.interval = conf.BENCH_INTERVAL if interval is None else interval
+
+        self.calls = [(p, m) for p, m, _ in mix]
+        self.weights = [w for _, _, w in mix]
+
+        self.started = None
+        self.elapsed = None
+        self.sent = 0
+        self.latencies = []
+        self.errors = 0
+        self.timeouts = 0
+        self.busy = 0
+        self.depths = []
+
+    def build(self):
+        paradigm, method = self.choose()
+        return getattr(self.paradigms[paradigm], method + '_request')({})
+
+    def choose(self):
+        point = random.uniform(0, sum(self.weights))
+        for call, weight in zip(self.calls, self.weights):
+            point -= weight
+            if point <= 0:
+                return call
+
+        return self.calls[-1]  # pragma: nocover
+
+    def get_client(self):
+        # Every client gets sockets of its own, as concurrent requests would
+        # otherwise churn through the shared pool. Timeouts are part of the
+        # result, so they are not retried.
+        client = KittenClient()
+        client.pool = SocketPool(zmq.REQ)
+        client.retries = 0
+
+        return client
+
+    def claim(self):
+        if self.requests is not None:
+            if self.sent >= self.requests:
+                return False
+        elif time.time() - self.started >= self.duration:
+            return False
+
+        self.sent += 1
+        return True
+
+    def call(self, client):
+        address = random.choice(self.addresses)
+        request = self.build()
+
+        start = time.time()
+        try:
+            response = client.send(address, request)
+        except RequestError as e:
+            if e.code == 'TIMEOUT':
+                self.timeouts += 1
+            elif e.code == 'BUSY':
+                self.busy += 1
+            else:
+                self.errors += 1
+            return
+        except Exception:
+            self.log.exception('Request failed')
+            self.errors += 1
+            return
+
+        self.latencies.append((time.time() - start) * 1000)
+
+        if response.get('code', 'OK') != 'OK':
+            self.errors += 1
+
+    def drive(self):
+        client = self.get_client()
+        try:
+            while self.claim():
+                self.call(client)
+        finally:
+            client.pool.clear()
+
+    def sample(self, client):
+        elapsed = time.time() - self.started
+
+        for address in self.addresses:
+            pong = client.heartbeat(address)
+            self.depths.append({
+                'time': round(elapsed, 3),
+                'address': address,
+                'depth': None if pong is None else pong.depth,
+            })
+
+    def sample_forever(self):
+        client = KittenClient()
+        while True:
+            self.sample(client)
+            gevent.sleep(self.interval)
+
+    def run(self):
+        self.log.info(
+            'Running {0} clients against {1}', self.clients, self.addresses
+        )
+
+        self.started = time.time()
+        sampler = gevent.spawn(self.sample_forever)
+
+        group = Group()
+        for _ in range(self.clients):
+            group.spawn(self.drive)
+        group.join()
+
+        sampler.kill()
+        self.elapsed = time.time() - self.started
+
+        return self.report()
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        elapsed = self.elapsed or 0
+
+        latency = dict(
+            (key, percentile(latencies, p)) for key, p in PERCENTILES
+        )
+        latency.update({
+            'min': latencies[0] if latencies else None,
+            'max': latencies[-1] if latencies else None,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+        })
+
+        return {
+            'addresses': self.addresses,
+            'clients': self.clients,
+            'mix': [
+                {'paradigm': p, 'method': m, 'weight': w}
+                for p, m, w in self.mix
+            ],
+            'duration': elapsed,
+            'requests': self.sent,
+            'completed': len(latencies),
+            'throughput': len(latencies) / elapsed if elapsed else 0,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'busy': self.busy,
+            'latency': latency,
+            'queue': self.depths,
+        }
+
+
+def format_report(report):
+    def ms(value):
+        return '-' if value is None else '{0:.2f}ms'.format(value)
+
+    lines = [
+        'Servers:     {0}'.format(', '.join(report['addresses'])),
+        'Clients:     {0}'.format(report['clients']),
+        'Duration:    {0:.2f}s'.format(report['duration']),
+        'Requests:    {0} ({1} completed, {2} errors, {3} timeouts, '
+        '{4} busy)'.format(
+            report['requests'],
+            report['completed'],
+            report['errors'],
+            report['timeouts'],
+            report['busy'],
+        ),
+        'Throughput:  {0:.1f} req/s'.format(report['throughput']),
+        'Latency:     {0}'.format('  '.join(
+            '{0} {1}'.format(key, ms(report['latency'][key]))
+            for key in ('min', 'p50', 'p90', 'p99', 'p999', 'max')
+        )),
+    ]
+
+    depths = {}
+    for sample in report['queue']:
+        if sample['depth'] is not None:
+            depths.setdefault(sample['address'], []).append(sample['depth'])
+
+    for address in report['addresses']:
+        values = depths.get(address)
+        if values:
+            lines.append('Queue depth: {0} max {1}, last {2}'.format(
+                address, max(values), values[-1]
+            ))
+        else:
+            lines.append('Queue depth: {0} unknown'.format(address))
+
+    return '\n'.join(lines)
+
+
+def setup_parser(subparsers):
+    bench = subparsers.add_parser(
+        'bench',
+        help="Measure throughput and latency of kitten servers"
+    )
+
+    bench.add_argument(
+        'addresses',
+        nargs='*',
+        metavar='<address>',
+        help='Servers to load, default the local one',
+    )
+    bench.add_argument(
+        '--clients',
+        type=int,
+        default=conf.BENCH_CLIENTS,
+        help='Concurrent clients, default {0}'.format(conf.BENCH_CLIENTS),
+    )
+    bench.add_argument(
+        '--duration',
+        type=float,
+        default=conf.BENCH_DURATION,
+        help='Seconds to run for, default {0}'.format(conf.BENCH_DURATION),
+    )
+    bench.add_argument(
+        '--requests',
+        type=int,
+        help='Send this many requests instead of running for --duration',
+    )
+    bench.add_argument(
+        '--mix',
+        type=str,
+        default='node.ping',
+        help="Requests to send, e.g. 'node.ping:3,node.sync:1'",
+    )
+    bench.add_argument(
+        '--interval',
+        type=float,
+        default=conf.BENCH_INTERVAL,
+        help='Seconds between queue depth samples',
+    )
+    bench.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the report as JSON',
+    )
+
+    return execute_parser
+
+
+def execute_parser(ns):
+    addresses = ns.addresses or ['{0}:{1}'.format(conf.ADDRESS, ns.port)]
+
+    bench = Bench(
+        addresses,
+        parse_mix(ns.mix),
+        clients=ns.clients,
+        duration=ns.duration,
+        requests=ns.requests,
+        interval=ns.interval,
+    )
+    report = bench.run()
+
+    if ns.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_report(report))
+
+    return 0 if report['completed'] else 1
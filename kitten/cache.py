@@ -0,0 +1,111 @@
+import copy
+import json
+import time
+import hashlib
+import logbook
+
+from kitten import conf
+from kitten import stats
+from kitten.util import OrderedDict
+
+
+class ResponseCache(object):
+    """
+    LRU cache of paradigm responses
+
+    Responses are keyed by paradigm, method and a hash of the rest of the
+    request, and kept for as long as the paradigm said when it opted the
+    method in. At most `size` responses are kept; the least recently used
+    one goes first.
+
+    Whatever the responses are computed from can change under them, so the
+    code that changes it calls invalidate(). A response that was computed
+    while the cache was invalidated is not stored, as it might be from
+    before the change.
+
+    Every process has a cache of its own, and invalidate() only empties the
+    one of the process it is called in. For changes made anywhere else, the
+    time a response is kept for is what bounds how stale it can get.
+
+    """
+
+    log = logbook.Logger('ResponseCache')
+
+    def __init__(self, size=None):
+        self.size = conf.RESPONSE_CACHE_SIZE if size is None else size
+
+        # key => (expiry timestamp, response), least recently used first
+        self.items = OrderedDict()
+
+        # Bumped by every invalidate()
+        self.generation = 0
+
+        self.metrics = stats.get('cache')
+
+    def __len__(self):
+        return len(self.items)
+
+    def key(self, request):
+        payload = dict(
+            (key, value) for key, value in request.items()
+            if key not in ('id', 'paradigm', 'method')
+        )
+        digest = hashlib.sha1(
+            json.dumps(payload, sort_keys=True, separators=(',', ':'))
+            .encode('utf-8')
+        ).hexdigest()
+
+        return (request['paradigm'], request['method'], digest)
+
+    def get(self, key):
+        """
+        Get a copy of a cached response, or None
+
+        """
+
+        item = self.items.pop(key, None)
+        if item is not None and item[0] <= time.time():
+            self.metrics.incr('expired')
+            item = None
+
+        if item is None:
+            self.metrics.incr('misses')
+            self.publish()
+            return None
+
+        # Back on the end as the most recently used
+        self.items[key] = item
+        self.metrics.incr('hits')
+
+        return copy.deepcopy(item[1])
+
+    def put(self, key, response, ttl, generation=None):
+        if generation is not None and generation != self.generation:
+            # Computed from data that has changed since
+            return False
+
+        self.items.pop(key, None)
+        self.items[key] = (time.time() + ttl, copy.deepcopy(response))
+
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+            self.metrics.incr('evictions')
+
+        self.publish()
+        return True
+
+    def invalidate(self):
+        if self.items:
+            self.log.debug('Dropping {0} cached responses', len(self.items))
+
+        self.items.clear()
+        self.generation += 1
+        self.metrics.incr('invalidations')
+        self.publish()
+
+    def publish(self):
+        self.metrics.set('size', len(self.items))
+
+
+# Shared by all requests in the process
+responses = ResponseCache()
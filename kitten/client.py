@@ -1,56 +1,617 @@
-import json
+import time
+import uuid
+import random
+import itertools
 import logbook
 import zmq.green as zmq
 
+import gevent
+from gevent.event import AsyncResult
+
+from kitten import conf
+from kitten import heartbeat
+from kitten import stats
+from kitten import wire
+from kitten.pool import context
+from kitten.pool import SocketPool
 from kitten.request import RequestError
+from kitten.request import budget
+from kitten.util import OrderedDict
+
+
+def busy_error(response):
+    """
+    Turn a BUSY reply into a RequestError, or None for any other reply
+
+    """
+
+    if response.get('code') != 'BUSY':
+        return None
+
+    return RequestError(
+        'BUSY',
+        response.get('message', 'Server busy'),
+        response.get('retry_after'),
+    )
+
+
+class DealerConnection(object):
+    """
+    Asynchronous connection to a single peer
+
+    Any number of requests can be outstanding at once. Replies are matched to
+    their request by the `id.uuid` field. Peers that do not echo the uuid
+    answer in order (a REP socket can only do so), so such replies go to the
+    oldest outstanding request instead.
+
+    """
+
+    log = logbook.Logger('DealerConnection')
+
+    def __init__(self, address, idle=None):
+        self.address = address
+        self.idle = conf.CLIENT_POOL_IDLE if idle is None else idle
+        self.closed = False
+
+        # uuid => AsyncResult, oldest first
+        self.pending = OrderedDict()
+
+        # Whether the peer has shown that it echoes uuids. Until it has, a
+        # timeout makes in-order matching unsafe; see expire().
+        self.echoes = False
+
+        self.socket = context().socket(zmq.DEALER)
+        self.socket.connect('tcp://{0}'.format(address))
+        self.reader = gevent.spawn(self.read_forever)
+
+    def send(self, request, timeout, codec=None):
+        # Copy so that the uuid is not written into the caller's request.
+        request = dict(request)
+        request['id'] = dict(request.get('id', {}))
+        key = request['id'].setdefault('uuid', str(uuid.uuid4()))
+
+        result = AsyncResult()
+        self.pending[key] = result
+
+        timer = gevent.spawn_later(timeout / 1000.0, self.expire, key, timeout)
+        result.rawlink(lambda _: timer.kill(block=False))
+
+        wire.send(self.socket, request, codec, [b''])
+        return result
+
+    def read_forever(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+
+        try:
+            while not self.closed:
+                if not poller.poll(self.idle * 1000):
+                    if not self.pending:
+                        self.log.debug('Closing idle connection to {0}',
+                                       self.address)
+                        self.close()
+                    continue
+
+                self.receive()
+
+        except Exception as e:
+            # Without a reader nothing sent on here gets a reply. Close, so
+            # that the next request gets a new connection.
+            self.log.exception('Reader for {0} died', self.address)
+            self.close(RequestError('CLOSED', str(e)))
+
+    def receive(self):
+        try:
+            response = wire.recv(self.socket, routed=True).data
+        except zmq.ZMQError:
+            raise
+        except Exception:
+            # Nothing in it can be trusted to match it to its request, which
+            # is left to time out. The connection itself is fine.
+            self.log.exception('Dropping undecodable reply from {0}',
+                               self.address)
+            return
+
+        self.resolve(response)
+
+    def resolve(self, response):
+        key = response.get('id', {}).get('uuid')
+        error = busy_error(response)
+
+        if key is not None:
+            self.echoes = True
+            result = self.pending.pop(key, None)
+            if result is None:
+                self.log.warning('Dropping late reply {0}', key)
+                return
+        elif self.pending:
+            _, result = self.pending.popitem(last=False)
+        else:
+            self.log.warning('Dropping unexpected reply {0}', response)
+            return
+
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set(response)
+
+    def expire(self, key, timeout):
+        result = self.pending.pop(key, None)
+        if result is None:
+            return
+
+        msg = 'Timeout after {0}ms'.format(timeout)
+        self.log.error(msg)
+        result.set_exception(RequestError('TIMEOUT', msg))
+
+        if not self.echoes:
+            # The late reply would be matched to the wrong request. Start
+            # over on a fresh connection instead.
+            self.close(RequestError('TIMEOUT', 'Connection reset'))
+
+    def close(self, error=None):
+        self.closed = True
+        if self.reader is not gevent.getcurrent():
+            self.reader.kill(block=False)
+        self.socket.close(linger=0)
+
+        error = error or RequestError('CLOSED', 'Connection closed')
+        while self.pending:
+            _, result = self.pending.popitem(last=False)
+            result.set_exception(error)
+
+
+class RoundTripEstimator(object):
+    """
+    Round trip time estimate for one peer
+
+    Keeps a smoothed round trip time and its variance the way TCP does (RFC
+    6298) and derives a timeout from them. All values are in milliseconds.
+
+    """
+
+    alpha = 1 / 8.0
+    beta = 1 / 4.0
+
+    def __init__(self, initial, minimum=None, maximum=None):
+        self.minimum = conf.CLIENT_TIMEOUT_MIN if minimum is None else minimum
+        self.maximum = conf.CLIENT_TIMEOUT_MAX if maximum is None else maximum
+
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar += self.beta * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.alpha * (rtt - self.srtt)
+
+        self.timeout = self.clamp(self.srtt + 4 * self.rttvar)
+
+    def backoff(self):
+        """
+        Double the timeout after a timeout, until a new sample arrives
+
+        """
+
+        self.timeout = self.clamp(self.timeout * 2)
+
+    def clamp(self, timeout):
+        return max(self.minimum, min(self.maximum, timeout))
+
+    def as_dict(self):
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'timeout': self.timeout,
+        }
 
 
 class KittenClient(object):
     log = logbook.Logger('KittenClient')
+
+    # Initial timeout for peers that have no round trip estimate yet
     timeout = 2000
+    retries = conf.CLIENT_RETRIES
+    backoff = conf.CLIENT_BACKOFF
+
+    # Shared by all clients in the process
+    pool = SocketPool(zmq.REQ)
+    dealers = {}
+    estimators = {}
+
+    # What peers have said they can decode; address => (time they said so,
+    # parsed wire.formats() or None for plain JSON only).
+    speaks = {}
+
+    # Replies from peers that could not decode what they were sent
+    rejected = (
+        'BAD_FRAMES',
+        'BAD_HEADER',
+        'UNKNOWN_CODEC',
+        'UNKNOWN_COMPRESSION',
+    )
+
+    # Heartbeats; address => time a beat to it last went unanswered
+    beats = SocketPool(zmq.REQ)
+    silent = {}
+
+    # Heartbeats skip the queue, so their round trips say nothing about how
+    # long requests take. They are estimated apart.
+    beat_estimators = {}
+    sequence = itertools.count(1)
+    metrics = stats.get('heartbeat')
 
     def send(self, address, request):
+        """
+        Send a request and wait for the reply
+
+        A request that times out is retried up to `retries` times on a fresh
+        socket after a jittered exponential backoff ("lazy pirate"). This
+        means that a peer might see a request more than once.
+
+        A peer that is too busy to take the request answers BUSY. Those are
+        retried as well, but not before the time the peer asked for.
+
+        A peer that rejects a message in conf.CODEC after all is sent it again
+        in plain JSON right away.
+
+        """
+
         self.log.info('Sending request on {1}: {0}', request, address)
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.wait(attempt, error.retry_after)
+                self.log.warning(
+                    'Retrying request on {0} ({1}/{2})',
+                    address, attempt, self.retries,
+                )
+
+            # Outside the try: once the deadline has passed, retrying is
+            # pointless.
+            stamped = self.stamp(request)
+
+            try:
+                return self.attempt(address, stamped)
+            except RequestError as e:
+                if e.code not in ('TIMEOUT', 'BUSY'):
+                    raise
+                error = e
+
+        raise error
+
+    def attempt(self, address, request):
+        estimator = self.get_estimator(address)
+        timeout = estimator.timeout
+        codec = self.codec(address)
         socket = self.connect(address)
-        socket.send_json(request)
-        self.log.info('Waiting for reply')
 
-        events = self.poll_reply(socket)
+        try:
+            start = time.time()
+            wire.send(socket, request, codec)
+            self.log.info('Waiting for reply')
+
+            events = self.poll_reply(socket, timeout)
+
+            if not events:
+                estimator.backoff()
+                msg = 'Timeout after {0}ms'.format(int(timeout))
+                self.log.error(msg)
+                raise RequestError('TIMEOUT', msg)
 
-        if not events:
-            msg = 'Timeout after {0}ms'.format(self.timeout)
-            self.log.error(msg)
-            self.close(socket)
-            raise RequestError('TIMEOUT', msg)
+            response = wire.recv(events[0][0]).data
 
-        # TODO: Can JSON events come in multiparts? Probably not?
-        response = events[0][0].recv_json()
+        except Exception:
+            # The REQ socket is stuck waiting for a reply that might never
+            # come, or broken in some other way. Never hand it out again.
+            self.pool.discard(socket)
+            raise
 
+        estimator.sample((time.time() - start) * 1000)
         self.log.info(response)
-        self.close(socket)
+        self.close(address, socket)
+
+        if codec is not None and response.get('code') in self.rejected:
+            # It said it could decode it. No point in waiting to find out if
+            # plain JSON works instead.
+            self.fall_back(address, response.get('message'))
+            return self.attempt(address, request)
+
+        error = busy_error(response)
+        if error is not None:
+            self.log.warning('{0} is busy', address)
+            raise error
 
         return response
 
-    def close(self, socket):
-        socket.close()
+    def stamp(self, request):
+        """
+        Pass on what is left of the deadline of the request being handled
 
-        # TODO: Figure out why destroying the context makes the application
-        # hang indefinetely.
-        # self.context.destroy()
-        # del self.context
+        Requests that already have a ttl are left alone. If less than a
+        millisecond is left, there is no point in sending anything; it would
+        go out as a ttl of zero and expire on arrival.
 
-    def connect(self, address):
-        self.context = zmq.Context()
-        socket = self.context.socket(zmq.REQ)
+        """
+
+        remaining = budget()
+        if remaining is None or 'ttl' in request.get('id', {}):
+            return request
 
-        host = 'tcp://{0}'.format(address)
-        socket.connect(host)
+        if remaining < 1:
+            raise RequestError('TIMEOUT', 'Deadline passed before sending')
 
-        return socket
+        request = dict(request)
+        request['id'] = dict(request.get('id', {}), ttl=int(remaining))
 
-    def poll_reply(self, socket):
+        return request
+
+    def codec(self, address):
+        """
+        Codec to send to a peer in; None for plain JSON
+
+        Peers only get anything else once they have listed the codec in a
+        heartbeat. Older kittens stop answering altogether when they get a
+        message they cannot decode, so it is never tried on them. Peers that
+        have not said anything yet are sent a heartbeat first.
+
+        """
+
+        codec = wire.default_codec()
+        if codec is None:
+            return None
+
+        known = self.speaks.get(address)
+        if known is None or time.time() - known[0] >= conf.CODEC_RETRY:
+            known = self.probe(address)
+
+        if not wire.accepts(known[1], codec):
+            return None
+
+        return codec
+
+    def probe(self, address):
+        try:
+            pong = self.heartbeat(address)
+        except Exception:
+            self.log.exception('Asking {0} for its codecs failed', address)
+            pong = None
+
+        formats = None if pong is None else wire.parse_formats(pong.formats)
+        known = self.speaks[address] = (time.time(), formats)
+
+        return known
+
+    def fall_back(self, address, reason=None):
+        self.log.warning(
+            'Sending plain JSON to {0} for {1}s: {2}',
+            address, conf.CODEC_RETRY, reason,
+        )
+        self.speaks[address] = (time.time(), None)
+
+    def wait(self, attempt, retry_after=None):
+        delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+        gevent.sleep(max(delay, retry_after or 0) / 1000.0)
+
+    def get_estimator(self, address, estimators=None):
+        if estimators is None:
+            estimators = self.estimators
+
+        estimator = estimators.get(address)
+        if estimator is None:
+            estimator = RoundTripEstimator(self.timeout)
+            estimators[address] = estimator
+
+        return estimator
+
+    def get_timeout(self, address):
+        return self.get_estimator(address).timeout
+
+    def estimates(self):
+        """
+        Current round trip estimates and timeouts, per address
+
+        """
+
+        return dict(
+            (address, estimator.as_dict())
+            for address, estimator in self.estimators.items()
+        )
+
+    def close(self, address, socket):
+        self.pool.release(address, socket)
+
+    def connect(self, address):
+        return self.pool.acquire(address)
+
+    def poll_reply(self, socket, timeout=None):
         poller = zmq.Poller()
         poller.register(socket, zmq.POLLIN)
-        events = poller.poll(self.timeout)
+        events = poller.poll(timeout or self.timeout)
 
         return events
+
+    def heartbeat(self, address):
+        """
+        Send a heartbeat to a node over its dedicated heartbeat port
+
+        Returns a heartbeat.Pong with the latency in milliseconds and the
+        queue depth of the node, or None if the node did not answer. Nodes
+        that do not answer are not tried again for conf.HEARTBEAT_RETRY
+        seconds, since they likely run a kitten without heartbeat support.
+
+        """
+
+        silent = self.silent.get(address)
+        if silent is not None and time.time() - silent < conf.HEARTBEAT_RETRY:
+            return None
+
+        sequence = next(self.sequence) % 2 ** 32
+
+        estimator = self.get_estimator(address, self.beat_estimators)
+        timeout = min(estimator.timeout, conf.HEARTBEAT_TIMEOUT)
+
+        target = heartbeat.address(address)
+        socket = self.beats.acquire(target)
+
+        try:
+            socket.send(heartbeat.ping(sequence))
+            events = self.poll_reply(socket, timeout)
+            pong = events and heartbeat.parse(events[0][0].recv(), sequence)
+        except Exception:
+            self.beats.discard(socket)
+            raise
+
+        if not pong:
+            self.log.warning('No heartbeat from {0}', address)
+            self.beats.discard(socket)
+            self.metrics.incr('silent')
+            self.silent[address] = time.time()
+            return None
+
+        self.beats.release(target, socket)
+        self.silent.pop(address, None)
+
+        estimator.sample(pong.latency)
+        self.metrics.incr('beats')
+        self.metrics.incr('latency', pong.latency)
+
+        return pong
+
+    def send_async(self, address, request, timeout=None):
+        """
+        Send a request without waiting for the reply
+
+        Returns an AsyncResult that is set to the response, or to a
+        RequestError if no reply arrived within `timeout` milliseconds.
+
+        """
+
+        connection = self.dealers.get(address)
+        if connection is None or connection.closed:
+            connection = DealerConnection(address)
+            self.dealers[address] = connection
+
+        self.log.info('Sending async request on {1}: {0}', request, address)
+        request = self.stamp(request)
+
+        start = time.time()
+        estimator = self.get_estimator(address)
+        codec = self.codec(address)
+        result = connection.send(request, timeout or estimator.timeout, codec)
+
+        def measure(result):
+            if not result.successful():
+                return
+
+            estimator.sample((time.time() - start) * 1000)
+
+            response = result.value
+            if codec is not None and response.get('code') in self.rejected:
+                self.fall_back(address, response.get('message'))
+
+        result.rawlink(measure)
+        return result
+
+    def send_many(self, requests, timeout=None):
+        """
+        Send (address, request) pairs concurrently
+
+        Returns AsyncResults in the same order. Waiting on all of them takes
+        as long as the slowest peer rather than the sum of all of them.
+
+        """
+
+        return [
+            self.send_async(address, request, timeout)
+            for address, request in requests
+        ]
+
+
+class Batcher(object):
+    """
+    Collect calls to the same peer and send them as one batch request
+
+    Calls made within `window` milliseconds of the first one, or until
+    `limit` calls have piled up, go out together in the 'batch' field of a
+    single request. Each caller gets an AsyncResult for its own response.
+
+    """
+
+    log = logbook.Logger('Batcher')
+
+    def __init__(self, client=None, window=None, limit=None):
+        self.client = client or KittenClient()
+        self.window = conf.BATCH_WINDOW if window is None else window
+        self.limit = conf.BATCH_SIZE if limit is None else limit
+
+        # address => [(request, AsyncResult)]
+        self.queued = {}
+        self.timers = {}
+
+    def send(self, address, request):
+        result = AsyncResult()
+        queue = self.queued.setdefault(address, [])
+        queue.append((request, result))
+
+        if len(queue) >= self.limit:
+            self.flush(address)
+        elif address not in self.timers:
+            self.timers[address] = gevent.spawn_later(
+                self.window / 1000.0, self.flush, address
+            )
+
+        return result
+
+    def flush(self, address):
+        timer = self.timers.pop(address, None)
+        if timer is not None and timer is not gevent.getcurrent():
+            timer.kill(block=False)
+
+        queue = self.queued.pop(address, None)
+        if queue:
+            gevent.spawn(self.deliver, address, queue)
+
+    def flush_all(self):
+        for address in list(self.queued):
+            self.flush(address)
+
+    def deliver(self, address, queue):
+        self.log.debug('Sending batch of {0} to {1}', len(queue), address)
+        batch = {
+            'batch': [request for request, _ in queue],
+        }
+
+        try:
+            response = self.client.send(address, batch)
+        except Exception as e:
+            for _, result in queue:
+                result.set_exception(e)
+            return
+
+        responses = response.get('batch')
+
+        if responses is None:
+            # The peer answered the batch as a whole (e.g. with an error, or
+            # with an ack if it does not know about batches), which is then
+            # the answer to every call in it.
+            responses = [response] * len(queue)
+
+        elif len(responses) != len(queue):
+            error = RequestError(
+                'BATCH_MISMATCH',
+                'Sent {0} calls, got {1} responses'.format(
+                    len(queue), len(responses)
+                )
+            )
+            for _, result in queue:
+                result.set_exception(error)
+            return
+
+        for (_, result), item in zip(queue, responses):
+            result.set(item)
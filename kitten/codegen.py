@@ -0,0 +1,240 @@
+"""
+Generated Python checks for message schemas
+
+jsonschema interprets a schema anew for every message it validates, which
+is most of the cost for messages as small as ours. build() turns a schema
+into the source of a plain function that checks a message in one
+expression, the way fastjsonschema does.
+
+The generated checks only answer "definitely valid". Whenever they say no,
+the message goes through jsonschema, which makes the final call and raises
+the error. That way the errors are always jsonschema's own, and the
+checks only need to be exact for the messages that pass.
+
+Only the keywords that kitten schemas use are supported. build() returns
+None for schemas with anything else in them, and those are left to
+jsonschema altogether.
+
+"""
+
+import numbers
+import logbook
+
+try:
+    string_types = (str, unicode)  # noqa
+except NameError:  # pragma: nocover
+    string_types = (str,)
+
+log = logbook.Logger('Codegen')
+
+# Keywords that jsonschema ignores, and so do we. 'optional' is not a
+# keyword at all, but it is used in the core schema.
+IGNORED = (
+    'optional',
+    'title',
+    'description',
+    'default',
+    'examples',
+    '$comment',
+)
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Generator(object):
+    """
+    Builds the check expression for one schema
+
+    Constants like enum values and property names are put in the namespace
+    of the generated function instead of being written out in the source,
+    so that they are built once.
+
+    """
+
+    def __init__(self):
+        self.namespace = {
+            'Number': numbers.Number,
+            'string_types': string_types,
+        }
+        self.counter = 0
+
+    def constant(self, value):
+        name = 'const{0}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def variable(self):
+        self.counter += 1
+        return 'item{0}'.format(self.counter)
+
+    def expression(self, schema, name):
+        if schema is True or schema == {}:
+            return 'True'
+        if schema is False:
+            return 'False'
+        if not isinstance(schema, dict):
+            raise Unsupported('Schema is not an object: {0!r}'.format(schema))
+
+        checks = []
+        handled = set(IGNORED)
+
+        for keywords, method in self.keywords:
+            if any(keyword in schema for keyword in keywords):
+                method(self, schema, name, checks)
+                handled.update(keywords)
+
+        unknown = set(schema) - handled
+        if unknown:
+            raise Unsupported(
+                'Unsupported keywords: {0}'.format(', '.join(sorted(unknown)))
+            )
+
+        if not checks:
+            return 'True'
+
+        return '({0})'.format(' and '.join(checks))
+
+    def check_type(self, schema, name, checks):
+        types = schema['type']
+        if not isinstance(types, list):
+            types = [types]
+
+        options = []
+        for kind in types:
+            if kind == 'object':
+                options.append('isinstance({0}, dict)')
+            elif kind == 'array':
+                options.append('isinstance({0}, list)')
+            elif kind == 'string':
+                options.append('isinstance({0}, string_types)')
+            elif kind == 'boolean':
+                options.append('isinstance({0}, bool)')
+            elif kind == 'null':
+                options.append('{0} is None')
+            elif kind == 'number':
+                options.append(
+                    '(isinstance({0}, Number) and not isinstance({0}, bool))'
+                )
+            elif kind == 'integer':
+                # Which floats count as integers depends on the draft; those
+                # are left to jsonschema.
+                options.append(
+                    '(isinstance({0}, (int, long_type)) and '
+                    'not isinstance({0}, bool))'
+                )
+            else:
+                raise Unsupported("Unknown type '{0}'".format(kind))
+
+        if 'integer' in types:
+            self.namespace['long_type'] = type(2 ** 64)
+
+        checks.append('({0})'.format(
+            ' or '.join(option.format(name) for option in options)
+        ))
+
+    def check_enum(self, schema, name, checks):
+        values = schema['enum']
+
+        # Equality in jsonschema has its own rules for numbers and booleans,
+        # so only enums of plain strings are done here.
+        if not all(isinstance(value, string_types) for value in values):
+            raise Unsupported('Only enums of strings are supported')
+
+        checks.append('(isinstance({0}, string_types) and {0} in {1})'.format(
+            name, self.constant(frozenset(values))
+        ))
+
+    def check_object(self, schema, name, checks):
+        properties = schema.get('properties', {})
+        required = schema.get('required', [])
+        additional = schema.get('additionalProperties', True)
+
+        # Like jsonschema, these say nothing about things that are not
+        # objects.
+        parts = []
+
+        for key in required:
+            parts.append('{0!r} in {1}'.format(key, name))
+
+        if additional is False:
+            parts.append('all(key in {0} for key in {1})'.format(
+                self.constant(frozenset(properties)), name
+            ))
+        elif additional is not True:
+            raise Unsupported('additionalProperties must be a boolean')
+
+        for key in sorted(properties):
+            value = '{0}[{1!r}]'.format(name, key)
+            expression = self.expression(properties[key], value)
+            if expression != 'True':
+                parts.append('({0!r} not in {1} or {2})'.format(
+                    key, name, expression
+                ))
+
+        if parts:
+            checks.append('(not isinstance({0}, dict) or ({1}))'.format(
+                name, ' and '.join(parts)
+            ))
+
+    def check_items(self, schema, name, checks):
+        items = schema['items']
+        if isinstance(items, list):
+            raise Unsupported('Only a single items schema is supported')
+
+        item = self.variable()
+        expression = self.expression(items, item)
+        if expression != 'True':
+            checks.append(
+                '(not isinstance({0}, list) or '
+                'all({1} for {2} in {0}))'.format(name, expression, item)
+            )
+
+    def check_bounds(self, schema, name, checks):
+        number = '(isinstance({0}, Number) and not isinstance({0}, bool))'
+        number = number.format(name)
+
+        if 'minimum' in schema:
+            checks.append('(not {0} or {1} >= {2!r})'.format(
+                number, name, schema['minimum']
+            ))
+        if 'maximum' in schema:
+            checks.append('(not {0} or {1} <= {2!r})'.format(
+                number, name, schema['maximum']
+            ))
+
+    # Keywords and the method that generates the checks for them
+    keywords = (
+        (('type',), check_type),
+        (('enum',), check_enum),
+        (('properties', 'required', 'additionalProperties'), check_object),
+        (('items',), check_items),
+        (('minimum', 'maximum'), check_bounds),
+    )
+
+
+def build(schema):
+    """
+    Build a function that tells if a message is definitely valid
+
+    Returns None if the schema uses keywords that are not supported.
+
+    """
+
+    generator = Generator()
+    try:
+        expression = generator.expression(schema, 'data')
+    except Unsupported as e:
+        log.debug('Not generating a check: {0}', e)
+        return None
+
+    source = 'def check(data):\n    return {0}\n'.format(expression)
+
+    namespace = generator.namespace
+    exec(compile(source, '<schema>', 'exec'), namespace)
+
+    check = namespace['check']
+    check.source = source
+
+    return check
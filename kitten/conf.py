@@ -7,6 +7,118 @@ DEFAULT_PORT = 5555
 
 ADDRESS = 'localhost'
 
+# Outgoing sockets kept open for reuse, and seconds before an unused one is
+# closed.
+CLIENT_POOL_SIZE = 64
+CLIENT_POOL_IDLE = 60
+
+# Bounds in milliseconds for the adaptive per-peer request timeouts, how many
+# times a timed out request is retried, and the base backoff between tries.
+CLIENT_TIMEOUT_MIN = 200
+CLIENT_TIMEOUT_MAX = 10000
+CLIENT_RETRIES = 3
+CLIENT_BACKOFF = 100
+
+# Heartbeats are answered on the request port plus HEARTBEAT_OFFSET. A beat
+# that gets no answer within HEARTBEAT_TIMEOUT ms falls back to a full ping,
+# and heartbeats to that node are not tried again for HEARTBEAT_RETRY seconds.
+HEARTBEAT_OFFSET = 1000
+HEARTBEAT_TIMEOUT = 500
+HEARTBEAT_RETRY = 300
+
+# Milliseconds that the client Batcher waits for more calls to the same peer,
+# and the most calls that go in one batch.
+BATCH_WINDOW = 5
+BATCH_SIZE = 100
+
+# Codec for outgoing message bodies; see kitten.wire. None sends plain JSON
+# that every kitten version understands. Replies and callbacks use the codec
+# of the request. Requests only go out in CODEC to peers that have listed it
+# in a heartbeat; they are asked on first contact and again after CODEC_RETRY
+# seconds. Peers without a heartbeat port are always sent plain JSON.
+CODEC = None
+CODEC_RETRY = 300
+
+# Bodies of framed messages larger than COMPRESSION_THRESHOLD bytes are
+# compressed with COMPRESSION, or never if it is None.
+COMPRESSION = 'zlib'
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+# Concurrent request handlers in the server. With POOL_ADAPTIVE the pool is
+# resized every POOL_INTERVAL seconds to fit the load, between POOL_MIN and
+# POOL_MAX handlers.
+POOL_SIZE = 5
+POOL_MIN = 2
+POOL_MAX = 100
+POOL_ADAPTIVE = False
+POOL_INTERVAL = 1.0
+
+# Sockets the server keeps open for sending responses back to requesters,
+# seconds before an unused one is closed, and milliseconds to wait for the
+# requester to confirm a response before the socket is given up on.
+CALLBACK_POOL_SIZE = 64
+CALLBACK_POOL_IDLE = 60
+CALLBACK_TIMEOUT = 5000
+
+# Inbound messages that the server listener works on at once. When this many
+# are being received and acked, the listener waits before reading more.
+LISTEN_SIZE = 1000
+
+# Worker processes behind the server port, or 0 to handle everything in the
+# server process itself. The server checks on its workers every
+# WORKER_INTERVAL seconds, restarts the ones that died, and gives them
+# WORKER_TIMEOUT seconds to exit on shutdown.
+WORKERS = 0
+WORKER_INTERVAL = 1.0
+WORKER_TIMEOUT = 5
+
+# Requests that the server holds before it starts answering BUSY, and the
+# milliseconds it then tells clients to wait before trying again.
+QUEUE_SIZE = 1000
+BUSY_RETRY_AFTER = 100
+
+# Paradigms the node serves, by name, as 'module:Class'. Installed packages
+# can add their own under the 'kitten.paradigms' entry point group; these
+# win over those with the same name. Paradigms are imported when the first
+# message for them arrives.
+PARADIGMS = {
+    'node': 'kitten.node:NodeParadigm',
+}
+
+# Priority classes of queued requests and their weights. When several classes
+# have requests waiting, workers take from them in proportion to the weights.
+# Paradigms put their methods in a class with `priorities`; everything else is
+# in the PRIORITY class. QUEUE_SIZE is per class.
+PRIORITIES = {
+    'high': 8,
+    'normal': 4,
+    'low': 1,
+}
+PRIORITY = 'normal'
+
+# How messages are checked against the paradigm schemas: 'full' validates
+# every request and response on both ends, 'boundary' only the ones that come
+# in from peers, 'sample' one in VALIDATION_SAMPLE at random, and 'off' none.
+# Paradigms can set the mode per method with `validation`.
+VALIDATION = 'full'
+VALIDATION_SAMPLE = 100
+
+# Validate messages with Python checks generated from the schemas where
+# possible, instead of having jsonschema interpret the schemas every time.
+# Messages that fail the checks still go through jsonschema for its errors.
+VALIDATION_CODEGEN = True
+
+# Responses that the server keeps for paradigm methods that opt in to
+# caching; see Paradigm.cache.
+RESPONSE_CACHE_SIZE = 1000
+
+# Defaults for `kitten bench`: concurrent clients, seconds to run for, and
+# seconds between queue depth samples.
+BENCH_CLIENTS = 10
+BENCH_DURATION = 10
+BENCH_INTERVAL = 1.0
+
 
 def get_dir(xdg_key, fallback):
     """
@@ -28,6 +140,7 @@ DATA_DIR = get_dir('DATA_HOME', '.local/share')
 CACHE_DIR = get_dir('CACHE_HOME', '.cache')
 LOG_DIR = os.path.join(DATA_DIR, 'logs')
 PIDFILE = os.path.join(CACHE_DIR, 'server-{0}.pid')
+BACKEND = 'ipc://' + os.path.join(CACHE_DIR, 'server-{0}.ipc')
 
 
 def create_dirs():  # pragma: nocover
@@ -37,3 +150,7 @@ def create_dirs():  # pragma: nocover
 
 def pidfile(port):
     return PIDFILE.format(port)
+
+
+def backend(port):
+    return BACKEND.format(port)
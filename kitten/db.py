@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from kitten import cache
 from kitten import conf
 
 Base = declarative_base()
@@ -30,5 +31,6 @@ def setup_core(ns):
     if not session.query(q.exists()).scalar():
         session.add(node.Node(address))
         session.commit()
+        cache.responses.invalidate()
 
     session.close()
@@ -0,0 +1,66 @@
+import time
+import struct
+
+from collections import namedtuple
+
+from kitten import conf
+
+# Kind, sequence number, sender timestamp and the queue depth of the server.
+# The server only flips the kind and fills in its queue depth, so the sender
+# can compute the latency from its own clock. Pongs can carry more after the
+# frame; the server puts the formats it can decode there (see kitten.wire).
+FRAME = struct.Struct('!cIdI')
+
+PING = b'P'
+PONG = b'O'
+
+Pong = namedtuple('Pong', ['latency', 'depth', 'formats'])
+Pong.__new__.__defaults__ = (b'',)
+
+
+def address(address):
+    """
+    The heartbeat address of a node, given its request address
+
+    """
+
+    host, port = address.rsplit(':', 1)
+    return '{0}:{1}'.format(host, int(port) + conf.HEARTBEAT_OFFSET)
+
+
+def ping(sequence):
+    return FRAME.pack(PING, sequence, time.time(), 0)
+
+
+def pong(frame, depth, formats=b''):
+    """
+    Turn a ping frame into the reply to it, or None if it is not a ping
+
+    """
+
+    if len(frame) != FRAME.size:
+        return None
+
+    kind, sequence, sent, _ = FRAME.unpack(frame)
+    if kind != PING:
+        return None
+
+    return FRAME.pack(PONG, sequence, sent, depth) + formats
+
+
+def parse(frame, sequence):
+    """
+    Parse a pong frame into a Pong with the round trip latency in ms
+
+    Returns None if the frame is not the pong to the given ping.
+
+    """
+
+    if len(frame) < FRAME.size:
+        return None
+
+    kind, received, sent, depth = FRAME.unpack_from(frame)
+    if kind != PONG or received != sequence:
+        return None
+
+    return Pong((time.time() - sent) * 1000, depth, bytes(frame[FRAME.size:]))
@@ -7,6 +7,7 @@ from sqlalchemy import DateTime
 from sqlalchemy import Integer
 from sqlalchemy import String
 
+from kitten import cache
 from kitten import conf
 from kitten.db import Session
 from kitten.db import Base
@@ -49,6 +50,17 @@ class NodeValidator(Validator):
 
 class NodeParadigm(Paradigm):
     validator = NodeValidator()
+    coalesce = ('ping',)
+    inline = ('ping',)
+    # Ping requests are answered inline and never wait in the queue. Syncs
+    # do, and are bulk work that the odd ping response from an older kitten
+    # should not wait behind.
+    priorities = {
+        'sync': 'low',
+    }
+
+    # Not cached: syncs create the nodes that the requester knows and this
+    # node does not, which a cached response would skip.
 
     @annotate
     def ping_request(self, request):
@@ -138,6 +150,7 @@ class Node(Base):
         if con.ping():
             session.add(con)
             session.commit()
+            cache.responses.invalidate()
             con.log.info('{0} added.'.format(con))
 
             if sync:
@@ -164,10 +177,16 @@ class Node(Base):
         """
         Send a quick ping heartbeat to the node
 
+        Uses the heartbeat port of the node if it has one, and a full ping
+        request otherwise.
+
         Returns boolean success.
 
         """
 
+        if self.paradigm.client.heartbeat(self.address) is not None:
+            return True
+
         request = self.paradigm.ping_request({})
         response = self.message(request)
         return response['code'] == 'OK'
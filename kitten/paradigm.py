@@ -1,33 +1,154 @@
 import re
+import copy
+import json
+
+from gevent.event import AsyncResult
+
+from kitten import stats
 from kitten.client import KittenClient
+from kitten.request import RequestError
+from kitten.validation import INBOUND
+from kitten.validation import OUTBOUND
+
+
+class ParadigmType(type):
+    """
+    Works out what a paradigm class handles when the class is created
+
+    Sets `name` ('FooParadigm' => 'foo') unless the class has one of its
+    own, and `responders`, which maps every method name to the attribute of
+    its *_response handler. Instances bind the handlers once, so that the
+    server finds the handler for a message with a dict lookup.
+
+    """
+
+    suffix = '_response'
 
+    def __init__(cls, name, bases, attrs):
+        super(ParadigmType, cls).__init__(name, bases, attrs)
 
-class Paradigm(object):
+        if 'name' not in attrs:
+            cls.name = name.lower()[:-8]  # Remove paradigm
+
+        cls.responders = dict(
+            (key[:-len(ParadigmType.suffix)], key)
+            for key in dir(cls)
+            if key.endswith(ParadigmType.suffix)
+            and callable(getattr(cls, key))
+        )
+
+
+# Python 2 and 3 spell metaclasses differently; this works for both.
+ParadigmBase = ParadigmType('ParadigmBase', (object,), {'name': None})
+
+
+class Paradigm(ParadigmBase):
     client = KittenClient()
 
+    # Methods that are safe to coalesce: concurrent identical requests for
+    # them to the same address share the first caller's round trip.
+    coalesce = ()
+
+    # Methods that are quick enough to be answered right away. The server
+    # runs them as soon as they arrive and puts the response in the reply,
+    # instead of acking them and calling back with the response later.
+    inline = ()
+
+    # method => seconds that the server may answer identical calls to it
+    # from its response cache. Only for methods without side effects, as a
+    # cached answer skips the handler. invalidate() only reaches the cache of
+    # its own process, so changes made by other processes (the command line,
+    # the other prefork workers) show up when the seconds run out.
+    cache = {}
+
+    # method => validation mode, see conf.VALIDATION. Methods that are not
+    # listed get conf.VALIDATION.
+    validation = {}
+
+    # method => priority class in the server queue, see conf.PRIORITIES.
+    # Methods that are not listed get conf.PRIORITY.
+    priorities = {}
+
+    # (address, paradigm, method, payload) => AsyncResult, shared by all
+    # paradigms in the process
+    inflight = {}
+    metrics = stats.get('paradigm')
+
     def send(self, address, request):
+        if request.get('method') not in self.coalesce:
+            return self.send_now(address, request)
+
+        key = self.coalesce_key(address, request)
+        pending = self.inflight.get(key)
+
+        if pending is not None:
+            self.metrics.incr('coalesced')
+
+            # Everyone gets a response of their own to change as they like
+            return copy.deepcopy(pending.get())
+
+        pending = self.inflight[key] = AsyncResult()
+        try:
+            response = self.send_now(address, request)
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        except BaseException:
+            # The first caller was interrupted by a gevent.Timeout or a kill
+            # of its own, which the others should not get. They would wait
+            # forever if they got nothing, though.
+            pending.set_exception(RequestError(
+                'INTERRUPTED', 'The request they were sharing was cancelled'
+            ))
+            raise
+        else:
+            pending.set(response)
+            return response
+        finally:
+            del self.inflight[key]
+
+    def send_now(self, address, request):
         paradigms = {self.name: self}
 
-        self.validator.request(request, paradigms)
+        self.validator.request(request, paradigms, OUTBOUND)
         response = self.client.send(address, request)
-        self.validator.response(response, paradigms)
+        self.validator.response(response, paradigms, INBOUND)
 
         return response
 
-    @property
-    def name(self):
-        # 'FooParadigm' => 'foo'
-        return self.__class__.__name__.lower()[:-8]  # Remove paradigm
+    def coalesce_key(self, address, request):
+        # The id differs for every request even if the call is the same.
+        payload = dict(
+            (key, value) for key, value in request.items() if key != 'id'
+        )
+
+        return (
+            address,
+            self.name,
+            request['method'],
+            json.dumps(payload, sort_keys=True),
+        )
+
+    def __init__(self):
+        # method => bound *_response handler
+        self.handlers = dict(
+            (method, getattr(self, key))
+            for method, key in self.responders.items()
+        )
 
 
 def annotate(func):
+    method = re.sub(r'_re(quest|sponse)$', '', func.__name__)
+
     def inner(self, *args):
         ret = func(self, *args)
 
         ret.update({
             'paradigm': self.name,
-            'method': re.sub(r'_re(quest|sponse)$', '', func.__name__),
+            'method': method,
         })
 
         return ret
+
+    inner.__name__ = func.__name__
     return inner
@@ -0,0 +1,129 @@
+import os
+import time
+import logbook
+import zmq.green as zmq
+
+from kitten import conf
+from kitten.util import OrderedDict
+
+_context = None
+_context_pid = None
+
+
+def context():
+    """
+    Get the zmq context shared by the whole process
+
+    A context owns I/O threads, so creating one per socket is expensive and
+    leaking them is worse. The context is recreated after a fork since zmq
+    contexts cannot be shared between processes.
+
+    """
+
+    global _context, _context_pid
+
+    pid = os.getpid()
+    if _context is None or _context_pid != pid:
+        _context = zmq.Context()
+        _context_pid = pid
+
+    return _context
+
+
+def reset():
+    """
+    Forget the shared context
+
+    Mostly useful for tests that patch out zmq.
+
+    """
+
+    global _context, _context_pid
+    _context = None
+    _context_pid = None
+
+
+class SocketPool(object):
+    """
+    Cache of connected sockets, at most one idle socket per address
+
+    Sockets are handed out with acquire() and given back with release(). A
+    socket that is checked out is never handed to anyone else, since REQ
+    sockets cannot be shared between concurrent requests. Sockets that are in
+    an unknown state (e.g. a REQ socket that timed out waiting for a reply)
+    must be given back with discard() so that they are closed instead.
+
+    """
+
+    log = logbook.Logger('SocketPool')
+
+    def __init__(self, kind=zmq.REQ, size=None, idle=None):
+        self.kind = kind
+        self.size = conf.CLIENT_POOL_SIZE if size is None else size
+        self.idle = conf.CLIENT_POOL_IDLE if idle is None else idle
+
+        # address => (socket, last used timestamp), oldest first
+        self.sockets = OrderedDict()
+
+    def __len__(self):
+        return len(self.sockets)
+
+    def acquire(self, address):
+        self.evict()
+
+        item = self.sockets.pop(address, None)
+        if item is not None and not item[0].closed:
+            return item[0]
+
+        return self.connect(address)
+
+    def release(self, address, socket):
+        if address in self.sockets:
+            # Someone else already gave one back while we were busy; there is
+            # no point in keeping two.
+            self.close(socket)
+            return
+
+        self.sockets[address] = (socket, time.time())
+
+        while len(self.sockets) > self.size:
+            _, (old, _) = self.sockets.popitem(last=False)
+            self.close(old)
+
+    def discard(self, socket):
+        self.log.debug('Discarding socket')
+        self.close(socket)
+
+    def evict(self):
+        """
+        Close all sockets that have not been used for `idle` seconds
+
+        """
+
+        limit = time.time() - self.idle
+        for address, (socket, used) in list(self.sockets.items()):
+            if used >= limit:
+                # Ordered by last use, so the rest are fresh as well.
+                break
+
+            self.log.debug('Evicting idle socket to {0}', address)
+            del self.sockets[address]
+            self.close(socket)
+
+    def clear(self):
+        for socket, _ in self.sockets.values():
+            self.close(socket)
+        self.sockets.clear()
+
+    def connect(self, address):
+        if '://' not in address:
+            address = 'tcp://{0}'.format(address)
+
+        socket = context().socket(self.kind)
+        socket.connect(address)
+
+        return socket
+
+    def close(self, socket):
+        # Never linger; pending messages on a dropped socket are garbage.
+        socket.close(linger=0)
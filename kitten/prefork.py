@@ -0,0 +1,244 @@
+import os
+import time
+import errno
+import signal
+import logbook
+import zmq.green as zmq
+
+import gevent
+
+from kitten import conf
+from kitten.server import KittenServer
+
+
+class WorkerServer(KittenServer):
+    """
+    Server in a worker process of a PreforkServer
+
+    Takes its requests from the backend socket of the front process instead
+    of listening on the port itself. The front process owns the port, the
+    heartbeat port and the pidfile.
+
+    """
+
+    heartbeats = False
+
+    def __init__(self, ns, backend, index=0):
+        super(WorkerServer, self).__init__(ns)
+        self.backend = backend
+
+        self.log = logbook.Logger(
+            'Worker-{0}-{1}'.format(self.ns.port, index)
+        )
+
+    def get_listener(self):
+        return self.get_socket(zmq.ROUTER, self.backend, bind=False)
+
+    def setup(self):
+        self.setup_signals()
+
+    def teardown_pidfile(self):
+        pass
+
+
+class PreforkServer(KittenServer):
+    """
+    Front process that spreads requests over `workers` worker processes
+
+    The front owns the public port and relays every message to a DEALER
+    socket on conf.backend(port), which hands them out to the workers in
+    turn. Replies find their way back through the envelopes. Workers that
+    die are restarted, and all of them are stopped when the front process
+    is.
+
+    """
+
+    def __init__(self, ns, workers):
+        super(PreforkServer, self).__init__(ns)
+        self.workers = workers
+        self.backend = conf.backend(self.ns.port)
+
+        # pid => worker index
+        self.children = {}
+
+        # Messages handed to the workers that have not been answered yet
+        self.inflight = 0
+
+        self.supervisor = None
+        self.stopping = False
+
+        self.log = logbook.Logger('Front-{0}'.format(self.ns.port))
+
+    def start(self):
+        self.setup()
+
+        # Fork before there is anything in the front process that the
+        # workers could inherit.
+        for index in range(self.workers):
+            self.spawn_worker(index)
+
+        self.listener = gevent.spawn(self.listen_forever)
+        self.heartbeat = gevent.spawn(self.heartbeat_forever)
+        self.supervisor = gevent.spawn(self.supervise_forever)
+
+        return self.listener
+
+    def spawn_worker(self, index):
+        pid = gevent.fork()
+        if pid == 0:  # pragma: nocover
+            self.run_worker(index)
+
+        self.log.info('Started worker {0} with pid {1}', index, pid)
+        self.children[pid] = index
+
+        return pid
+
+    def run_worker(self, index):
+        """
+        Body of a worker process; never returns
+
+        """
+
+        code = 0
+        try:
+            # The front process came along in the fork. Nothing in here may
+            # tear it down: that would stop the other workers and remove the
+            # pidfile of the front.
+            self.torn = True
+
+            # Neither may its greenlets touch its sockets. Restarted workers
+            # are forked from the supervisor, which keeps running here until
+            # the worker is done.
+            current = gevent.getcurrent()
+            inherited = (self.listener, self.heartbeat, self.supervisor)
+            gevent.killall([
+                greenlet for greenlet in inherited
+                if greenlet is not None and greenlet is not current
+            ], block=False)
+
+            server = WorkerServer(self.ns, self.backend, index)
+            server.start().join()
+
+        except SystemExit as e:
+            code = e.code or 0
+
+        except BaseException:
+            self.log.exception('Worker {0} died', index)
+            code = 1
+
+        finally:
+            os._exit(code)
+
+    def listen_forever(self):
+        frontend = backend = None
+        try:
+            frontend = self.get_listener()
+            backend = self.get_socket(zmq.DEALER, self.backend, bind=True)
+
+            poller = zmq.Poller()
+            poller.register(frontend, zmq.POLLIN)
+            poller.register(backend, zmq.POLLIN)
+
+            while self.relay(poller, frontend, backend):
+                pass
+
+        except Exception:
+            self.log.exception('Front died.')
+
+        finally:
+            if not self.forked():
+                for socket in (frontend, backend):
+                    if socket is not None:
+                        socket.close(linger=0)
+                self.teardown()
+
+    def relay(self, poller, frontend, backend):
+        """
+        Pass on whatever arrived on either side
+
+        """
+
+        for socket, _ in poller.poll():
+            frames = socket.recv_multipart(copy=False)
+
+            if socket is frontend:
+                backend.send_multipart(frames, copy=False)
+                self.inflight += 1
+            else:
+                frontend.send_multipart(frames, copy=False)
+                self.inflight = max(0, self.inflight - 1)
+
+        return True
+
+    def depth(self):
+        return self.inflight
+
+    def supervise(self):
+        """
+        Restart workers that have died
+
+        """
+
+        for pid in list(self.children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                done = pid
+
+            if not done or self.stopping:
+                continue
+
+            index = self.children.pop(pid)
+            self.log.error(
+                'Worker {0} (pid {1}) died. Restarting.', index, pid
+            )
+            self.metrics.incr('restarts')
+            self.spawn_worker(index)
+
+    def supervise_forever(self):
+        while True:
+            gevent.sleep(conf.WORKER_INTERVAL)
+            self.supervise()
+
+    def teardown_workers(self):
+        self.stopping = True
+        if self.supervisor is not None:
+            self.supervisor.kill(block=False)
+
+        self.log.info('Stopping {0} workers', len(self.children))
+        self.signal_workers(signal.SIGTERM)
+
+        deadline = time.time() + conf.WORKER_TIMEOUT
+        while self.children and time.time() < deadline:
+            self.reap()
+            if self.children:
+                gevent.sleep(0.1)
+
+        if self.children:
+            self.log.warning(
+                'Killing {0} workers that did not stop', len(self.children)
+            )
+            self.signal_workers(signal.SIGKILL)
+            while self.children:
+                self.reap(block=True)
+
+        return True
+
+    def signal_workers(self, sig):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+
+    def reap(self, block=False):
+        for pid in list(self.children):
+            try:
+                done, _ = os.waitpid(pid, 0 if block else os.WNOHANG)
+            except OSError:
+                done = pid
+
+            if done:
+                del self.children[pid]
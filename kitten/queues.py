@@ -0,0 +1,119 @@
+import time
+import collections
+
+from gevent.event import Event
+from gevent.queue import Full
+
+from kitten import conf
+from kitten import stats
+
+
+class RequestQueue(object):
+    """
+    Server queue with a FIFO per priority class
+
+    `classes` maps class names to weights. When more than one class has
+    requests waiting, get() takes from them in proportion to their weights
+    (smooth weighted round robin), so a burst in one class slows the others
+    down instead of starving them.
+
+    Every class holds at most `maxsize` requests. The class of an item is its
+    `priority` attribute; items without one, or with a class that is not
+    configured, go in the `default` class.
+
+    """
+
+    def __init__(self, classes=None, maxsize=None, default=None):
+        classes = conf.PRIORITIES if classes is None else classes
+
+        self.weights = dict(classes)
+        self.maxsize = conf.QUEUE_SIZE if maxsize is None else maxsize
+        self.default = conf.PRIORITY if default is None else default
+
+        if self.default not in self.weights:
+            raise ValueError(
+                "Default class '{0}' is not one of {1}".format(
+                    self.default, ', '.join(sorted(self.weights))
+                )
+            )
+
+        self.queues = dict((name, collections.deque()) for name in classes)
+        self.current = dict((name, 0) for name in classes)
+
+        # Set whenever there is something to get
+        self.ready = Event()
+
+        self.metrics = stats.get('queue')
+        self.publish()
+
+    def classify(self, item):
+        name = getattr(item, 'priority', None)
+        if name not in self.weights:
+            return self.default
+
+        return name
+
+    def put_nowait(self, item):
+        name = self.classify(item)
+        queue = self.queues[name]
+
+        if self.maxsize and len(queue) >= self.maxsize:
+            self.metrics.incr('{0}_full'.format(name))
+            raise Full
+
+        queue.append((time.time(), item))
+        self.metrics.set('{0}_depth'.format(name), len(queue))
+        self.ready.set()
+
+    # Nothing ever waits for room in the queue; a full class is answered
+    # with BUSY instead.
+    put = put_nowait
+
+    def get(self):
+        while not self.qsize():
+            self.ready.clear()
+            self.ready.wait()
+
+        name = self.choose()
+        queue = self.queues[name]
+
+        queued, item = queue.popleft()
+        self.metrics.set('{0}_depth'.format(name), len(queue))
+        self.metrics.incr('{0}_dequeued'.format(name))
+        self.metrics.incr('{0}_wait'.format(name), time.time() - queued)
+
+        return item
+
+    def choose(self):
+        """
+        Pick the class to take the next request from
+
+        Every class with requests waiting earns its weight in credit, and the
+        one with the most credit is picked and pays back the weights of all
+        of them. Over time each class is picked in proportion to its weight,
+        with the picks spread out evenly.
+
+        """
+
+        waiting = [name for name in sorted(self.queues) if self.queues[name]]
+
+        for name in waiting:
+            self.current[name] += self.weights[name]
+
+        name = max(waiting, key=lambda name: self.current[name])
+        self.current[name] -= sum(self.weights[n] for n in waiting)
+
+        return name
+
+    def qsize(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def empty(self):
+        return not self.qsize()
+
+    def depths(self):
+        return dict((name, len(queue)) for name, queue in self.queues.items())
+
+    def publish(self):
+        for name, depth in self.depths().items():
+            self.metrics.set('{0}_depth'.format(name), depth)
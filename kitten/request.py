@@ -1,28 +1,61 @@
+import time
+import numbers
 import jsonschema
 import logbook
 import datetime
 
+from gevent.local import local
+
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import Text
 
+from kitten import cache
+from kitten import conf
+from kitten import wire
 from kitten.db import Base
 from kitten.db import Session
 from kitten.util import AutoParadigmMixin
+from kitten.validation import INBOUND
+from kitten.validation import OUTBOUND
 from kitten.validation import Validator
 
 
 class RequestError(Exception):
-    def __init__(self, code, message):
+    def __init__(self, code, message, retry_after=None):
         self.code = code
         self.message = message
 
+        # Milliseconds the peer asked us to wait before trying again
+        self.retry_after = retry_after
+
     def __str__(self):  # pragma: nocover
         return "{0}: {1}".format(self.code, self.message)
 
 
+# Deadline of the request that the current greenlet is handling
+_current = local()
+
+
+def budget():
+    """
+    Milliseconds left until the deadline of the request being handled
+
+    None if that request has no deadline, or if no request is being handled.
+    Handlers can use this to cut their work short, and the client passes it
+    on to the requests they send.
+
+    """
+
+    deadline = getattr(_current, 'deadline', None)
+    if deadline is None:
+        return None
+
+    return max(0, (deadline - time.time()) * 1000)
+
+
 class KittenRequestItem(Base):
     __tablename__ = 'request'
 
@@ -33,24 +66,160 @@ class KittenRequestItem(Base):
     created = Column(DateTime, default=datetime.datetime.now)
 
 
+def valid_ttl(ttl):
+    """
+    Whether a ttl sent by a peer is a usable number of milliseconds
+
+    """
+
+    if isinstance(ttl, bool) or not isinstance(ttl, numbers.Number):
+        return False
+    return ttl >= 0
+
+
 class KittenRequest(AutoParadigmMixin):
     log = logbook.Logger('KittenRequest')
     validator = Validator()
+    responses = cache.responses
+
+    # (kind, phase) => name of the method that processes it
+    phases = {
+        ('request', 'payload'): 'process_request_payload',
+        ('request', 'ack'): 'process_request_ack',
+        ('response', 'payload'): 'process_response_payload',
+        ('response', 'ack'): 'process_response_ack',
+    }
 
     def __init__(self, request):
-        self.request = request
+        # Requests straight off the wire only have their header decoded. The
+        # payload is decoded the first time self.request is accessed.
+        if not isinstance(request, wire.Message):
+            request = wire.Message.from_data(request)
+
+        self.message = request
         self.response = None
 
+        # Set by the server when the response goes in the first reply, but
+        # the request still waits its turn in the queue; see settle().
+        self.reply = None
+
+        # Deadlines count from when the request got here, so that the clocks
+        # of the peers do not need to agree.
+        self.received = time.time()
+
     def __eq__(self, other):
         return self.request == other.request
 
+    @property
+    def request(self):
+        return self.message.data
+
+    @property
+    def header(self):
+        return self.message.header
+
+    # Plain calls, like the ones Node.ping sends, carry no or only part of
+    # the id. They are requests in the payload phase.
+
     @property
     def kind(self):
-        return self.request['id']['kind']
+        return self.header.get('id', {}).get('kind', 'request')
 
     @property
     def phase(self):
-        return self.request['id']['phase']
+        return self.header.get('id', {}).get('phase', 'payload')
+
+    @property
+    def batch(self):
+        """
+        Whether the request is a batch of calls, as the Batcher sends them
+
+        Batches have no paradigm of their own, which is what gives them away.
+
+        """
+
+        return 'paradigm' not in self.header and 'batch' in self.request
+
+    @property
+    def calls(self):
+        """
+        Headers of the calls in the request; one unless it is a batch
+
+        """
+
+        if not self.batch:
+            return [self.header]
+
+        batch = self.request['batch']
+        if not isinstance(batch, list):
+            return []
+
+        return [call if isinstance(call, dict) else {} for call in batch]
+
+    def listed(self, call, attribute, default):
+        paradigm = self.paradigms.get(call.get('paradigm'))
+        return getattr(paradigm, attribute, default)
+
+    @property
+    def inline(self):
+        """
+        Whether the request should be answered in the first reply
+
+        Only requests in the payload phase whose paradigm lists the method as
+        inline qualify. Decided from the header alone, except for batches,
+        which qualify when every call in them does.
+
+        """
+
+        if (self.kind, self.phase) != ('request', 'payload'):
+            return False
+
+        return all(
+            call.get('method') in self.listed(call, 'inline', ())
+            for call in self.calls
+        )
+
+    @property
+    def deadline(self):
+        """
+        Time after which the sender no longer wants the response
+
+        Requests carry their time to live in milliseconds in `id.ttl`.
+        Responses never expire; the work for them has already been done.
+        A ttl that is not a non-negative number is ignored.
+
+        """
+
+        ttl = self.header.get('id', {}).get('ttl')
+        if self.kind != 'request' or not valid_ttl(ttl):
+            return None
+
+        return self.received + ttl / 1000.0
+
+    def expired(self):
+        deadline = self.deadline
+        return deadline is not None and time.time() >= deadline
+
+    @property
+    def priority(self):
+        """
+        Priority class of the request in the server queue
+
+        A batch goes in the most urgent class of the calls in it.
+
+        """
+
+        classes = [
+            self.listed(call, 'priorities', {}).get(
+                call.get('method'), conf.PRIORITY
+            )
+            for call in self.calls
+        ]
+
+        return max(
+            classes or [conf.PRIORITY],
+            key=lambda name: conf.PRIORITIES.get(name, 0),
+        )
 
     @property
     def host(self):
@@ -59,35 +228,67 @@ class KittenRequest(AutoParadigmMixin):
             key = 'to'
         elif kind == 'response':
             key = 'from'
+        else:
+            # Not something any kitten sends; there is no telling where the
+            # response should go.
+            return None
 
-        return 'tcp://{0}'.format(self.request['id'][key])
+        address = self.header.get('id', {}).get(key)
+        if address is None:
+            # Plain calls have no return address.
+            return None
+
+        return 'tcp://{0}'.format(address)
+
+    def execute(self):
+        """
+        Run the request and return the response without sending it anywhere
+
+        """
+
+        previous = getattr(_current, 'deadline', None)
+        _current.deadline = self.deadline
 
-    def process(self, socket):
         try:
-            func = getattr(
-                self, 'process_{0}_{1}'.format(self.kind, self.phase)
-            )
-            response = func()
+            func = getattr(self, self.phases[(self.kind, self.phase)])
+            return func()
 
-        except jsonschema.exceptions.ValidationError as e:
-            self.log.exception('Validation error')
-            response = {
-                'code': 'VALIDATION_ERROR',
-                'message': e.message,
-            }
         except Exception as e:
-            self.log.exception('General exception')
-            response = {
-                'code': 'UNKNOWN_ERROR',
-                'message': str(e),
-            }
+            return self.error_response(e)
+
+        finally:
+            _current.deadline = previous
+
+    def settle(self, response=None):
+        """
+        Hand the response to the reply that is waiting for it
+
+        The request is run first, unless the response is already known.
+
+        """
+
+        if response is None:
+            response = self.execute()
+
+        self.reply.set(response)
+
+    def process(self, socket):
+        response = self.execute()
 
         # Send it back!
         response = self.decorate_response(response)
-        socket.send_json(response)
+
+        # The requester sent the request in this codec, so it can read it
+        wire.send(socket, response, self.message.codec)
 
         # Wait for confirmation
-        confirm = socket.recv_json()
+        if not socket.poll(conf.CALLBACK_TIMEOUT):
+            raise RequestError(
+                'TIMEOUT',
+                'No confirmation after {0}ms'.format(conf.CALLBACK_TIMEOUT),
+            )
+
+        confirm = wire.recv(socket).data
         self.process_confirm(confirm)
 
     def process_request_payload(self):
@@ -98,29 +299,102 @@ class KittenRequest(AutoParadigmMixin):
         send it to the appropriate paradigm and handler, get the response,
         validate the response, and return it.
 
+        A batch request carries a list of calls in its 'batch' field and gets
+        a list of responses in the same order back.
+
         """
 
         self.log.info('Got request: {0}', self.request)
 
-        self.validate_request(self.request)
+        if 'batch' in self.request:
+            self.response = {
+                'batch': [
+                    self.process_item(item) for item in self.request['batch']
+                ],
+            }
+        else:
+            self.response = self.dispatch(self.request)
+
+        self.log.debug('Returning response: {0}', self.response)
+        return self.response
+
+    def dispatch(self, request):
+        """
+        Validate a single call, run its handler and validate the response
+
+        Methods that the paradigm lists in `cache` are answered from the
+        response cache when an identical call was answered recently.
+
+        """
+
+        self.validate_request(request)
 
-        paradigm_name = self.request['paradigm']
-        method_name = self.request['method'] + '_response'
+        paradigm_name = request['paradigm']
+        method_name = request['method']
 
         paradigm = self.paradigms[paradigm_name]
-        method = getattr(paradigm, method_name)
+        handler = paradigm.handlers.get(method_name)
+        if handler is None:
+            raise LookupError(
+                "Method '{0}' not handled by '{1}'".format(
+                    method_name, paradigm_name
+                )
+            )
 
-        self.response = method(self.request)
-        self.validate_response(self.response)
+        ttl = getattr(paradigm, 'cache', {}).get(method_name)
+        if ttl is not None:
+            key = self.responses.key(request)
+            response = self.responses.get(key)
+            if response is not None:
+                return response
 
-        self.log.debug('Returning response: {0}', self.response)
-        return self.response
+            generation = self.responses.generation
+
+        response = handler(request)
+        self.validate_response(response)
+
+        if ttl is not None:
+            self.responses.put(key, response, ttl, generation)
+
+        return response
+
+    def process_item(self, item):
+        """
+        Dispatch one call of a batch
+
+        Errors are returned in place of the response, so that one broken call
+        does not fail the rest of the batch.
+
+        """
+
+        try:
+            return self.dispatch(item)
+        except Exception as e:
+            response = self.error_response(e)
+            response.update(wire.routing(item))
+            return response
+
+    def error_response(self, e):
+        if isinstance(e, jsonschema.exceptions.ValidationError):
+            self.log.exception('Validation error')
+            return {
+                'code': 'VALIDATION_ERROR',
+                'message': e.message,
+            }
+
+        self.log.exception('General exception')
+        return {
+            'code': 'UNKNOWN_ERROR',
+            'message': str(e),
+        }
 
     def process_request_ack(self):
         return None
 
     def process_response_payload(self):
-        self.validate_response(self.request)
+        # Responses from the peer that handled our request
+        for response in self.request.get('batch', [self.request]):
+            self.validate_response(response, INBOUND)
 
     def process_response_ack(self):
         return None
@@ -154,23 +428,43 @@ class KittenRequest(AutoParadigmMixin):
         session.close()
 
     def ack(self):
-        return {
+        ack = {
             'ack': True
         }
 
+        # Echo the id so that asynchronous clients can match the reply.
+        if 'id' in self.header:
+            ack['id'] = self.header['id']
+
+        return ack
+
+    def busy(self, retry_after):
+        """
+        Reply for a request that was turned away because the server is full
+
+        """
+
+        busy = {
+            'code': 'BUSY',
+            'message': 'Server busy, retry after {0}ms'.format(retry_after),
+            'retry_after': retry_after,
+        }
+
+        if 'id' in self.header:
+            busy['id'] = self.header['id']
+
+        return busy
+
     def decorate_response(self, response):
-        response.update({
-            'id': self.request['id'],
-            'paradigm': self.request['paradigm'],
-            'method': self.request['method'],
-        })
+        response.update(wire.routing(self.header))
 
         return response
 
     def validate_request(self, request):  # pragma: nocover
         self.log.info('Validating request...')
-        self.validator.request(request, self.paradigms)
+        self.validator.request(request, self.paradigms, INBOUND)
 
-    def validate_response(self, response):  # pragma: nocover
+    def validate_response(self, response,
+                          direction=OUTBOUND):  # pragma: nocover
         self.log.info('Validating response...')
-        self.validator.response(response, self.paradigms)
+        self.validator.response(response, self.paradigms, direction)
@@ -5,11 +5,20 @@ import zmq.green as zmq
 import logbook
 
 import gevent
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
 from gevent.pool import Pool
-from gevent.queue import Queue
+from gevent.queue import Full
 
 from kitten import conf
+from kitten import heartbeat
+from kitten import stats
+from kitten import wire
+from kitten.pool import context
+from kitten.pool import SocketPool
+from kitten.queues import RequestQueue
 from kitten.request import KittenRequest
+from kitten.workers import WorkerPool
 
 
 class KittenServer(object):
@@ -18,20 +27,50 @@ class KittenServer(object):
         signal.SIGTERM,
     )
 
+    # Whether to answer heartbeats on the heartbeat port
+    heartbeats = True
+
     def __init__(self, ns):
         self.ns = ns
 
         # Workers and queues
-        self.pool = Pool(5)
-        self.queue = Queue()
+        self.pool = WorkerPool(
+            self.option('pool_size'),
+            self.option('pool_min'),
+            self.option('pool_max'),
+        )
+        self.adaptive = self.option('pool_adaptive')
+        if self.adaptive:
+            # Start out within the bounds the pool is going to be kept in
+            self.pool.resize(self.pool.size)
+        self.queue = RequestQueue(conf.PRIORITIES, conf.QUEUE_SIZE)
+        self.metrics = stats.get('server')
+
+        # Inbound messages are answered in greenlets of their own. zmq
+        # sockets are not safe for concurrent sends, so replies take turns.
+        self.inbound = Pool(conf.LISTEN_SIZE)
+        self.sending = Semaphore()
+
+        # Sockets for sending responses back, per requester
+        self.callbacks = SocketPool(
+            zmq.REQ,
+            conf.CALLBACK_POOL_SIZE,
+            conf.CALLBACK_POOL_IDLE,
+        )
 
         # States
         self.working = None
         self.torn = False
 
+        # Greenlets that come along into forked processes must leave the
+        # sockets of this one alone.
+        self.pid = os.getpid()
+
         # Greenlets; to be populated when started
         self.listener = None
         self.worker = None
+        self.heartbeat = None
+        self.scaler = None
 
         self.log = logbook.Logger('Server-{0}'.format(self.ns.port))
 
@@ -40,23 +79,78 @@ class KittenServer(object):
         self.listener = gevent.spawn(self.listen_forever)
         self.worker = gevent.spawn(self.work_forever)
 
+        if self.heartbeats:
+            self.heartbeat = gevent.spawn(self.heartbeat_forever)
+
+        if self.adaptive:
+            self.scaler = gevent.spawn(self.scale_forever)
+
         return self.listener
 
+    def option(self, key):
+        """
+        Get a setting from the command line, or from conf if it was not given
+
+        """
+
+        value = vars(self.ns).get(key)
+        if value is None:
+            value = getattr(conf, key.upper())
+
+        return value
+
     def stop(self, exit=True):
         self.log.warning('Stopping server')
         self.teardown(exit)
 
     def listen(self, socket):
-        request = socket.recv_json()
-        # Send the request for processing and handle any errors
-        response = self.handle_request(request)
-        socket.send_json(response)
+        """
+        Receive one message and hand it off to be answered
+
+        The listener socket is a ROUTER, so it keeps receiving from other
+        peers while earlier messages are still being handled. REQ and DEALER
+        peers both work; the identity frames that the ROUTER puts in front of
+        every message route the reply back to the right one.
+
+        """
+
+        frames = socket.recv_multipart(copy=False)
+        self.inbound.spawn(self.answer, socket, frames)
 
         return True
 
+    def answer(self, socket, frames):
+        try:
+            envelope, frames = wire.split(frames)
+        except wire.WireError as e:
+            # Without an envelope there is no way to route a reply.
+            self.log.error('Dropping unroutable message: {0}', e)
+            return
+
+        try:
+            message = wire.unpack(frames, envelope)
+        except wire.WireError as e:
+            self.log.error('Undecodable message: {0}', e)
+            self.reply(socket, {'code': e.code, 'message': e.message},
+                       None, envelope)
+            return
+
+        # Send the request for processing and handle any errors. Only the
+        # header of the message has been decoded at this point.
+        response = self.handle_request(message)
+
+        # Answer in whatever format the sender used, since that is the one
+        # format it is guaranteed to understand.
+        self.reply(socket, response, message.codec, envelope)
+
+    def reply(self, socket, data, codec, envelope):
+        with self.sending:
+            wire.send(socket, data, codec, envelope)
+
     def listen_forever(self):
+        socket = None
         try:
-            socket = self.get_socket()
+            socket = self.get_listener()
             while self.listen(socket):
                 pass
 
@@ -64,29 +158,166 @@ class KittenServer(object):
             self.log.exception('Server died.')
 
         finally:
+            if socket is not None:
+                socket.close(linger=0)
             self.teardown()
 
+    def get_listener(self):
+        return self.get_socket(zmq.ROUTER)
+
     def teardown_listener(self):
         self.log.info('Stopping socket listener.')
+        self.inbound.kill(timeout=5)
         self.listener.kill(timeout=5)  # TODO: Configurable
 
+    def beat(self, socket):
+        """
+        Answer one heartbeat
+
+        Heartbeats skip the queue, the codecs and validation entirely; the
+        reply is the ping frame with the kind flipped and the queue depth
+        filled in. Anything that is not a ping is dropped.
+
+        Pongs also list the formats that this server can decode, which is
+        how clients find out that they can send it more than plain JSON.
+
+        """
+
+        frames = socket.recv_multipart()
+        pong = heartbeat.pong(frames[-1], self.depth(), wire.formats())
+
+        if pong is not None:
+            socket.send_multipart(frames[:-1] + [pong])
+
+        return True
+
+    def depth(self):
+        """
+        Requests waiting to be handled, as reported in heartbeats
+
+        """
+
+        return self.queue.qsize()
+
+    def heartbeat_forever(self):
+        socket = None
+        try:
+            host = 'tcp://*:{0}'.format(self.ns.port + conf.HEARTBEAT_OFFSET)
+            socket = self.get_socket(zmq.ROUTER, host)
+            while self.beat(socket):
+                pass
+
+        except Exception:
+            self.log.exception('Heartbeat died.')
+
+        finally:
+            if socket is not None and not self.forked():
+                socket.close(linger=0)
+
+    def forked(self):
+        return os.getpid() != self.pid
+
+    def teardown_heartbeat(self):
+        if self.heartbeat is not None:
+            self.log.info('Stopping heartbeat.')
+            self.heartbeat.kill(timeout=5)
+
     def handle_request(self, request):
         request = KittenRequest(request)
-        self.queue.put(request)
+
+        if request.inline:
+            # Quick enough to answer in one round trip; no ack, no queue and
+            # no callback connection.
+            self.metrics.incr('inline')
+            return request.decorate_response(request.execute())
+
+        if request.batch:
+            # The Batcher waits for the responses in the first reply, so that
+            # is held until a worker has run the batch.
+            request.reply = AsyncResult()
+
+        try:
+            self.queue.put_nowait(request)
+        except Full:
+            # Acking work that will not be done before the sender gives up on
+            # it only makes things worse. Tell it to come back later instead.
+            self.log.warning('Queue full, answering BUSY')
+            self.metrics.incr('busy')
+            return request.busy(conf.BUSY_RETRY_AFTER)
+
+        if request.reply is not None:
+            return request.decorate_response(request.reply.get())
+
         return request.ack()
 
     def work(self):
-        if self.queue.empty():
-            gevent.sleep(0.1)  # TODO: Configurable
-            self.log.debug('Slept')
-            return True
+        # Requests stay in the queue until there is a worker for them, where
+        # they count towards the queue bound and the depth in heartbeats.
+        self.pool.wait_available()
 
+        # Blocks until there is something to do, so requests are dispatched
+        # the moment they arrive and an idle server never wakes up.
         request = self.queue.get()
-        socket = self.get_socket(zmq.REQ, request.host)
-        self.pool.spawn(request.process, socket)
+
+        try:
+            self.start_request(request)
+        except Exception as e:
+            # Whatever is wrong with it, it must not stop the worker loop.
+            self.log.exception('Dropping broken request {0}', request.header)
+            self.metrics.incr('broken')
+
+            if request.reply is not None and not request.reply.ready():
+                request.settle(request.error_response(e))
 
         return True
 
+    def start_request(self, request):
+        if request.expired():
+            # The sender has given up on it; do not waste a worker on it.
+            self.log.warning('Dropping expired request {0}', request.header)
+            self.metrics.incr('expired')
+
+            if request.reply is not None:
+                request.settle({
+                    'code': 'TIMEOUT',
+                    'message': 'Expired before a worker got to it',
+                })
+            return
+
+        if request.reply is not None:
+            self.pool.spawn(request.settle)
+            return
+
+        if request.host is None:
+            # Nowhere to send the response to; just run it.
+            self.pool.spawn(request.execute)
+            return
+
+        self.pool.spawn(self.callback, request)
+
+    def callback(self, request):
+        """
+        Process a request and send the response back to the requester
+
+        The socket is only put back in the pool after a full round trip. A
+        socket that failed or timed out waiting for the confirmation is in an
+        unknown state and is closed instead.
+
+        """
+
+        host = request.host
+        socket = self.callbacks.acquire(host)
+
+        try:
+            request.process(socket)
+        except Exception:
+            self.log.exception('Sending response to {0} failed', host)
+            self.callbacks.discard(socket)
+            return False
+
+        self.callbacks.release(host, socket)
+        return True
+
     def work_forever(self):
         self.working = True
 
@@ -96,11 +327,27 @@ class KittenServer(object):
         self.working = False
         self.log.warning('Worker pool stopped.')
 
+    def scale(self):
+        size = self.pool.adapt(self.queue.qsize(), conf.POOL_INTERVAL)
+        self.log.debug('Workers: {0}', self.pool.as_dict())
+
+        return size
+
+    def scale_forever(self):
+        while True:
+            gevent.sleep(conf.POOL_INTERVAL)
+            self.scale()
+
     def teardown_workers(self):
+        for greenlet in (self.worker, self.scaler):
+            if greenlet is not None:
+                greenlet.kill(block=False)
+
         free = self.pool.free_count()
         if free == self.pool.size:
             self.log.info('Workers idle. Killing without timeout.')
             self.pool.kill()
+            self.callbacks.clear()
             return True
 
         timeout = 5  # TODO: Configurable
@@ -108,20 +355,29 @@ class KittenServer(object):
         self.log.info('Giving {1} requests {0}s to finish', timeout, count)
         self.pool.kill(timeout=timeout)
         self.log.info('Requests finished or timed out.')
+        self.callbacks.clear()
 
-    def get_socket(self, kind=zmq.REP, host=None):
-        context = zmq.Context()
-        socket = context.socket(kind)
+    def get_socket(self, kind=zmq.REP, host=None, bind=None):
+        socket = context().socket(kind)
 
         if not host:
             host = 'tcp://*:{0}'.format(self.ns.port)
 
+        if bind is None:
+            bind = kind in (zmq.REP, zmq.ROUTER)
+
         self.log.info(
-            'Binding {1} on {0}',
+            '{2} {1} on {0}',
             host,
-            {zmq.REP: 'REP', zmq.REQ: 'REQ'}.get(kind, kind)
+            {
+                zmq.REP: 'REP',
+                zmq.REQ: 'REQ',
+                zmq.ROUTER: 'ROUTER',
+                zmq.DEALER: 'DEALER',
+            }.get(kind, kind),
+            'Binding' if bind else 'Connecting',
         )
-        if kind == zmq.REP:
+        if bind:
             socket.bind(host)
         else:
             socket.connect(host)
@@ -144,6 +400,7 @@ class KittenServer(object):
         self.log.info('Tearing down server')
         self.teardown_workers()
         self.teardown_pidfile()
+        self.teardown_heartbeat()
         self.teardown_listener()
         self.log.info('Server teardown complete.')
 
@@ -180,8 +437,48 @@ def setup_parser(subparsers):
         help="Start or stop the server"
     )
 
+    server.add_argument(
+        '--pool-size',
+        type=int,
+        metavar='<n>',
+        help='Concurrent request handlers, default {0}'.format(
+            conf.POOL_SIZE
+        ),
+    )
+    server.add_argument(
+        '--pool-min',
+        type=int,
+        metavar='<n>',
+        help='Least handlers in adaptive mode, default {0}'.format(
+            conf.POOL_MIN
+        ),
+    )
+    server.add_argument(
+        '--pool-max',
+        type=int,
+        metavar='<n>',
+        help='Most handlers in adaptive mode, default {0}'.format(
+            conf.POOL_MAX
+        ),
+    )
+    server.add_argument(
+        '--adaptive',
+        dest='pool_adaptive',
+        action='store_true',
+        default=None,
+        help='Resize the handler pool to fit the load',
+    )
+
     sub = server.add_subparsers(help='Server commands', dest="server_command")
-    sub.add_parser('start', help='Start the server (default)')
+    start = sub.add_parser('start', help='Start the server (default)')
+    start.add_argument(
+        '--workers',
+        type=int,
+        metavar='<n>',
+        help='Run <n> worker processes behind the port, default {0}'.format(
+            conf.WORKERS or 'none',
+        ),
+    )
     sub.add_parser('stop', help='Stop the server')
 
     return execute_parser
@@ -210,7 +507,13 @@ def is_running(ns):
 def start_server(ns):
     logbook.info('Starting kitten server on port {0}'.format(ns.port))
 
-    server = KittenServer(ns)
+    workers = vars(ns).get('workers') or conf.WORKERS
+    if workers:
+        from kitten.prefork import PreforkServer
+        server = PreforkServer(ns, workers)
+    else:
+        server = KittenServer(ns)
+
     server.start()
     gevent.wait()
 
@@ -0,0 +1,61 @@
+import time
+
+from contextlib import contextmanager
+
+
+class Stats(object):
+    """
+    Named counters for one component
+
+    Counters only ever grow, so that rates and ratios can be computed from
+    two snapshots. Values that go up and down, like queue depths, are set
+    with set() instead.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = {}
+
+    def incr(self, key, value=1):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, key, value):
+        self.counters[key] = value
+
+    def get(self, key):
+        return self.counters.get(key, 0)
+
+    @contextmanager
+    def timer(self, key):
+        """
+        Add the seconds spent in the block to a counter
+
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.incr(key, time.time() - start)
+
+    def snapshot(self):
+        return dict(self.counters)
+
+    def reset(self):
+        self.counters.clear()
+
+
+registry = {}
+
+
+def get(name):
+    stats = registry.get(name)
+    if stats is None:
+        stats = registry[name] = Stats(name)
+
+    return stats
+
+
+def snapshot():
+    return dict((name, stats.snapshot()) for name, stats in registry.items())
@@ -1,7 +1,27 @@
 import os
+import sys
 import errno
 import logbook
 
+try:
+    from importlib import import_module
+except ImportError:  # pragma: nocover
+    # Python 2.6
+    def import_module(name):
+        __import__(name)
+        return sys.modules[name]
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: nocover
+    from collections import Mapping
+
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: nocover
+    # Python 2.6; the backport is installed there, see setup.py
+    from ordereddict import OrderedDict
+
 
 def mkdir(path):  # pragma: nocover
     """
@@ -19,25 +39,137 @@ def mkdir(path):  # pragma: nocover
             raise
 
 
+def entry_points(group):
+    """
+    Get the setuptools entry points in `group` by name
+
+    Nothing is imported; the entry points are loaded when used.
+
+    """
+
+    try:
+        from importlib.metadata import entry_points as find
+    except ImportError:  # pragma: nocover
+        try:
+            import pkg_resources
+        except ImportError:
+            return {}
+        found = pkg_resources.iter_entry_points(group)
+    else:
+        found = find()
+        if hasattr(found, 'select'):
+            found = found.select(group=group)
+        else:  # pragma: nocover
+            found = found.get(group, [])
+
+    return dict((entry.name, entry) for entry in found)
+
+
+def resolve(spec):
+    """
+    Get the object that a 'module:attribute' string or an entry point names
+
+    """
+
+    if hasattr(spec, 'load'):
+        return spec.load()
+
+    module, _, attribute = spec.partition(':')
+    return getattr(import_module(module), attribute)
+
+
+class ParadigmRegistry(Mapping):
+    """
+    Paradigms by name, each imported the first time it is used
+
+    Looking at the names does not import anything, so plugins that the node
+    never gets a message for are never loaded. A paradigm that fails to
+    load is logged and dropped, and is unknown from then on.
+
+    """
+
+    log = logbook.Logger('ParadigmRegistry')
+
+    def __init__(self, specs):
+        # name => 'module:Class' or an entry point
+        self.specs = dict(specs)
+
+        # name => paradigm instance
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        paradigm = self.loaded.get(name)
+        if paradigm is None:
+            paradigm = self.load(name)
+        return paradigm
+
+    def __contains__(self, name):
+        return name in self.specs
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+    def load(self, name):
+        spec = self.specs[name]
+
+        try:
+            paradigm = resolve(spec)()
+
+            # Build the validators now instead of on the first message
+            paradigm.validator.compile_all()
+        except Exception:
+            self.log.exception(
+                "Could not load paradigm '{0}' from {1}", name, spec
+            )
+            del self.specs[name]
+            raise KeyError(name)
+
+        if paradigm.name != name:
+            self.log.warning(
+                "Paradigm '{0}' calls itself '{1}'", name, paradigm.name
+            )
+
+        self.log.info("Loaded paradigm '{0}'", name)
+        self.loaded[name] = paradigm
+        return paradigm
+
+
 class AutoParadigmMixin(object):
     """
     Helper mixin that automatically gets paradigms when self.paradigms is
     accessed.
 
+    The paradigms are the ones in conf.PARADIGMS and the ones that installed
+    packages list under the 'kitten.paradigms' entry point group. They are
+    found once per process, and each is imported when first used.
+
     """
 
     log = logbook.Logger('AutoParadigmMixin')
     _paradigms = {}
 
+    # Shared by everything in the process
+    registry = None
+
     def get_paradigms(self):
         if self._paradigms:
             return self._paradigms
 
-        # TODO: Dynamic finding of paradigms
-        from kitten.node import NodeParadigm
-        self._paradigms = {
-            'node': NodeParadigm()
-        }
+        if AutoParadigmMixin.registry is None:
+            from kitten import conf
+
+            specs = entry_points('kitten.paradigms')
+            specs.update(conf.PARADIGMS)
+
+            AutoParadigmMixin.registry = ParadigmRegistry(specs)
+            self.log.debug(
+                'Found paradigms: {0}', ', '.join(sorted(specs))
+            )
+
+        self._paradigms = AutoParadigmMixin.registry
         return self._paradigms
 
     def set_paradigms(self, paradigms):
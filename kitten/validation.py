@@ -1,10 +1,22 @@
 import re
 import copy
 import pprint
-
-import jsonschema
+import random
 
 from jsonschema.exceptions import ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+from kitten import codegen
+from kitten import conf
+from kitten import stats
+
+# Whether a message is coming in from a peer or going out to one
+INBOUND = 'inbound'
+OUTBOUND = 'outbound'
+
+# Validation policies; see conf.VALIDATION
+MODES = ('full', 'boundary', 'sample', 'off')
 
 
 class DRY(object):
@@ -27,6 +39,11 @@ class Validator(object):
                     'phase': {
                         'enum': ['payload', 'ack'],
                     },
+                    # Milliseconds the sender will wait for the response
+                    'ttl': {
+                        'type': 'integer',
+                        'minimum': 0,
+                    },
                 },
                 'additionalProperties': False,
             },
@@ -40,13 +57,22 @@ class Validator(object):
         'additionalProperties': False,
     }
 
+    def __init__(self):
+        # '<method>_<kind>' => compiled jsonschema validator
+        self.compiled = {}
+
+        # '<method>_<kind>' => generated check, or None; see kitten.codegen
+        self.checks = {}
+
+    metrics = stats.get('validation')
+
     def request(self, *args):
         self.validate('request', *args)
 
     def response(self, *args):
         self.validate('response', *args)
 
-    def validate(self, kind, request, paradigms):
+    def validate(self, kind, request, paradigms, direction=INBOUND):
         paradigm_name, method_key = self.get_method(request)
 
         paradigm = paradigms.get(paradigm_name)
@@ -59,21 +85,102 @@ class Validator(object):
                 )
             )
 
+        if not self.wanted(self.policy(paradigm, method_key), direction):
+            self.metrics.incr('skipped')
+            return
+
+        try:
+            self.check(paradigm, paradigm_name, method_key, kind, request)
+        except ValidationError:
+            self.metrics.incr('failed')
+            raise
+
+        self.metrics.incr('validated')
+
+    def policy(self, paradigm, method_key):
+        """
+        Validation mode for a method, from the paradigm or else from conf
+
+        """
+
+        return getattr(paradigm, 'validation', {}).get(
+            method_key, conf.VALIDATION
+        )
+
+    def wanted(self, mode, direction):
+        """
+        Whether a message should be validated under a mode
+
+        """
+
+        if mode == 'full':
+            return True
+        if mode == 'boundary':
+            return direction == INBOUND
+        if mode == 'sample':
+            return random.randrange(conf.VALIDATION_SAMPLE) == 0
+        if mode == 'off':
+            return False
+
+        raise ValueError(
+            "Unknown validation mode '{0}'. Choices are: {1}".format(
+                mode, self._csl(MODES)
+            )
+        )
+
+    def check(self, paradigm, paradigm_name, method_key, kind, request):
         validator = paradigm.validator
         method_name = '{0}_{1}'.format(method_key, kind)
-        method = getattr(validator, method_name, None)
 
-        if method is None:
-            raise ValidationError(
-                "Method '{0}()' not found in '{1}'. Choices are: {2}".format(
-                    method_name,
-                    paradigm_name,
-                    self._csl(validator.get_known_methods())
+        compiled = validator.compiled.get(method_name)
+        if compiled is None:
+            if getattr(validator, method_name, None) is None:
+                raise ValidationError(
+                    "Method '{0}()' not found in '{1}'. Choices are: "
+                    "{2}".format(
+                        method_name,
+                        paradigm_name,
+                        self._csl(validator.get_known_methods())
+                    )
                 )
-            )
 
-        schema = self.decorate_schema(method())
-        jsonschema.validate(request, schema)
+            compiled = validator.compile(method_name)
+
+        check = validator.checks.get(method_name)
+        if check is not None and check(request):
+            return
+
+        # The same error that jsonschema.validate() would raise
+        error = best_match(compiled.iter_errors(request))
+        if error is not None:
+            raise error
+
+    def compile(self, method_name):
+        """
+        Build the validator for one schema method, once
+
+        Checking the schema and setting up a validator for it costs a lot
+        more than validating a message with it, so the result is kept. With
+        conf.VALIDATION_CODEGEN, a generated check is built as well.
+
+        """
+
+        compiled = self.compiled.get(method_name)
+        if compiled is None:
+            schema = self.decorate_schema(getattr(self, method_name)())
+
+            cls = validator_for(schema)
+            cls.check_schema(schema)
+            compiled = self.compiled[method_name] = cls(schema)
+
+            if conf.VALIDATION_CODEGEN:
+                self.checks[method_name] = codegen.build(schema)
+
+        return compiled
+
+    def compile_all(self):
+        for method_name in self.get_known_methods():
+            self.compile(method_name)
 
     def get_method(self, data):
         # TODO: Make this method actually return the method, with the
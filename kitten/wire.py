@@ -0,0 +1,378 @@
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # pragma: nocover
+    msgpack = None
+
+from kitten import conf
+from kitten import stats
+
+metrics = stats.get('wire')
+
+
+class WireError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):  # pragma: nocover
+        return "{0}: {1}".format(self.code, self.message)
+
+
+class Codec(object):
+    """
+    Serialization format for message bodies
+
+    """
+
+    name = None
+
+    def encode(self, data):  # pragma: nocover
+        raise NotImplementedError
+
+    def decode(self, data):  # pragma: nocover
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    # json.dumps() builds a new encoder on every call when it is given any
+    # options, which costs more than encoding a header does.
+    encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def encode(self, data):
+        return self.encoder.encode(data).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+# Fields that are needed to route a message. They go in the header frame so
+# that the payload does not have to be decoded to find out where a message
+# is going.
+ROUTING = ('id', 'paradigm', 'method')
+
+codecs = {}
+
+
+def register(codec):
+    codecs[codec.name] = codec
+    return codec
+
+
+_json = register(JsonCodec())
+if msgpack is not None:
+    register(MsgpackCodec())
+
+
+def get_codec(name):
+    """
+    Get a codec by name
+
+    None means plain single frame JSON, which every kitten version speaks.
+
+    """
+
+    if name is None:
+        return None
+
+    if name not in codecs:
+        raise WireError(
+            'UNKNOWN_CODEC',
+            "Codec '{0}' not available. Choices are: {1}".format(
+                name,
+                ', '.join(sorted(codecs)),
+            )
+        )
+
+    return codecs[name]
+
+
+def default_codec():
+    return get_codec(conf.CODEC)
+
+
+def formats():
+    """
+    The codecs and compressions this kitten can decode, as sent to peers
+
+    """
+
+    return _json.encode({
+        'codecs': sorted(codecs),
+        'compression': sorted(compressors),
+    })
+
+
+def parse_formats(data):
+    """
+    Parse what a peer sent from formats(); None if it sent nothing usable
+
+    """
+
+    try:
+        advertised = _json.decode(data)
+    except ValueError:
+        return None
+
+    if not isinstance(advertised, dict):
+        return None
+
+    return advertised
+
+
+def accepts(advertised, codec):
+    """
+    Whether a peer with the advertised formats can decode a codec message
+
+    """
+
+    if codec is None:
+        return True
+
+    if not advertised or codec.name not in advertised.get('codecs', ()):
+        return False
+
+    return (
+        conf.COMPRESSION is None or
+        conf.COMPRESSION in advertised.get('compression', ())
+    )
+
+
+class Compressor(object):
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+compressors = {}
+
+
+def register_compressor(compressor):
+    compressors[compressor.name] = compressor
+    return compressor
+
+
+register_compressor(Compressor(
+    'zlib',
+    lambda data: zlib.compress(data, conf.COMPRESSION_LEVEL),
+    zlib.decompress,
+))
+
+
+def get_compressor(name):
+    if name is None:
+        return None
+
+    if name not in compressors:
+        raise WireError(
+            'UNKNOWN_COMPRESSION',
+            "Compression '{0}' not available. Choices are: {1}".format(
+                name,
+                ', '.join(sorted(compressors)),
+            )
+        )
+
+    return compressors[name]
+
+
+def compress(body, compressor):
+    """
+    Compress a body if it is large enough for it to be worth it
+
+    Returns the body to send and whether it was compressed. Bodies that do
+    not shrink are sent as they are.
+
+    """
+
+    if compressor is None or len(body) < conf.COMPRESSION_THRESHOLD:
+        return body, False
+
+    with metrics.timer('compress_time'):
+        compressed = compressor.compress(body)
+
+    if len(compressed) >= len(body):
+        metrics.incr('compress_skipped')
+        return body, False
+
+    metrics.incr('compressed')
+    metrics.incr('compress_bytes_in', len(body))
+    metrics.incr('compress_bytes_out', len(compressed))
+
+    return compressed, True
+
+
+class Message(object):
+    """
+    A message as it came off the wire
+
+    The routing fields in `header` are always decoded. The rest of the
+    message stays an undecoded frame until `data` is first accessed, so
+    anything that only needs to know where a message goes never pays for
+    parsing the payload.
+
+    `codec` is the codec the sender used, so that the reply can be sent in a
+    format the sender is known to understand. `envelope` holds the routing
+    frames of ROUTER and DEALER sockets, up to and including the empty
+    delimiter frame.
+
+    """
+
+    def __init__(self, header, body=None, codec=None, envelope=(),
+                 compressor=None):
+        self.header = header
+        self.body = body
+        self.codec = codec
+        self.envelope = list(envelope)
+        self.compressor = compressor
+        self._data = None
+
+    @classmethod
+    def from_data(cls, data, codec=None, envelope=()):
+        message = cls(routing(data), None, codec, envelope)
+        message._data = data
+        return message
+
+    @property
+    def decoded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            body = self.body
+            if self.compressor is not None:
+                with metrics.timer('decompress_time'):
+                    body = self.compressor.decompress(bytes(body))
+
+            data = self.codec.decode(body)
+            data.update(self.header)
+            self._data = data
+            self.body = None
+
+        return self._data
+
+
+def routing(data):
+    return dict((key, data[key]) for key in ROUTING if key in data)
+
+
+def pack(data, codec=None):
+    """
+    Turn data into message frames
+
+    Without a codec this is a single JSON frame, exactly like send_json().
+    With one it is a small JSON header frame with the routing fields and the
+    name of the codec, followed by the rest of the data encoded with that
+    codec. Receivers tell the two apart by the number of frames.
+
+    Bodies of framed messages are compressed when they are larger than
+    conf.COMPRESSION_THRESHOLD, which is flagged in the header.
+
+    """
+
+    if codec is None:
+        return [json.dumps(data).encode('utf-8')]
+
+    header = routing(data)
+    header['codec'] = codec.name
+    body = codec.encode(dict(
+        (key, value) for key, value in data.items() if key not in ROUTING
+    ))
+
+    compressor = get_compressor(conf.COMPRESSION)
+    body, compressed = compress(body, compressor)
+    if compressed:
+        header['compression'] = compressor.name
+
+    return [_json.encode(header), body]
+
+
+def unpack(frames, envelope=()):
+    """
+    Turn message frames into a Message
+
+    The frames can be bytes or zmq.Frame objects. The body frame is kept
+    as it is, so that receiving with copy=False avoids copying it until it
+    is decoded.
+
+    """
+
+    if len(frames) == 1:
+        data = json.loads(_bytes(frames[0]).decode('utf-8'))
+        return Message.from_data(data, None, envelope)
+
+    if len(frames) != 2:
+        raise WireError(
+            'BAD_FRAMES',
+            'Expected 1 or 2 frames, got {0}'.format(len(frames))
+        )
+
+    try:
+        header = _json.decode(_bytes(frames[0]))
+    except ValueError as e:
+        raise WireError('BAD_HEADER', str(e))
+
+    codec = get_codec(header.pop('codec', None) or 'json')
+    compressor = get_compressor(header.pop('compression', None))
+    body = getattr(frames[1], 'buffer', frames[1])
+
+    return Message(header, body, codec, envelope, compressor)
+
+
+def send(socket, data, codec=None, envelope=()):
+    socket.send_multipart(list(envelope) + pack(data, codec))
+
+
+def recv(socket, routed=False):
+    """
+    Receive one message
+
+    If `routed` is set, the frames up to and including the first empty frame
+    are split off into the envelope of the message.
+
+    """
+
+    frames = socket.recv_multipart(copy=False)
+
+    envelope = ()
+    if routed:
+        envelope, frames = split(frames)
+
+    return unpack(frames, envelope)
+
+
+def split(frames):
+    """
+    Split the frames of a routed message into its envelope and the message
+
+    The envelope is everything up to and including the first empty frame.
+
+    """
+
+    for index, frame in enumerate(frames):
+        if not _bytes(frame):
+            break
+    else:
+        raise WireError('BAD_ENVELOPE', 'No delimiter frame in message')
+
+    envelope = [_bytes(frame) for frame in frames[:index + 1]]
+    return envelope, frames[index + 1:]
+
+
+def _bytes(frame):
+    return getattr(frame, 'bytes', frame)
@@ -0,0 +1,161 @@
+import math
+import time
+import logbook
+
+from gevent.event import Event
+from gevent.pool import Group
+
+from kitten import conf
+from kitten import stats
+
+
+class WorkerPool(Group):
+    """
+    Greenlet pool for request handlers whose size can change while it runs
+
+    At most `size` handlers run at once. Unlike gevent's Pool, spawn() never
+    blocks; callers wait for a free worker with wait_available() first, so
+    that requests stay in the server queue until there is someone to take
+    them.
+
+    The pool keeps a smoothed handler latency and how busy its workers are,
+    which adapt() uses to resize it within `minimum` and `maximum`. The
+    bounds only apply to resizing; the size it starts out with is kept as it
+    is.
+
+    """
+
+    log = logbook.Logger('WorkerPool')
+
+    # Weight of new samples in the smoothed handler latency
+    alpha = 1 / 8.0
+
+    # Workers to keep on top of what the load strictly needs
+    headroom = 1.25
+
+    def __init__(self, size=None, minimum=None, maximum=None):
+        super(WorkerPool, self).__init__()
+
+        self.minimum = conf.POOL_MIN if minimum is None else minimum
+        self.maximum = conf.POOL_MAX if maximum is None else maximum
+        self.size = conf.POOL_SIZE if size is None else size
+
+        if self.size < 1:
+            raise ValueError(
+                'Pool size must be at least 1, not {0}'.format(self.size)
+            )
+
+        # Handlers running right now
+        self.active = 0
+
+        # Smoothed handler latency in milliseconds
+        self.latency = None
+
+        # Handlers finished and seconds spent in them since the last adapt()
+        self.completed = 0
+        self.busy = 0.0
+        self.utilization = 0.0
+
+        # Set whenever there is a free worker
+        self.slot = Event()
+        self.slot.set()
+
+        self.metrics = stats.get('workers')
+        self.publish()
+
+    def clamp(self, size):
+        return max(self.minimum, min(self.maximum, size))
+
+    def full(self):
+        return self.active >= self.size
+
+    def free_count(self):
+        return max(0, self.size - self.active)
+
+    def wait_available(self):
+        while self.full():
+            self.slot.wait()
+
+    def spawn(self, func, *args, **kwargs):
+        self.active += 1
+        self.update()
+
+        return super(WorkerPool, self).spawn(self.run, func, *args, **kwargs)
+
+    def run(self, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+
+            self.active -= 1
+            self.completed += 1
+            self.busy += elapsed
+            self.sample(elapsed * 1000)
+            self.update()
+
+    def sample(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+
+    def update(self):
+        if self.full():
+            self.slot.clear()
+        else:
+            self.slot.set()
+
+    def resize(self, size):
+        size = self.clamp(size)
+        if size != self.size:
+            self.log.info('Resizing from {0} to {1} workers', self.size, size)
+            self.size = size
+
+        self.update()
+        self.publish()
+
+        return self.size
+
+    def adapt(self, depth, interval):
+        """
+        Resize the pool to what the current load needs
+
+        The workers needed are the rate that requests arrive at times how
+        long a handler takes (Little's law). The rate counts the requests
+        finished since the last call plus the ones still waiting in the
+        queue, so a backlog makes the pool grow. To not flap, the pool at most
+        doubles or shrinks by a quarter per call.
+
+        """
+
+        self.utilization = min(1.0, self.busy / (self.size * interval))
+
+        if self.latency is None:
+            # Nothing has finished yet, so there is nothing to go on except
+            # for requests piling up.
+            target = self.size * 2 if depth else self.size
+        else:
+            rate = (self.completed + depth) / float(interval)
+            needed = rate * self.latency / 1000.0 * self.headroom
+            target = int(math.ceil(needed))
+
+        target = max(int(self.size * 0.75), min(self.size * 2, target))
+
+        self.completed = 0
+        self.busy = 0.0
+
+        return self.resize(target)
+
+    def publish(self):
+        for key, value in self.as_dict().items():
+            self.metrics.set(key, value)
+
+    def as_dict(self):
+        return {
+            'size': self.size,
+            'active': self.active,
+            'utilization': self.utilization,
+            'latency': self.latency,
+        }
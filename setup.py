@@ -16,6 +16,14 @@ install_requires = [
     'gevent',
 ]
 
+if sys.version_info < (2, 7):
+    # Backport of collections.OrderedDict
+    install_requires.append('ordereddict')
+
+extras_require = {
+    'msgpack': ['msgpack'],
+}
+
 tests_require = [
     'pytest',
     'pytest-cov',
@@ -45,6 +53,7 @@ setup(
     license='MIT',
     packages=['kitten'],
     install_requires=install_requires,
+    extras_require=extras_require,
     tests_require=tests_require,
     zip_safe=False,
     entry_points={
@@ -0,0 +1,92 @@
+import pytest
+import gevent
+from mock import MagicMock
+from test.utils import random_port
+
+from kitten.client import Batcher
+from kitten.client import KittenClient
+from kitten.pool import SocketPool
+from kitten.server import KittenServer
+
+
+class TestBatcher(object):
+    def setup_method(self, method):
+        # Estimates from earlier tests would set the timeouts here
+        KittenClient.estimators.clear()
+
+        self.server = KittenServer(MagicMock())
+        self.server.teardown = MagicMock()
+        port = random_port(self.server)
+
+        self.listener = gevent.spawn(self.server.listen_forever)
+        self.worker = gevent.spawn(self.server.work_forever)
+        self.address = '127.0.0.1:{0}'.format(port.get(timeout=5))
+
+        client = KittenClient()
+        client.pool = SocketPool()
+        client.retries = 0
+        self.batcher = Batcher(client, window=20, limit=10)
+
+    def teardown_method(self, method):
+        self.batcher.client.pool.clear()
+        self.server.inbound.kill()
+        self.worker.kill()
+        self.listener.kill()
+
+    @pytest.mark.timeout(10)
+    def test_every_call_gets_its_own_response(self):
+        self.server.metrics.reset()
+
+        first = self.batcher.send(self.address, {
+            'paradigm': 'node', 'method': 'ping',
+        })
+        second = self.batcher.send(self.address, {
+            'paradigm': 'node', 'method': 'hehe',
+        })
+        third = self.batcher.send(self.address, {
+            'paradigm': 'node', 'method': 'ping',
+        })
+
+        ping = {'paradigm': 'node', 'method': 'ping', 'code': 'OK'}
+        assert first.get(timeout=5) == ping
+        assert third.get(timeout=5) == ping
+
+        error = second.get(timeout=5)
+        assert error['code'] == 'VALIDATION_ERROR'
+        assert error['method'] == 'hehe'
+
+        # All in one round trip, through the queue as 'hehe' is not inline
+        assert self.server.metrics.get('inline') == 0
+        assert self.server.queue.qsize() == 0
+
+    @pytest.mark.timeout(10)
+    def test_inline_batch(self):
+        self.server.metrics.reset()
+
+        results = [
+            self.batcher.send(self.address, {
+                'paradigm': 'node', 'method': 'ping',
+            })
+            for _ in range(3)
+        ]
+
+        for result in results:
+            assert result.get(timeout=5)['code'] == 'OK'
+
+        # All in one round trip, answered without going through the queue
+        assert self.server.metrics.get('inline') == 1
+
+    @pytest.mark.timeout(10)
+    def test_limit_sends_at_once(self):
+        self.batcher.limit = 2
+
+        results = [
+            self.batcher.send(self.address, {
+                'paradigm': 'node', 'method': 'ping',
+            })
+            for _ in range(2)
+        ]
+
+        assert self.address not in self.batcher.timers
+        for result in results:
+            assert result.get(timeout=5)['code'] == 'OK'
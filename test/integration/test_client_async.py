@@ -0,0 +1,76 @@
+import time
+import json
+
+import pytest
+import gevent
+from gevent.pool import Group
+import zmq.green as zmq
+
+from kitten.client import KittenClient
+from kitten.request import RequestError
+
+
+class TestClientAsync(object):
+    def setup_method(self, method):
+        self.context = zmq.Context()
+        self.delay = 0.1
+
+        # Three slow peers that echo the request id back
+        self.sockets = []
+        self.servers = Group()
+        self.addresses = []
+        for _ in range(3):
+            socket = self.context.socket(zmq.ROUTER)
+            port = socket.bind_to_random_port('tcp://127.0.0.1')
+            self.sockets.append(socket)
+            self.addresses.append('127.0.0.1:{0}'.format(port))
+            self.servers.spawn(self.serve, socket)
+
+        KittenClient.dealers.clear()
+        self.client = KittenClient()
+
+    def teardown_method(self, method):
+        self.servers.kill()
+        for socket in self.sockets:
+            socket.close(linger=0)
+        for connection in KittenClient.dealers.values():
+            connection.close()
+        KittenClient.dealers.clear()
+
+    def serve(self, socket):
+        while True:
+            frames = socket.recv_multipart()
+            self.servers.spawn(self.reply, socket, frames)
+
+    def reply(self, socket, frames):
+        gevent.sleep(self.delay)
+        request = json.loads(frames[-1].decode('utf-8'))
+        response = {'id': request['id'], 'code': 'OK'}
+        socket.send_multipart(frames[:-1] + [json.dumps(response).encode()])
+
+    @pytest.mark.timeout(10)
+    def test_send_many_concurrently(self):
+        requests = [
+            (address, {'paradigm': 'node', 'method': 'ping'})
+            for address in self.addresses
+            for _ in range(3)
+        ]
+
+        start = time.time()
+        results = self.client.send_many(requests)
+        responses = [result.get() for result in results]
+        elapsed = time.time() - start
+
+        assert all(r['code'] == 'OK' for r in responses)
+        # Nine requests that each take 0.1s, done in roughly one round trip
+        assert elapsed < self.delay * 3
+
+    @pytest.mark.timeout(10)
+    def test_send_async_timeout(self):
+        self.delay = 1
+        result = self.client.send_async(self.addresses[0], {}, timeout=50)
+
+        with pytest.raises(RequestError) as exc:
+            result.get()
+
+        assert exc.value.code == 'TIMEOUT'
@@ -0,0 +1,110 @@
+import os
+import signal
+
+import pytest
+import gevent
+from mock import MagicMock, patch
+from test.utils import random_port
+
+from kitten.client import KittenClient
+from kitten.pool import SocketPool
+from kitten.prefork import PreforkServer
+from kitten.prefork import WorkerServer
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Needs fork()')
+class TestPrefork(object):
+    def setup_method(self, method):
+        # Estimates from earlier tests would set the timeouts here
+        KittenClient.estimators.clear()
+
+        ns = MagicMock()
+        ns.port = 9830
+
+        # No signal handlers from within the test run, and the pidfile goes
+        # in /tmp
+        self.patches = [
+            patch('kitten.conf.BACKEND', 'ipc:///tmp/kitten-test-{0}.ipc'),
+            patch('kitten.conf.PIDFILE', '/tmp/kitten-test-{0}.pid'),
+            patch.object(WorkerServer, 'setup', MagicMock()),
+        ]
+        for p in self.patches:
+            p.start()
+
+        self.server = PreforkServer(ns, 2)
+        self.server.setup = self.server.setup_pidfile
+        port = random_port(self.server)
+
+        # The heartbeat port is derived from ns.port, which is not the one
+        # listened on here
+        self.server.heartbeat_forever = MagicMock()
+
+        self.server.start()
+        self.address = '127.0.0.1:{0}'.format(port.get(timeout=5))
+
+        self.client = KittenClient()
+        self.client.pool = SocketPool()
+
+        # Give the workers time to come up
+        gevent.sleep(0.5)
+
+    def teardown_method(self, method):
+        self.client.pool.clear()
+        self.server.teardown_workers()
+
+        # Tearing down for real would exit the test run
+        self.server.teardown = MagicMock()
+        self.server.heartbeat.kill()
+        self.server.listener.kill()
+        self.server.teardown_pidfile()
+
+        for p in self.patches:
+            p.stop()
+
+    def ping(self):
+        return self.client.send(self.address, {
+            'paradigm': 'node', 'method': 'ping',
+        })
+
+    @pytest.mark.timeout(20)
+    def test_workers_answer(self):
+        for _ in range(20):
+            assert self.ping()['code'] == 'OK'
+
+        assert len(self.server.children) == 2
+        assert self.server.depth() == 0
+
+    @pytest.mark.timeout(20)
+    def test_dead_worker_is_restarted(self):
+        assert self.ping()['code'] == 'OK'
+
+        pid, other = list(self.server.children)
+        os.kill(pid, signal.SIGKILL)
+        gevent.sleep(0.2)
+
+        # Restarted from the supervisor greenlet, like the front does
+        self.server.supervisor.kill()
+        gevent.spawn(self.server.supervise).join()
+        gevent.sleep(0.5)
+
+        assert pid not in self.server.children
+        assert len(self.server.children) == 2
+
+        # The new worker left the front and the other worker alone
+        assert other in self.server.children
+        os.kill(other, 0)
+        assert os.path.exists(self.server.pidfile)
+        assert not self.server.torn
+
+        for _ in range(10):
+            assert self.ping()['code'] == 'OK'
+
+    @pytest.mark.timeout(20)
+    def test_teardown_stops_workers(self):
+        pids = list(self.server.children)
+        self.server.teardown_workers()
+
+        assert self.server.children == {}
+        for pid in pids:
+            with pytest.raises(OSError):
+                os.kill(pid, 0)
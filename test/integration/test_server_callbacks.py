@@ -0,0 +1,67 @@
+import os
+
+import pytest
+import gevent
+import zmq.green as zmq
+from mock import MagicMock
+
+from kitten import pool
+from kitten.request import KittenRequest
+from kitten.server import KittenServer
+
+
+class QuickRequest(KittenRequest):
+    # Skip the handlers; this is about what happens to the sockets.
+    def execute(self):
+        return {'code': 'OK'}
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.skipif(
+    not os.path.isdir('/proc/self/fd'),
+    reason='Needs /proc to count file descriptors',
+)
+class TestServerCallbackResources(object):
+    def setup_method(self, method):
+        self.socket = pool.context().socket(zmq.REP)
+        port = self.socket.bind_to_random_port('tcp://127.0.0.1')
+        self.peer = gevent.spawn(self.confirm_forever)
+
+        self.server = KittenServer(MagicMock())
+        self.request = {
+            'id': {
+                'kind': 'request',
+                'phase': 'payload',
+                'to': '127.0.0.1:{0}'.format(port),
+                'from': '127.0.0.1:{0}'.format(port),
+            },
+            'paradigm': 'node',
+            'method': 'ping',
+        }
+
+    def teardown_method(self, method):
+        self.peer.kill()
+        self.server.callbacks.clear()
+        self.socket.close(linger=0)
+
+    def confirm_forever(self):
+        while True:
+            self.socket.recv_multipart()
+            self.socket.send(b'{"ack": true}')
+
+    @pytest.mark.timeout(120)
+    def test_fds_stay_flat(self):
+        # Warm up, so that the context and its I/O threads are in place
+        for _ in range(100):
+            assert self.server.callback(QuickRequest(self.request))
+
+        before = open_fds()
+        for _ in range(100000):
+            assert self.server.callback(QuickRequest(self.request))
+        after = open_fds()
+
+        assert after <= before
+        assert len(self.server.callbacks) == 1
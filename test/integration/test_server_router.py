@@ -0,0 +1,100 @@
+import time
+
+import pytest
+import gevent
+from gevent.pool import Group
+from mock import MagicMock
+from test.utils import random_port
+
+from kitten.client import KittenClient
+from kitten.pool import SocketPool
+from kitten.server import KittenServer
+
+
+class TestServerRouter(object):
+    def setup_method(self, method):
+        # Estimates from earlier tests would set the timeouts here
+        KittenClient.estimators.clear()
+
+        self.delay = 0.02
+
+        # Queued rather than answered inline, so that the reply is an ack
+        self.request = {'paradigm': 'node', 'method': 'sync', 'nodes': []}
+
+        self.server = KittenServer(MagicMock())
+        self.server.teardown = MagicMock()
+        port = random_port(self.server)
+
+        # Make handling each message slow, like a slow KittenRequest(...) or
+        # a queue put that has to wait would.
+        handle = self.server.handle_request
+
+        def slow(message):
+            gevent.sleep(self.delay)
+            return handle(message)
+
+        self.server.handle_request = slow
+        self.server.queue = MagicMock()
+
+        self.listener = gevent.spawn(self.server.listen_forever)
+        self.address = '127.0.0.1:{0}'.format(port.get(timeout=5))
+
+    def teardown_method(self, method):
+        self.server.inbound.kill()
+        self.listener.kill()
+
+    def client(self):
+        client = KittenClient()
+        client.pool = SocketPool()
+        client.retries = 0
+        return client
+
+    def run(self, clients, count):
+        def drive(client):
+            for _ in range(count):
+                ret = client.send(self.address, self.request)
+                assert ret == {'ack': True}
+            client.pool.clear()
+
+        group = Group()
+        start = time.time()
+        for _ in range(clients):
+            group.spawn(drive, self.client())
+        group.join(raise_error=True)
+
+        return clients * count / (time.time() - start)
+
+    @pytest.mark.timeout(10)
+    def test_throughput_scales_with_clients(self):
+        single = self.run(1, 5)
+        many = self.run(8, 5)
+
+        # In lockstep eight clients would get no more through than one.
+        assert many > single * 4
+
+    @pytest.mark.timeout(10)
+    def test_inline_ping(self):
+        client = self.client()
+        ret = client.send(self.address, {'paradigm': 'node', 'method': 'ping'})
+        client.pool.clear()
+
+        assert ret == {'paradigm': 'node', 'method': 'ping', 'code': 'OK'}
+        assert not self.server.queue.put_nowait.called
+
+    @pytest.mark.timeout(10)
+    def test_dealer_clients(self):
+        client = KittenClient()
+        results = client.send_many([
+            (self.address, self.request)
+            for _ in range(10)
+        ], timeout=1000)
+
+        start = time.time()
+        responses = [result.get() for result in results]
+
+        assert all(response['ack'] for response in responses)
+        assert time.time() - start < self.delay * 5
+
+        for connection in KittenClient.dealers.values():
+            connection.close()
+        KittenClient.dealers.clear()
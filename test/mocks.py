@@ -1,4 +1,6 @@
+from kitten import cache
 from kitten import db
+from kitten import pool
 from kitten.client import KittenClient
 from kitten.validation import Validator
 from kitten.paradigm import Paradigm
@@ -30,6 +32,9 @@ class MockDatabaseMixin(object):
         self.Base.metadata.create_all(self.engine)
         self.session = self.Session()
 
+        # Responses cached by earlier tests are from another database
+        cache.responses.invalidate()
+
         maybe_super(MockDatabaseMixin, self, 'setup_method', method)
 
     def teardown_method(self, method):
@@ -56,12 +61,23 @@ class MockKittenClientMixin(object):
     Methods that use this need to @mock.patch('zmq.green.Context') and assign
     the return_value of that mock to be self.context.
 
+    The shared context and socket pool are emptied so that sockets from
+    other tests are not reused.
+
     """
 
     def setup_method(self, method):
+        pool.reset()
+        KittenClient.pool.sockets.clear()
+        KittenClient.estimators.clear()
+        KittenClient.beat_estimators.clear()
+        KittenClient.beats.sockets.clear()
+        KittenClient.silent.clear()
+        KittenClient.speaks.clear()
+
         self.client = KittenClient()
         self.context = mock.MagicMock()
-        self.socket = mock.MagicMock()
+        self.socket = mock.MagicMock(closed=False)
         self.context.socket.return_value = self.socket
 
         maybe_super(MockKittenClientMixin, self, 'setup_method', method)
@@ -0,0 +1,179 @@
+import json
+import pytest
+
+from mock import MagicMock
+from mock import patch
+
+from kitten import bench
+from kitten.bench import Bench
+from kitten.client import KittenClient
+from kitten.heartbeat import Pong
+from kitten.request import RequestError
+from test.mocks import MockKittenClientMixin
+
+
+class TestParseMix(object):
+    def test_single(self):
+        assert bench.parse_mix('node.ping') == [('node', 'ping', 1)]
+
+    def test_weights(self):
+        ret = bench.parse_mix('node.ping:3, node.sync')
+        assert ret == [('node', 'ping', 3), ('node', 'sync', 1)]
+
+    def test_bad_item(self):
+        with pytest.raises(ValueError):
+            bench.parse_mix('ping')
+
+    def test_empty(self):
+        with pytest.raises(ValueError):
+            bench.parse_mix(',')
+
+
+class TestPercentile(object):
+    def test_empty(self):
+        assert bench.percentile([], 50) is None
+
+    def test_percentiles(self):
+        values = list(range(1, 1001))
+
+        assert bench.percentile(values, 50) == 500
+        assert bench.percentile(values, 99) == 990
+        assert bench.percentile(values, 99.9) == 999
+        assert bench.percentile(values, 100) == 1000
+
+    def test_single(self):
+        assert bench.percentile([4], 99.9) == 4
+
+
+class TestBench(MockKittenClientMixin):
+    def setup_method(self, method):
+        super(TestBench, self).setup_method(method)
+        self.bench = Bench(
+            ['a:1', 'b:2'],
+            [('node', 'ping', 1)],
+            clients=3,
+            requests=20,
+            interval=0.01,
+        )
+
+    def test_build(self):
+        request = self.bench.build()
+        assert request == {'paradigm': 'node', 'method': 'ping'}
+
+    def test_choose_respects_weights(self):
+        self.bench.calls = [('node', 'ping'), ('node', 'sync')]
+        self.bench.weights = [1, 0]
+
+        for _ in range(50):
+            assert self.bench.choose() == ('node', 'ping')
+
+    def test_client_does_not_retry_or_share_sockets(self):
+        client = self.bench.get_client()
+
+        assert client.retries == 0
+        assert client.pool is not KittenClient.pool
+
+    @patch.object(KittenClient, 'heartbeat')
+    @patch.object(KittenClient, 'send')
+    def test_run(self, send, heartbeat):
+        send.return_value = {'ack': True}
+        heartbeat.return_value = Pong(1.0, 7)
+
+        report = self.bench.run()
+
+        assert send.call_count == 20
+        assert report['requests'] == 20
+        assert report['completed'] == 20
+        assert report['errors'] == 0
+        assert report['timeouts'] == 0
+        assert report['latency']['p50'] is not None
+        assert report['latency']['p999'] >= report['latency']['p50']
+        assert report['queue'][0]['depth'] == 7
+        addresses = set(q['address'] for q in report['queue'])
+        assert addresses == set(['a:1', 'b:2'])
+
+        # Must be serializable for the --json output
+        json.dumps(report)
+
+    @patch.object(KittenClient, 'heartbeat')
+    @patch.object(KittenClient, 'send')
+    def test_run_counts_failures(self, send, heartbeat):
+        heartbeat.return_value = None
+        send.side_effect = [
+            RequestError('TIMEOUT', 'Timeout after 200ms'),
+            RequestError('BUSY', 'Server busy', 100),
+            RequestError('CLOSED', 'Connection closed'),
+            {'code': 'BAD_FRAMES', 'message': 'no'},
+            Exception('hehe'),
+            {'ack': True},
+        ]
+        self.bench.requests = 6
+        self.bench.clients = 1
+
+        report = self.bench.run()
+
+        assert report['timeouts'] == 1
+        assert report['busy'] == 1
+        assert report['errors'] == 3
+        assert report['completed'] == 2
+        assert report['queue'][0]['depth'] is None
+
+    @patch('time.time')
+    def test_claim_duration(self, time):
+        self.bench.requests = None
+        self.bench.duration = 10
+        self.bench.started = 100
+
+        time.return_value = 109.9
+        assert self.bench.claim() is True
+
+        time.return_value = 110
+        assert self.bench.claim() is False
+
+    def test_format_report(self):
+        self.bench.elapsed = 2.0
+        self.bench.sent = 2
+        self.bench.latencies = [1.0, 3.0]
+        self.bench.depths = [{'time': 0, 'address': 'a:1', 'depth': 4}]
+
+        ret = bench.format_report(self.bench.report())
+
+        assert 'Throughput:  1.0 req/s' in ret
+        assert 'p50 1.00ms' in ret
+        assert 'a:1 max 4, last 4' in ret
+        assert 'b:2 unknown' in ret
+
+
+class TestBenchParser(object):
+    def setup_method(self, method):
+        self.ns = MagicMock()
+        self.ns.addresses = []
+        self.ns.port = 5555
+        self.ns.mix = 'node.ping:2'
+        self.ns.requests = None
+
+    @patch('kitten.bench.Bench')
+    def test_execute_json(self, Bench, capsys):
+        Bench.return_value.run.return_value = {'completed': 1}
+        self.ns.json = True
+
+        ret = bench.execute_parser(self.ns)
+
+        assert ret == 0
+        assert Bench.call_args[0] == (
+            ['localhost:5555'], [('node', 'ping', 2)]
+        )
+        assert json.loads(capsys.readouterr()[0]) == {'completed': 1}
+
+    @patch('kitten.bench.format_report')
+    @patch('kitten.bench.Bench')
+    def test_execute_nothing_completed(self, Bench, format_report):
+        Bench.return_value.run.return_value = {'completed': 0}
+        format_report.return_value = ''
+        self.ns.json = False
+        self.ns.addresses = ['a:1']
+
+        ret = bench.execute_parser(self.ns)
+
+        assert ret == 1
+        assert Bench.call_args[0][0] == ['a:1']
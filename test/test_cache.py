@@ -0,0 +1,87 @@
+from mock import patch
+
+from kitten.cache import ResponseCache
+
+
+class TestResponseCache(object):
+    def setup_method(self, method):
+        self.cache = ResponseCache(3)
+        self.cache.metrics.reset()
+        self.request = {
+            'id': {'uuid': 'abc'},
+            'paradigm': 'node',
+            'method': 'sync',
+            'nodes': ['a', 'b'],
+        }
+
+    def test_key_ignores_id(self):
+        other = dict(self.request, id={'uuid': 'def'})
+        assert self.cache.key(self.request) == self.cache.key(other)
+
+    def test_key_is_canonical(self):
+        first = {'paradigm': 'p', 'method': 'm', 'a': 1, 'b': {'c': 2, 'd': 3}}
+        second = {'b': {'d': 3, 'c': 2}, 'method': 'm', 'paradigm': 'p'}
+        second['a'] = 1
+
+        assert self.cache.key(first) == self.cache.key(second)
+
+    def test_key_differs_by_payload(self):
+        other = dict(self.request, nodes=['a'])
+        assert self.cache.key(self.request) != self.cache.key(other)
+
+    def test_key_differs_by_method(self):
+        other = dict(self.request, method='ping')
+        assert self.cache.key(self.request) != self.cache.key(other)
+
+    def test_miss(self):
+        assert self.cache.get('hehe') is None
+        assert self.cache.metrics.get('misses') == 1
+
+    def test_hit(self):
+        self.cache.put('key', {'nodes': []}, 10)
+
+        assert self.cache.get('key') == {'nodes': []}
+        assert self.cache.metrics.get('hits') == 1
+
+    def test_hit_is_a_copy(self):
+        self.cache.put('key', {'nodes': []}, 10)
+        self.cache.get('key')['nodes'].append('hehe')
+
+        assert self.cache.get('key') == {'nodes': []}
+
+    @patch('time.time')
+    def test_expiry(self, time):
+        time.return_value = 100.0
+        self.cache.put('key', {}, 10)
+
+        time.return_value = 110.0
+        assert self.cache.get('key') is None
+        assert self.cache.metrics.get('expired') == 1
+        assert len(self.cache) == 0
+
+    def test_lru_eviction(self):
+        for key in 'abc':
+            self.cache.put(key, {}, 10)
+
+        # Makes 'b' the least recently used
+        self.cache.get('a')
+        self.cache.put('d', {}, 10)
+
+        assert len(self.cache) == 3
+        assert self.cache.get('b') is None
+        assert self.cache.get('a') is not None
+        assert self.cache.metrics.get('evictions') == 1
+
+    def test_invalidate(self):
+        self.cache.put('key', {}, 10)
+        self.cache.invalidate()
+
+        assert self.cache.get('key') is None
+        assert self.cache.metrics.get('invalidations') == 1
+
+    def test_put_from_before_invalidate(self):
+        generation = self.cache.generation
+        self.cache.invalidate()
+
+        assert self.cache.put('key', {}, 10, generation) is False
+        assert self.cache.get('key') is None
@@ -1,7 +1,19 @@
+import time
 import pytest
 import mock
+import gevent
+import zmq
+from gevent.event import AsyncResult
 from test.mocks import MockKittenClientMixin
+from test.utils import frames, sent
 
+from kitten import conf
+from kitten import heartbeat
+from kitten import wire
+from kitten.client import Batcher
+from kitten.client import DealerConnection
+from kitten.client import KittenClient
+from kitten.client import RoundTripEstimator
 from kitten.request import RequestError
 
 
@@ -14,22 +26,692 @@ class TestClientMessaging(MockKittenClientMixin):
     def test_simple_send(self, ctx, poller):
         ctx.return_value = self.context
 
-        self.socket.recv_json.return_value = {"hehe": True}
+        self.socket.recv_multipart.return_value = frames({"hehe": True})
         poller.return_value.poll.return_value = [(self.socket, 1)]
         ret = self.client.send('hehe:1234', {})
 
         assert ret == {'hehe': True}
         assert self.socket.connect.called
-        assert self.socket.recv_json.called
-        self.socket.send_json.assert_called_once_with({})
+        assert self.socket.recv_multipart.called
+        assert self.socket.send_multipart.call_count == 1
+        assert sent(self.socket) == {}
 
+    @mock.patch('kitten.client.budget')
     @mock.patch('zmq.green.Poller')
     @mock.patch('zmq.green.Context')
-    def test_simple_send_times_out(self, ctx, poller):
+    def test_send_passes_on_budget(self, ctx, poller, budget):
         ctx.return_value = self.context
+        budget.return_value = 250.7
 
-        self.socket.recv_json.return_value = {"hehe": True}
+        self.socket.recv_multipart.return_value = frames({"hehe": True})
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        request = {'id': {'uuid': 'abc'}}
+        self.client.send('hehe:1234', request)
+
+        assert sent(self.socket) == {'id': {'uuid': 'abc', 'ttl': 250}}
+        assert request == {'id': {'uuid': 'abc'}}
+
+    @mock.patch('kitten.client.budget')
+    def test_stamp_keeps_ttl(self, budget):
+        budget.return_value = 250
+        request = {'id': {'ttl': 1000}}
+
+        assert self.client.stamp(request) is request
+
+    @mock.patch('kitten.client.budget')
+    def test_stamp_deadline_passed(self, budget):
+        budget.return_value = 0
+
+        with pytest.raises(RequestError) as exc:
+            self.client.stamp({})
+
+        assert exc.value.code == 'TIMEOUT'
+
+    @mock.patch('kitten.client.budget')
+    def test_stamp_less_than_a_millisecond(self, budget):
+        budget.return_value = 0.7
+
+        with pytest.raises(RequestError) as exc:
+            self.client.stamp({})
+
+        assert exc.value.code == 'TIMEOUT'
+
+    @mock.patch('kitten.client.budget')
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Context')
+    def test_send_deadline_passed_not_retried(self, ctx, sleep, budget):
+        ctx.return_value = self.context
+        budget.return_value = 0
+
+        with pytest.raises(RequestError) as exc:
+            self.client.send('hehe:1234', {})
+
+        assert exc.value.code == 'TIMEOUT'
+        assert not sleep.called
+        assert not self.context.socket.called
+
+    @mock.patch('kitten.client.budget')
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_stops_retrying_at_deadline(self, ctx, poller, sleep,
+                                             budget):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = []
+        budget.side_effect = [500, 0]
+
+        with pytest.raises(RequestError) as exc:
+            self.client.send('hehe:1234', {})
+
+        assert exc.value.code == 'TIMEOUT'
+        assert sleep.call_count == 1
+        assert self.context.socket.call_count == 1
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_simple_send_times_out(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+
+        self.socket.recv_multipart.return_value = frames({"hehe": True})
+        poller.return_value.poll.return_value = []
+
+        with pytest.raises(RequestError):
+            self.client.send('hehe:1234', {})
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_reuses_socket(self, ctx, poller):
+        ctx.return_value = self.context
+
+        self.socket.recv_multipart.return_value = frames({"hehe": True})
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.client.send('hehe:1234', {})
+        self.client.send('hehe:1234', {})
+
+        assert ctx.call_count == 1
+        assert self.context.socket.call_count == 1
+        assert not self.socket.close.called
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_timeout_discards_socket(self, ctx, poller):
+        ctx.return_value = self.context
         poller.return_value.poll.return_value = []
+        self.client.retries = 0
 
         with pytest.raises(RequestError):
             self.client.send('hehe:1234', {})
+
+        self.socket.close.assert_called_once_with(linger=0)
+        assert len(self.client.pool) == 0
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_retries_on_new_socket(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+        self.socket.recv_multipart.return_value = frames({"hehe": True})
+        poller.return_value.poll.side_effect = [[], [], [(self.socket, 1)]]
+
+        ret = self.client.send('hehe:1234', {})
+
+        assert ret == {'hehe': True}
+        assert self.context.socket.call_count == 3
+        assert self.socket.close.call_count == 2
+        assert sleep.call_count == 2
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_gives_up_after_retries(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = []
+
+        with pytest.raises(RequestError) as exc:
+            self.client.send('hehe:1234', {})
+
+        assert exc.value.code == 'TIMEOUT'
+        assert self.context.socket.call_count == self.client.retries + 1
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_does_not_retry_other_errors(self, ctx, poller):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.socket.recv_multipart.side_effect = RequestError('BOOM', 'hehe')
+
+        with pytest.raises(RequestError) as exc:
+            self.client.send('hehe:1234', {})
+
+        assert exc.value.code == 'BOOM'
+        assert self.context.socket.call_count == 1
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_retries_busy_after_hint(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.socket.recv_multipart.side_effect = [
+            frames({'code': 'BUSY', 'retry_after': 5000}),
+            frames({'ack': True}),
+        ]
+
+        ret = self.client.send('hehe:1234', {})
+
+        assert ret == {'ack': True}
+        sleep.assert_called_once_with(5.0)
+
+        # A BUSY reply is a proper reply; the socket is still good.
+        assert self.context.socket.call_count == 1
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_gives_up_when_busy(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.socket.recv_multipart.return_value = frames(
+            {'code': 'BUSY', 'message': 'Full', 'retry_after': 10}
+        )
+
+        with pytest.raises(RequestError) as exc:
+            self.client.send('hehe:1234', {})
+
+        assert exc.value.code == 'BUSY'
+        assert exc.value.retry_after == 10
+        assert sleep.call_count == self.client.retries
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_send_polls_with_estimated_timeout(self, ctx, poller):
+        ctx.return_value = self.context
+        self.socket.recv_multipart.return_value = frames({"hehe": True})
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.client.get_estimator('hehe:1234').timeout = 321
+
+        self.client.send('hehe:1234', {})
+
+        poller.return_value.poll.assert_called_once_with(321)
+        assert self.client.estimates()['hehe:1234']['srtt'] is not None
+
+
+class TestClientCodecNegotiation(MockKittenClientMixin):
+    def setup_method(self, method):
+        super(TestClientCodecNegotiation, self).setup_method(method)
+        self.patch = mock.patch('kitten.conf.CODEC', 'json')
+        self.patch.start()
+
+    def teardown_method(self, method):
+        self.patch.stop()
+
+    def frame_count(self):
+        return len(self.socket.send_multipart.call_args[0][0])
+
+    def speaks(self, address='hehe:1234'):
+        formats = wire.parse_formats(wire.formats())
+        self.client.speaks[address] = (time.time(), formats)
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_sends_in_codec(self, ctx, poller):
+        ctx.return_value = self.context
+        self.socket.recv_multipart.return_value = frames({'hehe': True})
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.speaks()
+
+        self.client.send('hehe:1234', {'paradigm': 'node'})
+
+        assert self.frame_count() == 2
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_plain_to_peers_without_heartbeat(self, ctx, poller):
+        ctx.return_value = self.context
+        self.socket.recv_multipart.return_value = frames({'hehe': True})
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.client.heartbeat = mock.MagicMock(return_value=None)
+
+        self.client.send('hehe:1234', {'paradigm': 'node'})
+
+        assert self.frame_count() == 1
+        self.client.heartbeat.assert_called_once_with('hehe:1234')
+        assert self.client.speaks['hehe:1234'][1] is None
+
+    def test_asks_with_heartbeat(self):
+        self.client.heartbeat = mock.MagicMock(
+            return_value=heartbeat.Pong(1.0, 0, wire.formats()),
+        )
+
+        assert self.client.codec('hehe:1234') is wire.get_codec('json')
+        assert self.client.codec('hehe:1234') is wire.get_codec('json')
+        assert self.client.heartbeat.call_count == 1
+
+    def test_codec_not_listed(self):
+        self.client.heartbeat = mock.MagicMock(
+            return_value=heartbeat.Pong(1.0, 0, b'{"codecs": ["msgpack"]}'),
+        )
+
+        assert self.client.codec('hehe:1234') is None
+
+    def test_compression_not_listed(self):
+        self.client.heartbeat = mock.MagicMock(
+            return_value=heartbeat.Pong(1.0, 0, b'{"codecs": ["json"]}'),
+        )
+
+        assert self.client.codec('hehe:1234') is None
+
+    def test_failed_heartbeat(self):
+        self.client.heartbeat = mock.MagicMock(side_effect=zmq.ZMQError())
+
+        assert self.client.codec('hehe:1234') is None
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_no_codec_no_heartbeat(self, ctx, poller):
+        ctx.return_value = self.context
+        self.socket.recv_multipart.return_value = frames({'hehe': True})
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.client.heartbeat = mock.MagicMock()
+
+        with mock.patch('kitten.conf.CODEC', None):
+            self.client.send('hehe:1234', {'paradigm': 'node'})
+
+        assert not self.client.heartbeat.called
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_rejected_codec_retried_plain(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.socket.recv_multipart.side_effect = [
+            frames({'code': 'UNKNOWN_CODEC', 'message': 'hehe'}),
+            frames({'hehe': True}),
+        ]
+        self.client.retries = 0
+        self.speaks()
+
+        ret = self.client.send('hehe:1234', {'paradigm': 'node'})
+
+        assert ret == {'hehe': True}
+        assert self.frame_count() == 1
+        assert self.client.speaks['hehe:1234'][1] is None
+
+        # Right away, and without using up a retry
+        assert not sleep.called
+
+    @mock.patch('gevent.sleep')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_timeout_retried_in_codec(self, ctx, poller, sleep):
+        ctx.return_value = self.context
+        self.socket.recv_multipart.return_value = frames({'hehe': True})
+        poller.return_value.poll.side_effect = [[], [(self.socket, 1)]]
+        self.speaks()
+
+        self.client.send('hehe:1234', {'paradigm': 'node'})
+
+        assert self.frame_count() == 2
+
+    @mock.patch('kitten.client.time')
+    def test_asked_again_later(self, time):
+        time.time.return_value = 1000
+        self.client.heartbeat = mock.MagicMock(return_value=None)
+
+        assert self.client.codec('hehe:1234') is None
+        assert self.client.heartbeat.call_count == 1
+
+        self.client.heartbeat.return_value = heartbeat.Pong(
+            1.0, 0, wire.formats(),
+        )
+        time.time.return_value = 1000 + conf.CODEC_RETRY
+        assert self.client.codec('hehe:1234') is not None
+        assert self.client.heartbeat.call_count == 2
+
+    @mock.patch('kitten.client.DealerConnection')
+    def test_send_async_falls_back(self, dc):
+        dc.return_value.closed = False
+        results = []
+
+        def send(request, timeout, codec):
+            results.append(AsyncResult())
+            return results[-1]
+
+        dc.return_value.send.side_effect = send
+        self.speaks()
+
+        self.client.send_async('hehe:1234', {})
+        assert dc.return_value.send.call_args[0][2] is not None
+
+        results[0].set({'code': 'BAD_FRAMES'})
+        gevent.sleep(0)
+
+        self.client.send_async('hehe:1234', {})
+        assert dc.return_value.send.call_args[0][2] is None
+
+
+class TestRoundTripEstimator(object):
+    def setup_method(self, method):
+        self.estimator = RoundTripEstimator(2000, minimum=10, maximum=5000)
+
+    def test_initial(self):
+        assert self.estimator.timeout == 2000
+        assert self.estimator.srtt is None
+
+    def test_first_sample(self):
+        self.estimator.sample(100)
+
+        assert self.estimator.srtt == 100
+        assert self.estimator.rttvar == 50
+        assert self.estimator.timeout == 300
+
+    def test_following_samples_are_smoothed(self):
+        self.estimator.sample(100)
+        self.estimator.sample(180)
+
+        assert self.estimator.srtt == 110
+        assert self.estimator.rttvar == 57.5
+        assert self.estimator.timeout == 340
+
+    def test_stable_peer_converges(self):
+        for _ in range(100):
+            self.estimator.sample(20)
+
+        assert abs(self.estimator.srtt - 20) < 0.01
+        assert abs(self.estimator.timeout - 20) < 0.01
+
+    def test_clamped(self):
+        self.estimator.sample(1)
+        assert self.estimator.timeout == 10
+
+        self.estimator.sample(100000)
+        assert self.estimator.timeout == 5000
+
+    def test_backoff(self):
+        self.estimator.sample(100)
+        self.estimator.backoff()
+        assert self.estimator.timeout == 600
+
+        for _ in range(10):
+            self.estimator.backoff()
+        assert self.estimator.timeout == 5000
+
+    def test_as_dict(self):
+        self.estimator.sample(100)
+        assert self.estimator.as_dict() == {
+            'srtt': 100,
+            'rttvar': 50,
+            'timeout': 300,
+        }
+
+
+class TestDealerConnection(object):
+    def setup_method(self, method):
+        with mock.patch('kitten.client.context'):
+            with mock.patch('gevent.spawn'):
+                self.connection = DealerConnection('hehe:1234')
+        self.socket = self.connection.socket
+
+    def sent(self):
+        frames = self.socket.send_multipart.call_args[0][0]
+        assert frames[0] == b''
+        return wire.unpack(frames[1:]).data
+
+    def test_send_adds_uuid(self):
+        request = {'paradigm': 'node'}
+        self.connection.send(request, 1000)
+
+        assert 'uuid' in self.sent()['id']
+        assert 'id' not in request
+
+    def test_send_keeps_uuid(self):
+        self.connection.send({'id': {'uuid': 'abc'}}, 1000)
+
+        assert self.sent()['id']['uuid'] == 'abc'
+        assert 'abc' in self.connection.pending
+
+    def test_resolve_by_uuid(self):
+        first = self.connection.send({'id': {'uuid': 'a'}}, 1000)
+        second = self.connection.send({'id': {'uuid': 'b'}}, 1000)
+
+        self.connection.resolve({'id': {'uuid': 'b'}, 'code': 'OK'})
+
+        assert second.get(block=False) == {'id': {'uuid': 'b'}, 'code': 'OK'}
+        assert not first.ready()
+        assert self.connection.echoes is True
+
+    def test_resolve_without_uuid_in_order(self):
+        first = self.connection.send({}, 1000)
+        second = self.connection.send({}, 1000)
+
+        self.connection.resolve({'ack': True})
+
+        assert first.get(block=False) == {'ack': True}
+        assert not second.ready()
+
+    def test_resolve_busy(self):
+        result = self.connection.send({'id': {'uuid': 'a'}}, 1000)
+        self.connection.resolve({
+            'id': {'uuid': 'a'}, 'code': 'BUSY', 'retry_after': 100,
+        })
+
+        with pytest.raises(RequestError) as exc:
+            result.get(block=False)
+
+        assert exc.value.code == 'BUSY'
+        assert exc.value.retry_after == 100
+
+    def test_resolve_late_reply_dropped(self):
+        result = self.connection.send({'id': {'uuid': 'a'}}, 1000)
+        self.connection.resolve({'id': {'uuid': 'zombie'}})
+
+        assert not result.ready()
+
+    def test_expire(self):
+        self.connection.echoes = True
+        result = self.connection.send({'id': {'uuid': 'a'}}, 1000)
+        self.connection.expire('a', 1000)
+
+        with pytest.raises(RequestError) as exc:
+            result.get(block=False)
+
+        assert exc.value.code == 'TIMEOUT'
+        assert not self.connection.closed
+
+    def test_expire_resets_when_peer_does_not_echo(self):
+        first = self.connection.send({}, 1000)
+        second = self.connection.send({}, 1000)
+        key = list(self.connection.pending)[0]
+
+        self.connection.expire(key, 1000)
+
+        assert self.connection.closed
+        self.socket.close.assert_called_once_with(linger=0)
+        for result in (first, second):
+            with pytest.raises(RequestError):
+                result.get(block=False)
+
+    def test_undecodable_reply_dropped(self):
+        result = self.connection.send({}, 1000)
+        self.socket.recv_multipart.return_value = [
+            b'', b'{"codec": "rot13"}', b'hehe',
+        ]
+
+        self.connection.receive()
+
+        assert not result.ready()
+        assert not self.connection.closed
+
+    @mock.patch('zmq.green.Poller')
+    def test_reader_closes_when_it_dies(self, poller):
+        result = self.connection.send({}, 1000)
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.socket.recv_multipart.side_effect = zmq.ZMQError()
+
+        self.connection.read_forever()
+
+        assert self.connection.closed
+        with pytest.raises(RequestError) as exc:
+            result.get(block=False)
+        assert exc.value.code == 'CLOSED'
+
+
+class TestClientAsync(object):
+    def setup_method(self, method):
+        KittenClient.dealers.clear()
+        KittenClient.estimators.clear()
+        self.client = KittenClient()
+
+    def teardown_method(self, method):
+        KittenClient.dealers.clear()
+
+    @mock.patch('kitten.client.DealerConnection')
+    def test_send_async_reuses_connection(self, dc):
+        dc.return_value.closed = False
+        self.client.send_async('hehe:1234', {})
+        self.client.send_async('hehe:1234', {})
+
+        dc.assert_called_once_with('hehe:1234')
+        assert dc.return_value.send.call_count == 2
+
+    @mock.patch('kitten.client.DealerConnection')
+    def test_send_async_replaces_closed_connection(self, dc):
+        dc.return_value.closed = True
+        self.client.send_async('hehe:1234', {})
+        self.client.send_async('hehe:1234', {})
+
+        assert dc.call_count == 2
+
+    @mock.patch('kitten.client.DealerConnection')
+    def test_send_async_default_timeout(self, dc):
+        dc.return_value.closed = False
+        self.client.send_async('hehe:1234', {})
+
+        dc.return_value.send.assert_called_once_with(
+            {}, self.client.timeout, None
+        )
+
+    @mock.patch.object(KittenClient, 'send_async')
+    def test_send_many(self, send_async):
+        requests = [('a:1', {'n': 1}), ('b:2', {'n': 2})]
+        ret = self.client.send_many(requests, 500)
+
+        assert send_async.call_args_list == [
+            mock.call('a:1', {'n': 1}, 500),
+            mock.call('b:2', {'n': 2}, 500),
+        ]
+        assert len(ret) == 2
+
+
+class TestBatcher(object):
+    def setup_method(self, method):
+        self.client = mock.MagicMock()
+        self.batcher = Batcher(self.client, window=5, limit=3)
+
+    def test_error_goes_to_everyone(self):
+        self.client.send.side_effect = RequestError('TIMEOUT', 'hehe')
+
+        first = self.batcher.send('a:1', {})
+        second = self.batcher.send('a:1', {})
+
+        for result in (first, second):
+            with pytest.raises(RequestError):
+                result.get(timeout=1)
+
+    def test_mismatched_batch(self):
+        self.client.send.return_value = {'batch': [{}]}
+
+        first = self.batcher.send('a:1', {})
+        self.batcher.send('a:1', {})
+
+        with pytest.raises(RequestError) as exc:
+            first.get(timeout=1)
+
+        assert exc.value.code == 'BATCH_MISMATCH'
+
+    def test_flush_all(self):
+        self.client.send.return_value = {'batch': [{}]}
+        result = self.batcher.send('a:1', {})
+
+        self.batcher.flush_all()
+
+        assert self.batcher.timers == {}
+        assert result.get(timeout=1) == {}
+
+
+class TestClientHeartbeat(MockKittenClientMixin):
+    def pong(self, depth=0):
+        def reply(frame):
+            self.socket.recv.return_value = heartbeat.pong(frame, depth)
+        self.socket.send.side_effect = reply
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_heartbeat(self, ctx, poller):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.pong(depth=4)
+
+        pong = self.client.heartbeat('hehe:1234')
+
+        assert pong.depth == 4
+        assert pong.latency >= 0
+        self.socket.connect.assert_called_once_with('tcp://hehe:2234')
+        assert self.client.metrics.get('beats') >= 1
+
+        # Kept apart from the estimates that set request timeouts
+        assert self.client.beat_estimators['hehe:1234'].srtt is not None
+        assert 'hehe:1234' not in self.client.estimates()
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_heartbeat_reuses_socket(self, ctx, poller):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = [(self.socket, 1)]
+        self.pong()
+
+        self.client.heartbeat('hehe:1234')
+        self.client.heartbeat('hehe:1234')
+
+        assert self.context.socket.call_count == 1
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_heartbeat_silent_peer(self, ctx, poller):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = []
+
+        assert self.client.heartbeat('hehe:1234') is None
+        self.socket.close.assert_called_once_with(linger=0)
+
+        # Not retried for a while
+        assert self.client.heartbeat('hehe:1234') is None
+        assert self.socket.send.call_count == 1
+
+    @mock.patch('time.time')
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_heartbeat_silent_peer_retried_later(self, ctx, poller, time):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = []
+        time.return_value = 1000
+
+        self.client.heartbeat('hehe:1234')
+        time.return_value = 1000 + conf.HEARTBEAT_RETRY
+        self.client.heartbeat('hehe:1234')
+
+        assert self.socket.send.call_count == 2
+
+    @mock.patch('zmq.green.Poller')
+    @mock.patch('zmq.green.Context')
+    def test_heartbeat_timeout_is_capped(self, ctx, poller):
+        ctx.return_value = self.context
+        poller.return_value.poll.return_value = []
+
+        self.client.heartbeat('hehe:1234')
+
+        poller.return_value.poll.assert_called_once_with(
+            conf.HEARTBEAT_TIMEOUT
+        )
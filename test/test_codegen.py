@@ -0,0 +1,197 @@
+import pytest
+
+from jsonschema.exceptions import ValidationError
+from jsonschema.validators import validator_for
+from mock import MagicMock, patch
+
+from kitten import codegen
+from kitten.node import NodeValidator
+from kitten.validation import Validator
+
+STRINGS = {'type': 'array', 'items': {'type': 'string'}}
+
+# (schema, instances) shared by the generated checks and jsonschema. Each
+# instance is checked with both, so anything the checks get wrong shows up
+# as a difference.
+CONFORMANCE = [
+    ({}, [None, 1, 'a', [], {}]),
+    ({'type': 'string'}, ['', 'a', u'\xe9', 1, None, [], b'a']),
+    ({'type': 'integer'}, [0, -1, 2 ** 70, 1.5, True, '1', None]),
+    ({'type': 'number'}, [0, 1.5, -2, True, False, '1', None]),
+    ({'type': 'boolean'}, [True, False, 0, 1, None]),
+    ({'type': 'null'}, [None, 0, '', False]),
+    ({'type': 'object'}, [{}, {'a': 1}, [], 'a', None]),
+    ({'type': 'array'}, [[], [1], (), {}, 'a']),
+    ({'type': ['string', 'null']}, ['a', None, 1]),
+    ({'enum': ['OK', 'FAILED']}, ['OK', 'FAILED', 'ok', '', None, 1, ['OK']]),
+    (STRINGS, [[], ['a', 'b'], ['a', 1], [None], 'ab', None, {}]),
+    ({'items': {'type': 'string'}}, [['a'], [1], 'ab', 1]),
+    ({'minimum': 0}, [0, 1, -1, -0.5, 'a', None, True]),
+    ({'maximum': 10}, [10, 11, 9.5, 'z', None]),
+    ({'type': 'integer', 'minimum': 0}, [0, 5, -1, True]),
+    (
+        {'properties': {'a': {'type': 'string'}}},
+        [{}, {'a': 'x'}, {'a': 1}, {'b': 1}, [], 'a'],
+    ),
+    (
+        {'properties': {'a': {}}, 'additionalProperties': False},
+        [{}, {'a': 1}, {'b': 1}, {'a': 1, 'b': 2}, []],
+    ),
+    (
+        {'required': ['a'], 'properties': {'a': {'type': 'string'}}},
+        [{'a': 'x'}, {}, {'a': 1}, 'a'],
+    ),
+    (
+        {
+            'type': 'object',
+            'properties': {
+                'id': {
+                    'type': 'object',
+                    'properties': {'ttl': {'type': 'integer', 'minimum': 0}},
+                    'additionalProperties': False,
+                },
+                'nodes': STRINGS,
+            },
+            'additionalProperties': False,
+        },
+        [
+            {},
+            {'id': {}},
+            {'id': {'ttl': 5}},
+            {'id': {'ttl': -5}},
+            {'id': {'ttl': 'a'}},
+            {'id': {'hehe': 1}},
+            {'id': None},
+            {'nodes': ['a:1', 'b:2']},
+            {'nodes': ['a:1', 2]},
+            {'nodes': 'a:1'},
+            {'hehe': True},
+            [],
+        ],
+    ),
+]
+
+CASES = [
+    (schema, instance)
+    for schema, instances in CONFORMANCE
+    for instance in instances
+]
+
+UNSUPPORTED = [
+    {'pattern': '^a'},
+    {'type': 'hehe'},
+    {'enum': [1, 2]},
+    {'items': [{'type': 'string'}]},
+    {'additionalProperties': {'type': 'string'}},
+    {'properties': {'a': {'format': 'email'}}},
+]
+
+
+def jsonschema_valid(schema, instance):
+    cls = validator_for(schema)
+    return cls(schema).is_valid(instance)
+
+
+class TestCodegenConformance(object):
+    @pytest.mark.parametrize('schema,instance', CASES)
+    def test_never_passes_invalid(self, schema, instance):
+        check = codegen.build(schema)
+
+        if check(instance):
+            assert jsonschema_valid(schema, instance)
+
+    @pytest.mark.parametrize('schema,instance', [
+        (schema, instance)
+        for schema, instance in CASES
+        if not isinstance(instance, float)
+    ])
+    def test_same_verdict(self, schema, instance):
+        # Only floats that jsonschema takes as integers are left for it
+        check = codegen.build(schema)
+
+        assert check(instance) == jsonschema_valid(schema, instance)
+
+
+class TestCodegenBuild(object):
+    @pytest.mark.parametrize('schema', UNSUPPORTED)
+    def test_unsupported(self, schema):
+        assert codegen.build(schema) is None
+
+    def test_ignored_keywords(self):
+        check = codegen.build({'type': 'string', 'optional': True})
+        assert check('a')
+
+    def test_source(self):
+        check = codegen.build({'type': 'string'})
+        assert 'isinstance(data, string_types)' in check.source
+
+    def test_node_schemas(self):
+        validator = NodeValidator()
+        for method_name in validator.get_known_methods():
+            method = getattr(validator, method_name)
+            schema = validator.decorate_schema(method())
+            assert codegen.build(schema) is not None
+
+
+class TestValidatorCodegen(object):
+    def setup_method(self, method):
+        self.validator = NodeValidator()
+        self.paradigms = {'node': MagicMock(
+            validator=self.validator,
+            validation={},
+        )}
+
+    def validate(self, kind, data):
+        try:
+            getattr(self.validator, kind)(data, self.paradigms)
+        except ValidationError as e:
+            return e.message, list(e.path)
+
+    @pytest.mark.parametrize('kind,data', [
+        ('request', {'paradigm': 'node', 'method': 'ping'}),
+        ('request', {'paradigm': 'node', 'method': 'ping', 'hehe': 1}),
+        ('request', {'paradigm': 'node', 'method': 'sync', 'nodes': ['a']}),
+        ('request', {'paradigm': 'node', 'method': 'sync', 'nodes': [1]}),
+        ('request', {
+            'paradigm': 'node', 'method': 'ping', 'id': {'ttl': -1},
+        }),
+        ('response', {'paradigm': 'node', 'method': 'ping', 'code': 'OK'}),
+        ('response', {'paradigm': 'node', 'method': 'ping', 'code': 'NO'}),
+        ('response', {'paradigm': 'node', 'method': 'sync', 'nodes': 'a'}),
+    ])
+    def test_same_errors_as_jsonschema(self, kind, data):
+        with patch('kitten.conf.VALIDATION_CODEGEN', False):
+            expected = self.validate(kind, data)
+
+        self.validator = NodeValidator()
+        self.paradigms['node'].validator = self.validator
+
+        assert self.validate(kind, data) == expected
+        assert self.validator.checks
+
+    def test_generated_check_used(self):
+        data = {'paradigm': 'node', 'method': 'ping'}
+        self.validator.compile('ping_request')
+        compiled = self.validator.compiled['ping_request'] = MagicMock()
+
+        self.validate('request', data)
+
+        assert not compiled.iter_errors.called
+
+    @patch('kitten.conf.VALIDATION_CODEGEN', False)
+    def test_disabled(self):
+        self.validate('request', {'paradigm': 'node', 'method': 'ping'})
+
+        assert self.validator.checks == {}
+        assert 'ping_request' in self.validator.compiled
+
+    def test_unsupported_schema_falls_back(self):
+        validator = Validator()
+        validator.hehe_request = lambda: {'hehe': {'pattern': '^a'}}
+        paradigms = {'p': MagicMock(validator=validator, validation={})}
+        data = {'paradigm': 'p', 'method': 'hehe', 'hehe': 'b'}
+
+        with pytest.raises(ValidationError):
+            validator.request(data, paradigms)
+
+        assert validator.checks['hehe_request'] is None
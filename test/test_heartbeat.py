@@ -0,0 +1,56 @@
+from mock import patch
+
+from kitten import heartbeat
+
+
+class TestHeartbeatFrames(object):
+    def test_address(self):
+        with patch('kitten.conf.HEARTBEAT_OFFSET', 1000):
+            assert heartbeat.address('10.0.0.1:5555') == '10.0.0.1:6555'
+
+    def test_frame_is_tiny(self):
+        assert len(heartbeat.ping(1)) == heartbeat.FRAME.size < 32
+
+    def test_pong(self):
+        frame = heartbeat.pong(heartbeat.ping(7), 12)
+        kind, sequence, _, depth = heartbeat.FRAME.unpack(frame)
+
+        assert kind == heartbeat.PONG
+        assert sequence == 7
+        assert depth == 12
+
+    def test_pong_ignores_garbage(self):
+        assert heartbeat.pong(b'{"paradigm": "node"}', 0) is None
+
+    def test_pong_ignores_pongs(self):
+        frame = heartbeat.pong(heartbeat.ping(7), 0)
+        assert heartbeat.pong(frame, 0) is None
+
+    @patch('time.time')
+    def test_parse(self, time):
+        time.return_value = 100.0
+        frame = heartbeat.pong(heartbeat.ping(7), 3)
+
+        time.return_value = 100.25
+        pong = heartbeat.parse(frame, 7)
+
+        assert pong.latency == 250
+        assert pong.depth == 3
+
+    def test_pong_carries_formats(self):
+        frame = heartbeat.pong(heartbeat.ping(7), 3, b'hehe')
+        assert heartbeat.parse(frame, 7).formats == b'hehe'
+
+    def test_pong_without_formats(self):
+        frame = heartbeat.pong(heartbeat.ping(7), 3)
+        assert heartbeat.parse(frame, 7).formats == b''
+
+    def test_parse_wrong_sequence(self):
+        frame = heartbeat.pong(heartbeat.ping(7), 3)
+        assert heartbeat.parse(frame, 8) is None
+
+    def test_parse_ping(self):
+        assert heartbeat.parse(heartbeat.ping(7), 7) is None
+
+    def test_parse_garbage(self):
+        assert heartbeat.parse(b'hehe', 7) is None
@@ -105,6 +105,32 @@ class TestMain(object):
         assert popen.called
 
 
+    @patch('subprocess.Popen')
+    @patch('sys.argv')
+    @patch('argparse.ArgumentParser')
+    @patch('kitten.log')
+    @patch('kitten.bench')
+    @patch('kitten.server')
+    @patch('kitten.node')
+    @patch('kitten.db')
+    @patch('kitten.conf')
+    def test_bench_does_not_autostart(
+        self, conf, db, node, server, bench, log, ap, av, popen
+    ):
+        ap.return_value = self.parser
+        self.ns.command = 'bench'
+
+        server.is_running.return_value = False
+        bench.setup_parser.return_value = self.runner
+        self.runner.return_value = 0
+
+        with pytest.raises(SystemExit):
+            main()
+
+        assert self.runner.called
+        assert not popen.called
+
+
 class TestVersion(object):
     @patch('os.path.exists')
     def test_version_no_git_dir(self, exists):
@@ -1,5 +1,6 @@
 import pytest
 
+from kitten import cache
 from kitten.conf import DEFAULT_PORT
 from kitten.node import Node
 from kitten.node import NodeParadigm
@@ -8,9 +9,13 @@ from kitten.node import setup_parser
 from kitten.node import execute_parser
 from test.mocks import MockDatabaseMixin
 from test.mocks import MockKittenClientMixin
+from test.utils import frames, sent
 
 from mock import MagicMock, patch, call
 
+from kitten.client import KittenClient
+from kitten.heartbeat import Pong
+from kitten.request import KittenRequest
 from kitten.request import RequestError
 from jsonschema.exceptions import ValidationError
 
@@ -51,6 +56,15 @@ class TestNodeCreation(NodeTestBase):
         assert len(res) == 1
         assert res[0].address == "localhost:{0}".format(DEFAULT_PORT)
 
+    @patch.object(Node, 'ping')
+    def test_create_node_invalidates_cache(self, p):
+        p.return_value = True
+        generation = cache.responses.generation
+
+        Node.create(self.address)
+
+        assert cache.responses.generation == generation + 1
+
     @patch.object(Node, 'ping')
     def test_create_node_ping_fails(self, p):
         p.return_value = False
@@ -160,22 +174,24 @@ class TestNodeMessagingIntegration(MockKittenClientMixin):
         self.node = Node(self.host)
         super(TestNodeMessagingIntegration, self).setup_method(method)
 
+    @patch.object(KittenClient, 'heartbeat')
     @patch('zmq.green.Poller')
     @patch('zmq.green.Context')
-    def test_ping(self, ctx, poller):
+    def test_ping(self, ctx, poller, heartbeat):
         ctx.return_value = self.context
+        heartbeat.return_value = None
 
-        self.socket.recv_json.return_value = {
+        self.socket.recv_multipart.return_value = frames({
             "code": "OK",
             "method": "ping",
             "paradigm": "node",
-        }
+        })
         poller.return_value.poll.return_value = [(self.socket, 1)]
 
         ret = self.node.ping()
 
         assert ret is True
-        assert self.socket.send_json.called
+        assert self.socket.send_multipart.called
 
         # Make sure that it adds the tcp:// part.
         self.socket.connect.assert_called_once_with(
@@ -183,6 +199,16 @@ class TestNodeMessagingIntegration(MockKittenClientMixin):
         )
 
 
+    @patch.object(KittenClient, 'send')
+    @patch.object(KittenClient, 'heartbeat')
+    def test_ping_uses_heartbeat(self, heartbeat, send):
+        heartbeat.return_value = Pong(1.5, 0)
+
+        assert self.node.ping() is True
+        heartbeat.assert_called_once_with(self.host)
+        assert not send.called
+
+
 class TestNodeParadigmPing(object):
     def setup_method(self, method):
         self.paradigm = NodeParadigm()
@@ -232,12 +258,12 @@ class TestNodeSync(NodeTestBase, MockKittenClientMixin):
             'paradigm': 'node',
             'nodes': [],
         }
-        self.socket.recv_json.return_value = request
+        self.socket.recv_multipart.return_value = frames(request)
         poller.return_value.poll.return_value = [(self.socket, 1)]
 
         self.node.sync()
 
-        self.socket.send_json.assert_called_once_with(request)
+        assert sent(self.socket) == request
         assert not create.called
 
     @patch.object(Node, 'create')
@@ -247,20 +273,20 @@ class TestNodeSync(NodeTestBase, MockKittenClientMixin):
         ctx.return_value = self.context
         node = 'node.js'
 
-        self.socket.recv_json.return_value = {
+        self.socket.recv_multipart.return_value = frames({
             'method': 'sync',
             'paradigm': 'node',
             'nodes': [node],
-        }
+        })
         poller.return_value.poll.return_value = [(self.socket, 1)]
 
         self.node.sync()
 
-        self.socket.send_json.assert_called_once_with({
+        assert sent(self.socket) == {
             'nodes': [],
             'method': 'sync',
             'paradigm': 'node',
-        })
+        }
 
         create.assert_called_once_with(node, True)
 
@@ -271,26 +297,37 @@ class TestNodeSync(NodeTestBase, MockKittenClientMixin):
         ctx.return_value = self.context
         nodes = ['neverland.ca.org', 'node.js', 'hehe.people.nu']
 
-        self.socket.recv_json.return_value = {
+        self.socket.recv_multipart.return_value = frames({
             'method': 'sync',
             'paradigm': 'node',
             'nodes': nodes,
-        }
+        })
         poller.return_value.poll.return_value = [(self.socket, 1)]
 
         self.node.sync()
 
-        self.socket.send_json.assert_called_once_with({
+        assert sent(self.socket) == {
             'nodes': [],
             'method': 'sync',
             'paradigm': 'node',
-        })
+        }
 
         calls = create.call_args_list
         assert len(calls) == 3
         for x, address in enumerate(nodes):
             assert calls[x] == call(address, True)
 
+    @patch.object(Node, 'create')
+    def test_repeated_sync_creates_nodes_every_time(self, create):
+        request = KittenRequest({
+            'paradigm': 'node', 'method': 'sync', 'nodes': ['node.js'],
+        })
+
+        for _ in range(2):
+            request.execute()
+
+        assert create.call_args_list == [call('node.js', True)] * 2
+
     @patch.object(Node, 'create')
     def test_sync_response(self, create):
         nodes = sorted(['neverland.ca.org', 'node.js', 'hehe.people.nu'])
@@ -0,0 +1,195 @@
+import pytest
+import gevent
+
+from gevent.event import Event
+from jsonschema.exceptions import ValidationError
+from mock import MagicMock, patch
+
+from kitten.paradigm import Paradigm
+from kitten.paradigm import annotate
+from kitten.request import RequestError
+
+from test.mocks import MockParadigm
+
+
+class CoalescingParadigm(MockParadigm):
+    name = 'mock'
+    coalesce = ('method',)
+
+
+class TestParadigmSend(object):
+    def setup_method(self, method):
+        self.paradigm = MockParadigm()
+        self.paradigm.client = MagicMock()
+        self.paradigm.client.send.return_value = {
+            'paradigm': 'mock',
+            'method': 'method',
+            'code': 'OK',
+        }
+
+    def test_name(self):
+        assert self.paradigm.name == 'mock'
+
+    def test_send_validates_and_sends(self):
+        request = {'paradigm': 'mock', 'method': 'method', 'field': 1}
+        ret = self.paradigm.send('a:1', request)
+
+        self.paradigm.client.send.assert_called_once_with('a:1', request)
+        assert ret['code'] == 'OK'
+
+    def test_send_invalid_request(self):
+        request = {'paradigm': 'mock', 'method': 'method', 'field': 'x'}
+
+        with pytest.raises(ValidationError):
+            self.paradigm.send('a:1', request)
+
+        assert not self.paradigm.client.send.called
+
+    @patch('kitten.conf.VALIDATION', 'boundary')
+    def test_send_boundary_checks_only_response(self):
+        request = {'paradigm': 'mock', 'method': 'method', 'field': 'x'}
+        self.paradigm.send('a:1', request)
+
+        self.paradigm.client.send.return_value['code'] = 1
+        with pytest.raises(ValidationError):
+            self.paradigm.send('a:1', request)
+
+
+class TestParadigmCoalescing(object):
+    def setup_method(self, method):
+        Paradigm.inflight.clear()
+        Paradigm.metrics.reset()
+
+        self.release = Event()
+        self.paradigm = CoalescingParadigm()
+        self.paradigm.client = MagicMock()
+        self.paradigm.client.send.side_effect = self.slow_send
+
+        self.request = {'paradigm': 'mock', 'method': 'method', 'field': 1}
+
+    def slow_send(self, address, request):
+        self.release.wait()
+        return {'paradigm': 'mock', 'method': 'method', 'code': 'OK'}
+
+    def spawn(self, address='a:1', request=None):
+        return gevent.spawn(
+            self.paradigm.send, address, request or dict(self.request)
+        )
+
+    def finish(self, greenlets):
+        gevent.sleep(0)
+        self.release.set()
+        gevent.joinall(greenlets, timeout=1)
+
+    def test_identical_requests_share_round_trip(self):
+        greenlets = [self.spawn() for _ in range(3)]
+        self.finish(greenlets)
+
+        assert self.paradigm.client.send.call_count == 1
+        assert all(g.value['code'] == 'OK' for g in greenlets)
+        assert Paradigm.metrics.get('coalesced') == 2
+        assert Paradigm.inflight == {}
+
+    def test_id_does_not_prevent_coalescing(self):
+        first = dict(self.request, id={'uuid': 'a'})
+        second = dict(self.request, id={'uuid': 'b'})
+        greenlets = [self.spawn(request=first), self.spawn(request=second)]
+        self.finish(greenlets)
+
+        assert self.paradigm.client.send.call_count == 1
+
+    def test_different_addresses_not_coalesced(self):
+        greenlets = [self.spawn('a:1'), self.spawn('b:2')]
+        self.finish(greenlets)
+
+        assert self.paradigm.client.send.call_count == 2
+
+    def test_different_payloads_not_coalesced(self):
+        other = dict(self.request, field=2)
+        greenlets = [self.spawn(), self.spawn(request=other)]
+        self.finish(greenlets)
+
+        assert self.paradigm.client.send.call_count == 2
+
+    def test_not_opted_in(self):
+        self.paradigm.coalesce = ()
+        greenlets = [self.spawn() for _ in range(2)]
+        self.finish(greenlets)
+
+        assert self.paradigm.client.send.call_count == 2
+        assert Paradigm.metrics.get('coalesced') == 0
+
+    def test_errors_are_shared(self):
+        def fail(address, request):
+            self.release.wait()
+            raise RequestError('TIMEOUT', 'hehe')
+
+        self.paradigm.client.send.side_effect = fail
+        greenlets = [self.spawn() for _ in range(2)]
+        self.finish(greenlets)
+
+        assert self.paradigm.client.send.call_count == 1
+        assert all(isinstance(g.exception, RequestError) for g in greenlets)
+        assert Paradigm.inflight == {}
+
+    def test_responses_are_copies(self):
+        greenlets = [self.spawn() for _ in range(2)]
+        self.finish(greenlets)
+
+        first, second = [g.value for g in greenlets]
+        assert first == second
+        assert first is not second
+
+    def test_interrupted_first_caller(self):
+        first = self.spawn()
+        gevent.sleep(0)
+        second = self.spawn()
+        gevent.sleep(0)
+
+        first.kill(gevent.Timeout(0.1))
+        second.join(timeout=1)
+
+        assert second.ready()
+        assert isinstance(second.exception, RequestError)
+        assert second.exception.code == 'INTERRUPTED'
+        assert Paradigm.inflight == {}
+
+
+class HandlingParadigm(Paradigm):
+    def echo_response(self, request):
+        return {'code': 'OK'}
+
+    @annotate
+    def ping_response(self, request):
+        return {'code': 'OK'}
+
+    def ping_request(self):
+        return {}
+
+
+class TestParadigmHandlers(object):
+    def test_name_from_class(self):
+        assert HandlingParadigm.name == 'handling'
+
+    def test_name_set_by_class(self):
+        assert CoalescingParadigm.name == 'mock'
+
+    def test_responders(self):
+        assert HandlingParadigm.responders == {
+            'echo': 'echo_response',
+            'ping': 'ping_response',
+        }
+
+    def test_handlers_are_bound(self):
+        paradigm = HandlingParadigm()
+
+        assert set(paradigm.handlers) == set(['echo', 'ping'])
+        assert paradigm.handlers['echo'] == paradigm.echo_response
+
+    def test_annotated_handler(self):
+        paradigm = HandlingParadigm()
+        ret = paradigm.handlers['ping']({})
+
+        assert ret == {'code': 'OK', 'paradigm': 'handling', 'method': 'ping'}
+        assert HandlingParadigm.ping_response.__name__ == 'ping_response'
+
@@ -0,0 +1,138 @@
+from mock import MagicMock, patch
+
+from kitten import pool
+from kitten.pool import SocketPool
+
+
+class TestContext(object):
+    def setup_method(self, method):
+        pool.reset()
+
+    def teardown_method(self, method):
+        pool.reset()
+
+    @patch('zmq.green.Context')
+    def test_context_is_shared(self, Context):
+        assert pool.context() is pool.context()
+        assert Context.call_count == 1
+
+    @patch('os.getpid')
+    @patch('zmq.green.Context')
+    def test_context_recreated_after_fork(self, Context, getpid):
+        Context.side_effect = [MagicMock(), MagicMock()]
+        getpid.return_value = 100
+        first = pool.context()
+
+        getpid.return_value = 101
+        second = pool.context()
+
+        assert first is not second
+        assert Context.call_count == 2
+
+
+class TestSocketPool(object):
+    def setup_method(self, method):
+        self.pool = SocketPool(size=2, idle=60)
+        self.pool.connect = MagicMock(
+            side_effect=lambda a: MagicMock(closed=False)
+        )
+
+    def test_acquire_connects(self):
+        socket = self.pool.acquire('host:1')
+
+        self.pool.connect.assert_called_once_with('host:1')
+        assert socket is not None
+
+    def test_acquire_after_release_reuses(self):
+        socket = self.pool.acquire('host:1')
+        self.pool.release('host:1', socket)
+
+        assert self.pool.acquire('host:1') is socket
+        assert self.pool.connect.call_count == 1
+
+    def test_acquired_socket_is_not_shared(self):
+        first = self.pool.acquire('host:1')
+        second = self.pool.acquire('host:1')
+
+        assert first is not second
+
+    def test_acquire_skips_closed(self):
+        socket = self.pool.acquire('host:1')
+        self.pool.release('host:1', socket)
+        socket.closed = True
+
+        assert self.pool.acquire('host:1') is not socket
+        assert self.pool.connect.call_count == 2
+
+    def test_release_duplicate_closes(self):
+        first = self.pool.acquire('host:1')
+        second = self.pool.acquire('host:1')
+        self.pool.release('host:1', first)
+        self.pool.release('host:1', second)
+
+        assert len(self.pool) == 1
+        second.close.assert_called_once_with(linger=0)
+
+    def test_release_over_cap_closes_oldest(self):
+        sockets = [self.pool.acquire('host:{0}'.format(x)) for x in range(3)]
+        for x, socket in enumerate(sockets):
+            self.pool.release('host:{0}'.format(x), socket)
+
+        assert len(self.pool) == 2
+        assert 'host:0' not in self.pool.sockets
+        sockets[0].close.assert_called_once_with(linger=0)
+
+    @patch('time.time')
+    def test_evict_idle(self, time):
+        time.return_value = 1000
+        socket = self.pool.acquire('host:1')
+        self.pool.release('host:1', socket)
+
+        time.return_value = 1061
+        self.pool.evict()
+
+        assert len(self.pool) == 0
+        socket.close.assert_called_once_with(linger=0)
+
+    @patch('time.time')
+    def test_evict_keeps_fresh(self, time):
+        time.return_value = 1000
+        socket = self.pool.acquire('host:1')
+        self.pool.release('host:1', socket)
+
+        time.return_value = 1059
+        self.pool.evict()
+
+        assert len(self.pool) == 1
+
+    def test_discard_closes(self):
+        socket = self.pool.acquire('host:1')
+        self.pool.discard(socket)
+
+        socket.close.assert_called_once_with(linger=0)
+        assert len(self.pool) == 0
+
+    def test_clear(self):
+        socket = self.pool.acquire('host:1')
+        self.pool.release('host:1', socket)
+        self.pool.clear()
+
+        assert len(self.pool) == 0
+        socket.close.assert_called_once_with(linger=0)
+
+
+class TestSocketPoolConnect(object):
+    def setup_method(self, method):
+        pool.reset()
+
+    @patch('zmq.green.Context')
+    def test_connect(self, Context):
+        socket = SocketPool().connect('host:1')
+
+        assert socket is Context.return_value.socket.return_value
+        socket.connect.assert_called_once_with('tcp://host:1')
+
+    @patch('zmq.green.Context')
+    def test_connect_full_address(self, Context):
+        socket = SocketPool().connect('tcp://host:1')
+        socket.connect.assert_called_once_with('tcp://host:1')
@@ -0,0 +1,193 @@
+import errno
+import signal
+
+import zmq
+
+from mock import MagicMock, patch, call
+
+from kitten import conf
+from kitten.prefork import PreforkServer
+from kitten.prefork import WorkerServer
+from kitten.server import start_server
+
+
+class TestWorkerServer(object):
+    def setup_method(self, method):
+        self.server = WorkerServer(MagicMock(), 'ipc://hehe', 2)
+
+    def test_listener_connects_to_backend(self):
+        self.server.get_socket = MagicMock()
+        self.server.get_listener()
+
+        self.server.get_socket.assert_called_once_with(
+            zmq.ROUTER, 'ipc://hehe', bind=False
+        )
+
+    def test_no_pidfile(self):
+        self.server.setup_signals = MagicMock()
+        self.server.setup_pidfile = MagicMock()
+
+        self.server.setup()
+        self.server.teardown_pidfile()
+
+        assert self.server.setup_signals.called
+        assert not self.server.setup_pidfile.called
+
+    @patch('gevent.spawn')
+    def test_no_heartbeat(self, spawn):
+        self.server.setup = MagicMock()
+        self.server.start()
+
+        assert self.server.heartbeat is None
+
+
+class TestPreforkServer(object):
+    def setup_method(self, method):
+        ns = MagicMock()
+        ns.port = 4000
+        self.server = PreforkServer(ns, 3)
+
+    def test_backend(self):
+        assert self.server.backend == conf.backend(4000)
+        assert self.server.backend.startswith('ipc://')
+
+    @patch('gevent.spawn')
+    @patch('gevent.fork')
+    def test_start_forks_workers(self, fork, spawn):
+        fork.side_effect = [101, 102, 103]
+        self.server.setup = MagicMock()
+
+        self.server.start()
+
+        assert self.server.children == {101: 0, 102: 1, 103: 2}
+        assert fork.call_count == 3
+        assert call(self.server.supervise_forever) in spawn.call_args_list
+
+    def test_relay(self):
+        frontend = MagicMock()
+        backend = MagicMock()
+        poller = MagicMock()
+
+        poller.poll.return_value = [(frontend, 1)]
+        self.server.relay(poller, frontend, backend)
+
+        backend.send_multipart.assert_called_once_with(
+            frontend.recv_multipart.return_value, copy=False
+        )
+        assert self.server.depth() == 1
+
+        poller.poll.return_value = [(backend, 1)]
+        self.server.relay(poller, frontend, backend)
+
+        frontend.send_multipart.assert_called_once_with(
+            backend.recv_multipart.return_value, copy=False
+        )
+        assert self.server.depth() == 0
+
+    @patch('os.waitpid')
+    def test_supervise_restarts_dead_workers(self, waitpid):
+        self.server.children = {101: 0, 102: 1}
+        self.server.spawn_worker = MagicMock()
+        waitpid.side_effect = lambda pid, flags: (pid if pid == 102 else 0, 0)
+
+        self.server.supervise()
+
+        self.server.spawn_worker.assert_called_once_with(1)
+        assert self.server.children == {101: 0}
+        assert self.server.metrics.get('restarts') >= 1
+
+    @patch('os.waitpid')
+    def test_supervise_lost_child(self, waitpid):
+        self.server.children = {101: 0}
+        self.server.spawn_worker = MagicMock()
+        waitpid.side_effect = OSError(errno.ECHILD, 'No child processes')
+
+        self.server.supervise()
+
+        self.server.spawn_worker.assert_called_once_with(0)
+
+    @patch('os.waitpid')
+    def test_supervise_not_while_stopping(self, waitpid):
+        self.server.children = {101: 0}
+        self.server.spawn_worker = MagicMock()
+        self.server.stopping = True
+        waitpid.return_value = (101, 0)
+
+        self.server.supervise()
+
+        assert not self.server.spawn_worker.called
+
+    @patch('os.waitpid')
+    @patch('os.kill')
+    def test_teardown_workers(self, kill, waitpid):
+        self.server.children = {101: 0, 102: 1}
+        self.server.supervisor = MagicMock()
+        waitpid.side_effect = lambda pid, flags: (pid, 0)
+
+        self.server.teardown_workers()
+
+        assert self.server.stopping
+        assert self.server.children == {}
+        assert kill.call_args_list == [
+            call(101, signal.SIGTERM),
+            call(102, signal.SIGTERM),
+        ] or kill.call_args_list == [
+            call(102, signal.SIGTERM),
+            call(101, signal.SIGTERM),
+        ]
+
+    @patch('kitten.conf.WORKER_TIMEOUT', 0)
+    @patch('os.waitpid')
+    @patch('os.kill')
+    def test_teardown_kills_stuck_workers(self, kill, waitpid):
+        self.server.children = {101: 0}
+        waitpid.side_effect = lambda pid, flags: (pid if not flags else 0, 0)
+
+        self.server.teardown_workers()
+
+        assert kill.call_args_list == [
+            call(101, signal.SIGTERM),
+            call(101, signal.SIGKILL),
+        ]
+        assert self.server.children == {}
+
+    @patch('os._exit')
+    @patch('kitten.prefork.WorkerServer')
+    def test_run_worker(self, Worker, exit):
+        self.server.listener = MagicMock()
+        Worker.return_value.start.return_value.join.side_effect = SystemExit(0)
+
+        self.server.run_worker(1)
+
+        Worker.assert_called_once_with(self.server.ns, self.server.backend, 1)
+        exit.assert_called_once_with(0)
+
+    @patch('os._exit')
+    @patch('kitten.prefork.WorkerServer')
+    def test_run_worker_crash(self, Worker, exit):
+        Worker.side_effect = ValueError('hehe')
+
+        self.server.run_worker(1)
+
+        exit.assert_called_once_with(1)
+
+
+class TestStartServer(object):
+    @patch('gevent.wait')
+    @patch('kitten.prefork.PreforkServer')
+    def test_workers(self, Prefork, wait):
+        ns = MagicMock()
+        ns.workers = 4
+        start_server(ns)
+
+        Prefork.assert_called_once_with(ns, 4)
+        assert Prefork.return_value.start.called
+
+    @patch('gevent.wait')
+    @patch('kitten.prefork.PreforkServer')
+    @patch('kitten.server.KittenServer')
+    def test_single_process(self, Server, Prefork, wait):
+        start_server(MagicMock())
+
+        assert Server.return_value.start.called
+        assert not Prefork.called
@@ -0,0 +1,105 @@
+import pytest
+import gevent
+
+from mock import MagicMock
+from gevent.queue import Full
+
+from kitten.queues import RequestQueue
+
+
+def item(priority=None):
+    return MagicMock(priority=priority)
+
+
+class TestRequestQueue(object):
+    def setup_method(self, method):
+        self.queue = RequestQueue({'high': 3, 'low': 1}, 1000, 'low')
+
+    def test_classify(self):
+        assert self.queue.classify(item('high')) == 'high'
+        assert self.queue.classify(item('low')) == 'low'
+
+    def test_classify_unknown_goes_in_default(self):
+        assert self.queue.classify(item('hehe')) == 'low'
+        assert self.queue.classify('plain') == 'low'
+
+    def test_bad_default(self):
+        with pytest.raises(ValueError):
+            RequestQueue({'high': 1}, 10, 'low')
+
+    def test_fifo_within_class(self):
+        items = [item('low') for _ in range(3)]
+        for i in items:
+            self.queue.put_nowait(i)
+
+        assert [self.queue.get() for _ in items] == items
+
+    def test_qsize_and_empty(self):
+        assert self.queue.empty()
+
+        self.queue.put_nowait(item('high'))
+        self.queue.put_nowait(item('low'))
+
+        assert self.queue.qsize() == 2
+        assert not self.queue.empty()
+        assert self.queue.depths() == {'high': 1, 'low': 1}
+
+    def test_full_per_class(self):
+        queue = RequestQueue({'high': 1, 'low': 1}, 1, 'low')
+        queue.put_nowait(item('low'))
+
+        with pytest.raises(Full):
+            queue.put_nowait(item('low'))
+
+        # Other classes still have room
+        queue.put_nowait(item('high'))
+        assert queue.qsize() == 2
+
+    def test_weighted_fair(self):
+        for _ in range(8):
+            self.queue.put_nowait(item('high'))
+            self.queue.put_nowait(item('low'))
+
+        taken = [self.queue.get().priority for _ in range(8)]
+
+        assert taken.count('high') == 6
+        assert taken.count('low') == 2
+
+    def test_low_class_is_not_starved(self):
+        for _ in range(100):
+            self.queue.put_nowait(item('high'))
+        self.queue.put_nowait(item('low'))
+
+        taken = [self.queue.get().priority for _ in range(4)]
+
+        assert 'low' in taken
+
+    def test_burst_does_not_delay_other_class(self):
+        for _ in range(100):
+            self.queue.put_nowait(item('low'))
+        self.queue.put_nowait(item('high'))
+
+        assert self.queue.get().priority == 'high'
+
+    def test_get_blocks_until_put(self):
+        getter = gevent.spawn(self.queue.get)
+        gevent.sleep(0)
+        assert not getter.ready()
+
+        i = item('high')
+        self.queue.put_nowait(i)
+
+        assert getter.get(timeout=1) is i
+
+    def test_metrics(self):
+        self.queue.metrics.reset()
+        self.queue.put_nowait(item('high'))
+        self.queue.put_nowait(item('high'))
+
+        assert self.queue.metrics.get('high_depth') == 2
+
+        self.queue.get()
+
+        assert self.queue.metrics.get('high_depth') == 1
+        assert self.queue.metrics.get('high_dequeued') == 1
+        assert self.queue.metrics.get('high_wait') >= 0
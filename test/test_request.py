@@ -5,10 +5,15 @@ from itertools import product
 from copy import deepcopy
 from mock import MagicMock, patch
 
+from kitten import wire
+from kitten.cache import ResponseCache
 from kitten.server import KittenServer
 from kitten.request import KittenRequest
+from kitten.request import RequestError
+from kitten.request import budget
 
 from test.mocks import MockDatabaseMixin
+from test.utils import frames, sent
 
 
 class RequestMixin(object):
@@ -34,7 +39,7 @@ class RequestMixin(object):
     def check_code(self, code, msg):
         check = {'code': code, 'message': msg}
         check.update(self.request_payload)
-        self.socket.send_json.assert_called_once_with(check)
+        assert sent(self.socket) == check
 
 
 
@@ -62,8 +67,12 @@ class TestRequestProcessPhases(RequestMixin):
         self.socket = MagicMock()
         super(TestRequestProcessPhases, self).setup_method(method)
 
-    def check_phase(self, request, confirm, method):
-        request = KittenRequest(request)
+    @patch.object(wire, 'recv')
+    @patch.object(wire, 'send')
+    def check_phase(self, request, confirm, method, send, recv):
+        # The response goes back in the codec of the request
+        codec = wire.get_codec('json')
+        request = KittenRequest(wire.unpack(wire.pack(request, codec)))
 
         response = MagicMock()
         confirm.return_value = response
@@ -71,9 +80,9 @@ class TestRequestProcessPhases(RequestMixin):
         request.process(self.socket)
 
         confirm.assert_called_once_with()
-        self.socket.send_json.assert_called_once_with(response)
-        self.socket.recv_json.assert_called_once_with()
-        method.assert_called_once_with(self.socket.recv_json.return_value)
+        send.assert_called_once_with(self.socket, response, codec)
+        recv.assert_called_once_with(self.socket)
+        method.assert_called_once_with(recv.return_value.data)
 
     @patch.object(KittenRequest, 'process_confirm')
     @patch.object(KittenRequest, 'process_request_payload')
@@ -96,6 +105,23 @@ class TestRequestProcessPhases(RequestMixin):
         self.check_phase(self.response_ack, pc, ack)
 
 
+class TestRequestProcessConfirm(RequestMixin):
+    @patch('kitten.conf.CALLBACK_TIMEOUT', 123)
+    @patch.object(KittenRequest, 'process_request_payload')
+    @patch.object(wire, 'send')
+    def test_confirm_timeout(self, send, payload):
+        socket = MagicMock()
+        socket.poll.return_value = 0
+        payload.return_value = {}
+
+        with pytest.raises(RequestError) as exc:
+            KittenRequest(self.request_payload).process(socket)
+
+        assert exc.value.code == 'TIMEOUT'
+        socket.poll.assert_called_once_with(123)
+        assert not socket.recv_multipart.called
+
+
 class TestRequestProcessIntegration(RequestMixin):
     def setup_method(self, method):
         self.socket = MagicMock()
@@ -105,6 +131,7 @@ class TestRequestProcessIntegration(RequestMixin):
 class TestRequestProcessErrors(RequestMixin):
     def setup_method(self, method):
         self.socket = MagicMock()
+        self.socket.recv_multipart.return_value = frames({})
         super(TestRequestProcessErrors, self).setup_method(method)
 
     @patch.object(KittenRequest, 'process_request_payload')
@@ -136,6 +163,7 @@ class TestRequestHandle(RequestMixin):
         response = {'haha': 'fak u'}
         paradigm = MagicMock()
         paradigm.scale_response.return_value = response
+        paradigm.handlers = {m: paradigm.scale_response}
 
         request = KittenRequest(data)
         request.paradigms = {p: paradigm}
@@ -190,3 +218,383 @@ class TestRequestHost(object):
 
         ret = request.host
         assert ret == 'tcp://{0}'.format(self._from)
+
+    def test_unknown_kind(self):
+        self.data['id']['kind'] = 'req'
+        request = KittenRequest(self.data)
+
+        assert request.host is None
+
+    def test_no_id(self):
+        request = KittenRequest({'paradigm': 'node', 'method': 'ping'})
+
+        assert request.kind == 'request'
+        assert request.phase == 'payload'
+        assert request.host is None
+
+    def test_uuid_only(self):
+        request = KittenRequest({'id': {'uuid': 'abc'}})
+
+        assert request.kind == 'request'
+        assert request.host is None
+
+
+class TestRequestExecute(object):
+    def test_execute_without_id(self):
+        request = KittenRequest({'paradigm': 'node', 'method': 'ping'})
+        request.validate_request = MagicMock()
+        request.validate_response = MagicMock()
+
+        ret = request.execute()
+
+        assert ret == {'code': 'OK', 'paradigm': 'node', 'method': 'ping'}
+
+    def test_execute_error(self):
+        request = KittenRequest({'paradigm': 'node', 'method': 'hehe'})
+        request.validate_request = MagicMock()
+
+        ret = request.execute()
+
+        assert ret['code'] == 'UNKNOWN_ERROR'
+        assert ret['message'] == "Method 'hehe' not handled by 'node'"
+
+
+class TestRequestDeadline(object):
+    def request(self, ttl, kind='request'):
+        return KittenRequest({
+            'id': {'uuid': 'abc', 'kind': kind, 'ttl': ttl},
+            'paradigm': 'node',
+            'method': 'ping',
+        })
+
+    def test_no_ttl(self):
+        request = KittenRequest({'paradigm': 'node', 'method': 'ping'})
+
+        assert request.deadline is None
+        assert not request.expired()
+
+    def test_deadline_counts_from_receipt(self):
+        request = self.request(500)
+        assert request.deadline == request.received + 0.5
+
+    @patch('time.time')
+    def test_expired(self, time):
+        time.return_value = 100.0
+        request = self.request(500)
+        assert not request.expired()
+
+        time.return_value = 100.5
+        assert request.expired()
+
+    def test_invalid_ttl(self):
+        for ttl in ('500', -1, True, None, [500]):
+            request = self.request(ttl)
+
+            assert request.deadline is None
+            assert not request.expired()
+
+    def test_responses_do_not_expire(self):
+        request = self.request(0, kind='response')
+
+        assert request.deadline is None
+        assert not request.expired()
+
+    def test_no_budget_outside_requests(self):
+        assert budget() is None
+
+    def test_budget_in_handler(self):
+        budgets = []
+
+        def handler(request):
+            budgets.append(budget())
+            return {'code': 'OK'}
+
+        paradigm = MagicMock(handlers={'ping': handler})
+        request = self.request(500)
+        request.paradigms = {'node': paradigm}
+        request.validate_request = MagicMock()
+        request.validate_response = MagicMock()
+
+        request.execute()
+
+        assert 0 < budgets[0] <= 500
+        assert budget() is None
+
+
+class TestRequestCache(object):
+    def setup_method(self, method):
+        self.handler = MagicMock(return_value={'code': 'OK'})
+        self.paradigm = MagicMock(
+            cache={'test': 10},
+            handlers={'test': self.handler},
+        )
+        self.data = {'paradigm': 'test', 'method': 'test', 'hehe': 1}
+
+    def dispatch(self, data):
+        request = KittenRequest(data)
+        request.paradigms = {'test': self.paradigm}
+        request.responses = ResponseCache()
+        request.validate_request = MagicMock()
+        request.validate_response = MagicMock()
+        return request
+
+    def test_cached(self):
+        request = self.dispatch(self.data)
+
+        assert request.dispatch(self.data) == {'code': 'OK'}
+        assert request.dispatch(self.data) == {'code': 'OK'}
+        assert self.handler.call_count == 1
+
+    def test_not_opted_in(self):
+        self.paradigm.cache = {}
+        request = self.dispatch(self.data)
+
+        request.dispatch(self.data)
+        request.dispatch(self.data)
+
+        assert self.handler.call_count == 2
+        assert len(request.responses) == 0
+
+    def test_different_payload(self):
+        request = self.dispatch(self.data)
+
+        request.dispatch(self.data)
+        request.dispatch(dict(self.data, hehe=2))
+
+        assert self.handler.call_count == 2
+
+    def test_invalidated(self):
+        request = self.dispatch(self.data)
+
+        request.dispatch(self.data)
+        request.responses.invalidate()
+        request.dispatch(self.data)
+
+        assert self.handler.call_count == 2
+
+
+class TestRequestAck(RequestMixin):
+    def test_ack(self):
+        request = KittenRequest({'paradigm': 'test', 'method': 'test'})
+        assert request.ack() == {'ack': True}
+
+    def test_ack_echoes_id(self):
+        request = KittenRequest(self.request_payload)
+        assert request.ack() == {
+            'ack': True,
+            'id': self.request_payload['id'],
+        }
+
+
+class TestRequestInline(RequestMixin):
+    def setup_method(self, method):
+        super(TestRequestInline, self).setup_method(method)
+        paradigm = MagicMock(inline=('test',))
+        self.paradigms = {'test': paradigm}
+
+    def request(self, data):
+        request = KittenRequest(data)
+        request.paradigms = self.paradigms
+        return request
+
+    def test_inline_method(self):
+        assert self.request(self.request_payload).inline is True
+
+    def test_inline_without_id(self):
+        request = self.request({'paradigm': 'test', 'method': 'test'})
+        assert request.inline is True
+
+    def test_other_method(self):
+        self.request_payload['method'] = 'slow'
+        assert self.request(self.request_payload).inline is False
+
+    def test_unknown_paradigm(self):
+        self.request_payload['paradigm'] = 'hehe'
+        assert self.request(self.request_payload).inline is False
+
+    def test_other_phases(self):
+        for data in (self.request_ack, self.response_payload):
+            assert self.request(data).inline is False
+
+    def test_node_ping(self):
+        request = KittenRequest({'paradigm': 'node', 'method': 'ping'})
+        assert request.inline is True
+
+    def test_batch(self):
+        request = self.request({
+            'id': self.request_payload['id'],
+            'batch': [
+                {'paradigm': 'test', 'method': 'test'},
+                {'paradigm': 'test', 'method': 'test'},
+            ],
+        })
+        assert request.batch is True
+        assert request.inline is True
+
+    def test_batch_with_other_method(self):
+        request = self.request({
+            'id': self.request_payload['id'],
+            'batch': [
+                {'paradigm': 'test', 'method': 'test'},
+                {'paradigm': 'test', 'method': 'slow'},
+            ],
+        })
+        assert request.inline is False
+
+    def test_malformed_batch(self):
+        request = self.request({'batch': ['hehe']})
+        assert request.inline is False
+
+    def test_batch_response(self):
+        self.response_payload.pop('paradigm', None)
+        self.response_payload['batch'] = []
+        assert self.request(self.response_payload).inline is False
+
+    def test_decides_from_header(self):
+        frames = wire.pack(self.request_payload, wire.get_codec('json'))
+        message = wire.unpack(frames)
+
+        assert self.request(message).inline is True
+        assert not message.decoded
+
+
+class TestRequestPriority(RequestMixin):
+    def setup_method(self, method):
+        super(TestRequestPriority, self).setup_method(method)
+        paradigm = MagicMock(priorities={'test': 'low'})
+        self.paradigms = {'test': paradigm}
+
+    def request(self, data):
+        request = KittenRequest(data)
+        request.paradigms = self.paradigms
+        return request
+
+    def test_listed_method(self):
+        assert self.request(self.request_payload).priority == 'low'
+
+    @patch('kitten.conf.PRIORITY', 'hehe')
+    def test_default(self):
+        self.request_payload['method'] = 'slow'
+        assert self.request(self.request_payload).priority == 'hehe'
+
+    @patch('kitten.conf.PRIORITY', 'hehe')
+    def test_unknown_paradigm(self):
+        self.request_payload['paradigm'] = 'hehe'
+        assert self.request(self.request_payload).priority == 'hehe'
+
+    def test_node_sync(self):
+        request = KittenRequest({'paradigm': 'node', 'method': 'sync'})
+        assert request.priority == 'low'
+
+    def test_batch_takes_most_urgent_call(self):
+        self.paradigms['hehe'] = MagicMock(priorities={'hehe': 'high'})
+        request = self.request({
+            'batch': [
+                {'paradigm': 'test', 'method': 'test'},
+                {'paradigm': 'hehe', 'method': 'hehe'},
+                {'paradigm': 'test', 'method': 'slow'},
+            ],
+        })
+        assert request.priority == 'high'
+
+
+class TestRequestBusy(RequestMixin):
+    def test_busy(self):
+        request = KittenRequest({'paradigm': 'test', 'method': 'test'})
+        ret = request.busy(100)
+
+        assert ret['code'] == 'BUSY'
+        assert ret['retry_after'] == 100
+        assert 'id' not in ret
+
+    def test_busy_echoes_id(self):
+        request = KittenRequest(self.request_payload)
+        assert request.busy(100)['id'] == self.request_payload['id']
+
+
+class TestRequestLazyDecoding(RequestMixin):
+    def setup_method(self, method):
+        super(TestRequestLazyDecoding, self).setup_method(method)
+        self.request_payload['nodes'] = ['a:1', 'b:2']
+
+        frames = wire.pack(self.request_payload, wire.get_codec('json'))
+        self.message = wire.unpack(frames)
+
+    def test_routing_does_not_decode(self):
+        request = KittenRequest(self.message)
+
+        assert request.kind == 'request'
+        assert request.phase == 'payload'
+        assert request.host == 'tcp://all of you'
+        assert request.ack()['id'] == self.request_payload['id']
+        assert not self.message.decoded
+
+    def test_request_decodes(self):
+        request = KittenRequest(self.message)
+
+        assert request.request == self.request_payload
+        assert self.message.decoded
+
+
+class TestRequestBatch(RequestMixin):
+    def setup_method(self, method):
+        super(TestRequestBatch, self).setup_method(method)
+        self.paradigm = MagicMock(cache={})
+        self.paradigm.one_response.return_value = {'code': 'OK'}
+        self.paradigm.two_response.side_effect = Exception('boom')
+        self.paradigm.handlers = {
+            'one': self.paradigm.one_response,
+            'two': self.paradigm.two_response,
+        }
+
+        self.request_payload['batch'] = [
+            {'paradigm': 'test', 'method': 'one'},
+            {'paradigm': 'test', 'method': 'two'},
+            {'paradigm': 'test', 'method': 'one'},
+        ]
+
+    @patch.object(KittenRequest, 'validate_response')
+    @patch.object(KittenRequest, 'validate_request')
+    def test_batch(self, req, res):
+        request = KittenRequest(self.request_payload)
+        request.paradigms = {'test': self.paradigm}
+
+        ret = request.process_request_payload()
+
+        assert ret['batch'][0] == {'code': 'OK'}
+        assert ret['batch'][1] == {
+            'code': 'UNKNOWN_ERROR',
+            'message': 'boom',
+            'paradigm': 'test',
+            'method': 'two',
+        }
+        assert ret['batch'][2] == {'code': 'OK'}
+
+        # Every call is validated on its own
+        assert req.call_count == 3
+        assert req.call_args_list[0][0][0] == self.request_payload['batch'][0]
+
+    @patch.object(KittenRequest, 'validate_request')
+    def test_batch_item_validation_error(self, req):
+        req.side_effect = [
+            None, jsonschema.exceptions.ValidationError('nope'), None,
+        ]
+        self.paradigm.two_response.side_effect = None
+
+        request = KittenRequest(self.request_payload)
+        request.paradigms = {'test': self.paradigm}
+
+        with patch.object(KittenRequest, 'validate_response'):
+            ret = request.process_request_payload()
+
+        assert ret['batch'][1]['code'] == 'VALIDATION_ERROR'
+        assert ret['batch'][2] == {'code': 'OK'}
+
+    @patch.object(KittenRequest, 'validate_response')
+    def test_batch_response_validated_per_item(self, res):
+        self.response_payload['batch'] = [{'code': 'OK'}, {'code': 'OK'}]
+        request = KittenRequest(self.response_payload)
+
+        request.process_response_payload()
+
+        assert res.call_count == 2
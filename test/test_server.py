@@ -1,16 +1,23 @@
 import signal
+import argparse
 import pytest
 import gevent
 import zmq
 
+from gevent.queue import Queue
 from mock import MagicMock, patch, call, mock_open
-from test.utils import builtin
+from test.utils import builtin, frames
 
+from kitten import conf
+from kitten import heartbeat
 from kitten import server
+from kitten import wire
 from kitten.server import KittenServer
 from kitten.server import setup_parser
 from kitten.server import execute_parser
+from kitten import pool
 from kitten.request import KittenRequest
+from kitten.request import RequestError
 
 
 class TestServerIntegration(object):
@@ -41,6 +48,32 @@ class TestServerArgparser(object):
         assert ret is execute_parser
 
 
+class TestServerArgparserOptions(object):
+    def setup_method(self, method):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--port', type=int, default=5555)
+        setup_parser(parser.add_subparsers(dest='command'))
+        self.parse = parser.parse_args
+
+    def test_defaults(self):
+        ns = self.parse(['server'])
+        server = KittenServer(ns)
+
+        assert server.pool.size == conf.POOL_SIZE
+        assert server.adaptive is conf.POOL_ADAPTIVE
+
+    def test_pool_options(self):
+        ns = self.parse([
+            'server', '--pool-size', '12', '--pool-max', '40', '--adaptive',
+            'start',
+        ])
+        server = KittenServer(ns)
+
+        assert server.pool.size == 12
+        assert server.pool.maximum == 40
+        assert server.adaptive is True
+
+
 class TestServerArgparserSubcommandSetup(object):
     def setup_method(self, method):
         self.server_args = MagicMock()
@@ -160,11 +193,13 @@ class TestServerTeardownUmbrella(object):
         self.server.teardown_pidfile = MagicMock()
         self.server.teardown_listener = MagicMock()
         self.server.teardown_workers = MagicMock()
+        self.server.teardown_heartbeat = MagicMock()
 
     def check(self):
         self.server.teardown_pidfile.assert_called_once_with()
         self.server.teardown_listener.assert_called_once_with()
         self.server.teardown_workers.assert_called_once_with()
+        self.server.teardown_heartbeat.assert_called_once_with()
 
     @patch('sys.exit')
     def test_teardown(self, exit):
@@ -204,6 +239,7 @@ class TestServerTeardownUnits(object):
 
 class TestServerSocket(object):
     def setup_method(self, method):
+        pool.reset()
         self.server = KittenServer(MagicMock())
         self.port = 3307
         self.server.ns.port = self.port
@@ -227,6 +263,14 @@ class TestServerSocket(object):
         assert ret is socket
         socket.connect.assert_called_once_with('tcp://*:{0}'.format(self.port))
 
+    @patch('zmq.green.Context')
+    def test_sockets_share_context(self, Context):
+        Context.return_value = self.ctx
+        self.server.get_socket()
+        self.server.get_socket(kind=zmq.ROUTER)
+
+        assert Context.call_count == 1
+
 
 class TestServerListen(object):
     def setup_method(self, method):
@@ -237,15 +281,86 @@ class TestServerListen(object):
         self.server.teardown = MagicMock()
 
     def test_listen(self):
+        self.socket.recv_multipart.return_value = frames({})
+        self.server.inbound = MagicMock()
+
+        ret = self.server.listen(self.socket)
+
+        assert ret is True
+        self.socket.recv_multipart.assert_called_once_with(copy=False)
+        self.server.inbound.spawn.assert_called_once_with(
+            self.server.answer, self.socket, frames({}),
+        )
+
+    def test_answer(self):
         recv = {'pat': 'benatar'}
         fake = {}
-        self.socket.recv_json = MagicMock(return_value=recv)
         self.server.handle_request = MagicMock(return_value=fake)
 
-        self.server.listen(self.socket)
-        self.socket.recv_json.assert_called_once_with()
-        self.server.handle_request.assert_called_once_with(recv)
-        self.socket.send_json.assert_called_once_with({})
+        self.server.answer(self.socket, [b'peer', b''] + frames(recv))
+
+        message = self.server.handle_request.call_args[0][0]
+        assert message.data == recv
+
+        reply = self.socket.send_multipart.call_args[0][0]
+        assert reply[:2] == [b'peer', b'']
+        assert wire.unpack(reply[2:]).data == {}
+
+    def test_answer_replies_in_request_codec(self):
+        codec = wire.get_codec('json')
+        self.server.handle_request = MagicMock(return_value={'ack': True})
+
+        self.server.answer(
+            self.socket, [b'peer', b''] + wire.pack({'pat': 'benatar'}, codec)
+        )
+
+        reply = self.socket.send_multipart.call_args[0][0]
+        assert reply == [b'peer', b''] + wire.pack({'ack': True}, codec)
+
+    def test_answer_unknown_codec(self):
+        self.server.handle_request = MagicMock()
+
+        self.server.answer(
+            self.socket, [b'peer', b'', b'{"codec": "rot13"}', b'{}']
+        )
+
+        assert not self.server.handle_request.called
+        reply = self.socket.send_multipart.call_args[0][0]
+        assert reply[:2] == [b'peer', b'']
+        assert wire.unpack(reply[2:]).data['code'] == 'UNKNOWN_CODEC'
+
+    def test_answer_drops_unroutable(self):
+        self.server.handle_request = MagicMock()
+
+        self.server.answer(self.socket, frames({}))
+
+        assert not self.server.handle_request.called
+        assert not self.socket.send_multipart.called
+
+    def test_answer_does_not_decode_payload(self):
+        data = {
+            'id': {'uuid': 'abc', 'kind': 'request', 'phase': 'payload'},
+            'paradigm': 'node',
+            'method': 'sync',
+            'nodes': ['a:1'],
+        }
+        self.server.queue = MagicMock()
+
+        self.server.answer(
+            self.socket,
+            [b'peer', b''] + wire.pack(data, wire.get_codec('json')),
+        )
+
+        request = self.server.queue.put_nowait.call_args[0][0]
+        reply = self.socket.send_multipart.call_args[0][0]
+        assert wire.unpack(reply[2:]).data == {'ack': True, 'id': data['id']}
+        assert not request.message.decoded
+
+    def test_listen_forever_binds_router(self):
+        self.server.listen = MagicMock(return_value=False)
+        self.server.listen_forever()
+
+        self.server.get_socket.assert_called_once_with(zmq.ROUTER)
 
     def test_listen_forever(self):
         self.server.listen = MagicMock(side_effect=[True, True, False])
@@ -264,6 +379,50 @@ class TestServerListen(object):
         self.server.teardown.assert_called_once_with()
 
 
+class TestServerHeartbeat(object):
+    def setup_method(self, method):
+        self.server = KittenServer(MagicMock())
+        self.socket = MagicMock()
+
+    def test_beat(self):
+        self.server.queue.put('hehe')
+        ping = heartbeat.ping(3)
+        self.socket.recv_multipart.return_value = [b'peer', b'', ping]
+
+        ret = self.server.beat(self.socket)
+
+        assert ret is True
+        frames = self.socket.send_multipart.call_args[0][0]
+        assert frames[:2] == [b'peer', b'']
+        assert frames[2] == heartbeat.pong(ping, 1, wire.formats())
+
+    def test_beat_drops_garbage(self):
+        self.socket.recv_multipart.return_value = [b'peer', b'', b'{}']
+
+        ret = self.server.beat(self.socket)
+
+        assert ret is True
+        assert not self.socket.send_multipart.called
+
+    @patch('kitten.conf.HEARTBEAT_OFFSET', 1000)
+    def test_heartbeat_forever_binds_offset_port(self):
+        self.server.ns.port = 5555
+        self.server.get_socket = MagicMock()
+        self.server.beat = MagicMock(side_effect=[True, False])
+
+        self.server.heartbeat_forever()
+
+        self.server.get_socket.assert_called_once_with(
+            zmq.ROUTER, 'tcp://*:6555'
+        )
+        assert self.server.beat.call_count == 2
+
+    def test_teardown_heartbeat(self):
+        self.server.heartbeat = MagicMock()
+        self.server.teardown_heartbeat()
+        self.server.heartbeat.kill.assert_called_once_with(timeout=5)
+
+
 class TestServerUtils(object):
     def setup_method(self, method):
         self.ns = MagicMock()
@@ -325,6 +484,89 @@ class TestServerQueue(object):
         assert self.server.queue.get() == KittenRequest(data)
         assert ret == {'ack': True}
 
+    def test_inline_request_is_answered_right_away(self):
+        data = {
+            'id': {'uuid': 'abc', 'kind': 'request', 'phase': 'payload'},
+            'paradigm': 'node',
+            'method': 'ping',
+        }
+
+        ret = self.server.handle_request(data)
+
+        assert ret == dict(data, code='OK')
+        assert self.server.queue.qsize() == 0
+        assert self.server.metrics.get('inline') >= 1
+
+    @patch('kitten.conf.BUSY_RETRY_AFTER', 250)
+    def test_full_queue_answers_busy(self):
+        self.server.queue = Queue(1)
+        self.server.handle_request('{}')
+
+        ret = self.server.handle_request('{}')
+
+        assert ret['code'] == 'BUSY'
+        assert ret['retry_after'] == 250
+        assert self.server.queue.qsize() == 1
+        assert self.server.metrics.get('busy') >= 1
+
+    def test_inline_batch_is_answered_right_away(self):
+        ping = {'paradigm': 'node', 'method': 'ping'}
+
+        ret = self.server.handle_request({'batch': [ping, ping]})
+
+        assert [r['code'] for r in ret['batch']] == ['OK', 'OK']
+        assert self.server.queue.qsize() == 0
+
+    def test_batch_waits_for_worker(self):
+        batch = {'batch': [{'paradigm': 'node', 'method': 'hehe'}]}
+
+        reply = gevent.spawn(self.server.handle_request, batch)
+        gevent.sleep(0)
+
+        assert not reply.ready()
+        assert self.server.queue.qsize() == 1
+
+        self.server.queue.get().settle()
+
+        ret = reply.get(timeout=1)
+        assert ret['batch'][0]['code'] == 'VALIDATION_ERROR'
+
+    def test_full_queue_answers_busy_to_batches(self):
+        self.server.queue = Queue(1)
+        self.server.handle_request('{}')
+
+        ret = self.server.handle_request({
+            'batch': [{'paradigm': 'node', 'method': 'sync'}],
+        })
+
+        assert ret['code'] == 'BUSY'
+        assert self.server.queue.qsize() == 1
+
+    @patch('kitten.conf.QUEUE_SIZE', 3)
+    def test_queue_is_bounded(self):
+        assert KittenServer(MagicMock()).queue.maxsize == 3
+
+    @patch('kitten.conf.PRIORITIES', {'high': 2, 'hehe': 1})
+    @patch('kitten.conf.PRIORITY', 'hehe')
+    def test_queue_classes(self):
+        queue = KittenServer(MagicMock()).queue
+        assert queue.weights == {'high': 2, 'hehe': 1}
+
+    def test_pings_skip_queued_syncs(self):
+        # Pings that are not answered inline, like ones in other phases
+        sync = {'paradigm': 'node', 'method': 'sync'}
+        ping = {
+            'id': {'uuid': 'abc', 'kind': 'response', 'phase': 'payload'},
+            'paradigm': 'node',
+            'method': 'ping',
+        }
+
+        for _ in range(10):
+            self.server.handle_request(sync)
+        self.server.handle_request(ping)
+
+        assert self.server.queue.get().header['method'] == 'ping'
+
 
 class TestServerWorker(object):
     def setup_method(self, method):
@@ -335,27 +577,149 @@ class TestServerWorker(object):
         self.server.get_socket = MagicMock()
 
     @patch('gevent.sleep')
-    def test_empty_queue(self, sleep):
-        self.server.queue.empty.return_value = True
-        ret = self.server.work()
+    def test_blocks_on_queue(self, sleep):
+        self.server.work()
 
-        assert ret is True
-        sleep.assert_called_once_with(0.1)
+        self.server.queue.get.assert_called_once_with()
+        assert not sleep.called
 
     def test_handle_request(self):
         request = MagicMock()
-        sock_ret = 'sex as a weapon'
-        self.server.get_socket.return_value = sock_ret
+        request.reply = None
+        request.expired.return_value = False
         self.server.queue.get.return_value = request
 
         ret = self.server.work()
 
         assert ret is True
         self.server.pool.spawn.assert_called_once_with(
-            request.process,
-            sock_ret,
+            self.server.callback,
+            request,
         )
 
+    def test_handle_request_without_return_address(self):
+        request = MagicMock()
+        request.reply = None
+        request.host = None
+        request.expired.return_value = False
+        self.server.queue.get.return_value = request
+
+        ret = self.server.work()
+
+        assert ret is True
+        assert not self.server.get_socket.called
+        self.server.pool.spawn.assert_called_once_with(request.execute)
+
+    def test_drops_expired_request(self):
+        request = MagicMock()
+        request.expired.return_value = True
+        self.server.queue.get.return_value = request
+
+        ret = self.server.work()
+
+        assert ret is True
+        assert not self.server.pool.spawn.called
+        assert self.server.metrics.get('expired') >= 1
+
+    def test_broken_request_does_not_stop_worker(self):
+        request = MagicMock()
+        request.expired.side_effect = TypeError('hehe')
+        self.server.queue.get.return_value = request
+
+        ret = self.server.work()
+
+        assert ret is True
+        assert not self.server.pool.spawn.called
+        assert self.server.metrics.get('broken') >= 1
+
+    def test_batch_is_settled(self):
+        request = KittenRequest({'batch': []})
+        request.reply = MagicMock()
+        self.server.queue.get.return_value = request
+
+        self.server.work()
+
+        self.server.pool.spawn.assert_called_once_with(request.settle)
+
+    def test_expired_batch_is_settled(self):
+        request = MagicMock()
+        request.expired.return_value = True
+        self.server.queue.get.return_value = request
+
+        self.server.work()
+
+        assert not self.server.pool.spawn.called
+        response = request.settle.call_args[0][0]
+        assert response['code'] == 'TIMEOUT'
+
+    def test_unknown_kind(self):
+        request = KittenRequest({
+            'id': {'kind': 'req', 'to': 'hehe:1234', 'ttl': 1000},
+            'paradigm': 'node',
+            'method': 'ping',
+        })
+        self.server.queue.get.return_value = request
+
+        ret = self.server.work()
+
+        assert ret is True
+        self.server.pool.spawn.assert_called_once_with(request.execute)
+
+
+class TestServerCallback(object):
+    def setup_method(self, method):
+        self.server = KittenServer(MagicMock())
+        self.server.callbacks = MagicMock()
+        self.request = MagicMock()
+        self.request.host = 'tcp://hehe:1234'
+        self.socket = self.server.callbacks.acquire.return_value
+
+    def test_callback(self):
+        ret = self.server.callback(self.request)
+
+        assert ret is True
+        acquire = self.server.callbacks.acquire
+        acquire.assert_called_once_with('tcp://hehe:1234')
+        self.request.process.assert_called_once_with(self.socket)
+        self.server.callbacks.release.assert_called_once_with(
+            'tcp://hehe:1234', self.socket
+        )
+
+    def test_callback_failure_discards_socket(self):
+        self.request.process.side_effect = RequestError('TIMEOUT', 'hehe')
+
+        ret = self.server.callback(self.request)
+
+        assert ret is False
+        self.server.callbacks.discard.assert_called_once_with(self.socket)
+        assert not self.server.callbacks.release.called
+
+    def test_teardown_closes_callbacks(self):
+        self.server.pool = MagicMock()
+        self.server.pool.free_count.return_value = self.server.pool.size
+
+        self.server.teardown_workers()
+
+        self.server.callbacks.clear.assert_called_once_with()
+
+
+class TestServerWorkerDispatch(object):
+    def setup_method(self, method):
+        self.server = KittenServer(MagicMock())
+        self.server.pool = MagicMock()
+
+    def test_dispatches_as_soon_as_queued(self):
+        worker = gevent.spawn(self.server.work)
+        gevent.sleep(0)
+        assert not self.server.pool.spawn.called
+
+        request = KittenRequest({'paradigm': 'node', 'method': 'ping'})
+        self.server.queue.put(request)
+        worker.join(timeout=0.05)
+
+        assert worker.value is True
+        self.server.pool.spawn.assert_called_once_with(request.execute)
+
 
 class TestServerWorkerLoop(object):
     def setup_method(self, method):
@@ -401,6 +765,62 @@ class TestServerWorkerTeardown(object):
         assert ret is None
         self.server.pool.kill.assert_called_once_with(timeout=5)
 
+    def test_teardown_kills_worker(self):
+        self.server.worker = MagicMock()
+        self.server.scaler = MagicMock()
+        self.server.pool.free_count.return_value = self.server.pool.size
+
+        self.server.teardown_workers()
+
+        self.server.worker.kill.assert_called_once_with(block=False)
+        self.server.scaler.kill.assert_called_once_with(block=False)
+
+
+class TestServerScaling(object):
+    def setup_method(self, method):
+        self.server = KittenServer(MagicMock())
+        self.server.pool = MagicMock()
+
+    def test_scale(self):
+        self.server.queue.put('hehe')
+        self.server.pool.adapt.return_value = 9
+
+        ret = self.server.scale()
+
+        assert ret == 9
+        self.server.pool.adapt.assert_called_once_with(1, conf.POOL_INTERVAL)
+
+    @patch('gevent.sleep')
+    def test_scale_forever(self, sleep):
+        self.server.scale = MagicMock(side_effect=[1, 2, Exception])
+
+        with pytest.raises(Exception):
+            self.server.scale_forever()
+
+        assert self.server.scale.call_count == 3
+        sleep.assert_called_with(conf.POOL_INTERVAL)
+
+    def test_fixed_size_not_clamped(self):
+        for size in (1, 500):
+            ns = argparse.Namespace(port=9999, pool_size=size)
+            assert KittenServer(ns).pool.size == size
+
+    def test_adaptive_size_clamped(self):
+        ns = argparse.Namespace(
+            port=9999, pool_size=500, pool_max=100, pool_adaptive=True,
+        )
+        assert KittenServer(ns).pool.size == 100
+
+    @patch('gevent.spawn')
+    def test_start_adaptive(self, spawn):
+        self.server.setup = MagicMock()
+        self.server.adaptive = True
+
+        self.server.start()
+
+        assert self.server.scaler is not None
+        assert call(self.server.scale_forever) in spawn.call_args_list
+
 
 class TestServerStartStop(object):
     def setup_method(self, method):
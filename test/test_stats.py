@@ -0,0 +1,54 @@
+from mock import patch
+
+from kitten import stats
+from kitten.stats import Stats
+
+
+class TestStats(object):
+    def setup_method(self, method):
+        self.stats = Stats('test')
+
+    def test_incr(self):
+        self.stats.incr('hits')
+        self.stats.incr('hits', 2)
+
+        assert self.stats.get('hits') == 3
+
+    def test_get_missing(self):
+        assert self.stats.get('nope') == 0
+
+    def test_set(self):
+        self.stats.set('depth', 5)
+        self.stats.set('depth', 2)
+
+        assert self.stats.get('depth') == 2
+
+    @patch('time.time')
+    def test_timer(self, time):
+        time.side_effect = [10, 10.5]
+        with self.stats.timer('spent'):
+            pass
+
+        assert self.stats.get('spent') == 0.5
+
+    def test_snapshot_is_a_copy(self):
+        self.stats.incr('hits')
+        snapshot = self.stats.snapshot()
+        self.stats.incr('hits')
+
+        assert snapshot == {'hits': 1}
+
+    def test_reset(self):
+        self.stats.incr('hits')
+        self.stats.reset()
+
+        assert self.stats.snapshot() == {}
+
+
+class TestStatsRegistry(object):
+    def test_get_is_shared(self):
+        assert stats.get('shared') is stats.get('shared')
+
+    def test_snapshot(self):
+        stats.get('registry-test').incr('hits')
+        assert stats.snapshot()['registry-test'] == {'hits': 1}
@@ -1,4 +1,13 @@
+import pytest
+
+from mock import MagicMock, patch
+
 from kitten.util import AutoParadigmMixin
+from kitten.util import ParadigmRegistry
+from kitten.util import entry_points
+from kitten.util import resolve
+
+from test.mocks import MockParadigm
 
 
 class TestAutoParadigmMixin(object):
@@ -21,3 +30,80 @@ class TestAutoParadigmMixin(object):
         self.apm.paradigms = {'hehe': True}
 
         assert self.apm._paradigms == {'hehe': True}
+
+    def test_registry_is_shared(self):
+        assert self.apm.paradigms is AutoParadigmMixin().paradigms
+
+    @patch.object(AutoParadigmMixin, 'registry', None)
+    @patch('kitten.util.entry_points')
+    def test_entry_points_and_conf(self, entry_points):
+        entry_points.return_value = {
+            'node': 'hehe:HeheParadigm',
+            'mock': 'test.mocks:MockParadigm',
+        }
+
+        with patch('kitten.conf.PARADIGMS', {'node': 'kitten.node:X'}):
+            ret = self.apm.paradigms
+
+        entry_points.assert_called_once_with('kitten.paradigms')
+        assert ret.specs == {
+            'node': 'kitten.node:X',
+            'mock': 'test.mocks:MockParadigm',
+        }
+
+
+class TestParadigmRegistry(object):
+    def setup_method(self, method):
+        self.registry = ParadigmRegistry({
+            'mock': 'test.mocks:MockParadigm',
+        })
+
+    @patch('kitten.util.import_module')
+    def test_names_without_import(self, import_module):
+        assert 'mock' in self.registry
+        assert 'hehe' not in self.registry
+        assert list(self.registry) == ['mock']
+        assert len(self.registry) == 1
+
+        assert not import_module.called
+
+    def test_loaded_on_first_use(self):
+        assert self.registry.loaded == {}
+
+        paradigm = self.registry['mock']
+
+        assert isinstance(paradigm, MockParadigm)
+        assert self.registry['mock'] is paradigm
+        assert self.registry.get('mock') is paradigm
+
+    def test_unknown(self):
+        with pytest.raises(KeyError):
+            self.registry['hehe']
+
+        assert self.registry.get('hehe') is None
+
+    def test_failed_load_is_dropped(self):
+        self.registry.specs['broken'] = 'kitten.hehe:HeheParadigm'
+
+        assert self.registry.get('broken') is None
+        assert 'broken' not in self.registry
+
+    def test_entry_point(self):
+        entry = MagicMock()
+        entry.load.return_value = MockParadigm
+        registry = ParadigmRegistry({'mock': entry})
+
+        assert isinstance(registry['mock'], MockParadigm)
+        entry.load.assert_called_once_with()
+
+
+class TestResolve(object):
+    def test_string(self):
+        assert resolve('test.mocks:MockParadigm') is MockParadigm
+
+    def test_entry_point(self):
+        entry = MagicMock()
+        assert resolve(entry) is entry.load.return_value
+
+    def test_entry_points_empty_group(self):
+        assert entry_points('kitten.hehe') == {}
@@ -1,9 +1,12 @@
 import pytest
+import jsonschema
 
+from kitten.validation import INBOUND
+from kitten.validation import OUTBOUND
 from kitten.validation import Validator
 from jsonschema.exceptions import ValidationError
 
-from mock import MagicMock
+from mock import MagicMock, patch
 from test.mocks import MockValidator
 
 
@@ -34,7 +37,7 @@ class TestValidatorGetMethod(object):
 class TestValidatorRequest(object):
     def setup_method(self, method):
         self.validator = MockValidator()
-        self.paradigm = MagicMock()
+        self.paradigm = MagicMock(validation={})
         self.paradigm.validator = self.validator
         self.paradigms = {'paradigm': self.paradigm}
 
@@ -71,6 +74,155 @@ class TestValidatorRequest(object):
         with pytest.raises(ValidationError):
             self.validator.request(self.request, self.paradigms)
 
+    def test_ttl(self):
+        self.request['id'] = {'uuid': 'abc', 'ttl': 500}
+        self.validator.request(self.request, self.paradigms)
+
+    def test_negative_ttl(self):
+        self.request['id'] = {'uuid': 'abc', 'ttl': -1}
+
+        with pytest.raises(ValidationError):
+            self.validator.request(self.request, self.paradigms)
+
+
+class TestValidatorCompiled(object):
+    def setup_method(self, method):
+        self.validator = MockValidator()
+        self.paradigm = MagicMock(validation={})
+        self.paradigm.validator = self.validator
+        self.paradigms = {'paradigm': self.paradigm}
+
+        self.request = {
+            'paradigm': 'paradigm',
+            'method': 'method',
+        }
+
+    def test_compiled_once(self):
+        with patch.object(
+            MockValidator, 'decorate_schema',
+            side_effect=Validator.decorate_schema,
+            autospec=True,
+        ) as decorate:
+            for _ in range(3):
+                self.validator.request(self.request, self.paradigms)
+
+        assert decorate.call_count == 1
+        assert 'method_request' in self.validator.compiled
+
+    def test_compiled_per_kind(self):
+        self.validator.request(self.request, self.paradigms)
+        self.validator.response(self.request, self.paradigms)
+
+        assert sorted(self.validator.compiled) == [
+            'method_request', 'method_response',
+        ]
+
+    def test_compile_all(self):
+        self.validator.compile_all()
+
+        assert sorted(self.validator.compiled) == [
+            'method_request', 'method_response',
+        ]
+
+    def test_not_shared_between_validators(self):
+        self.validator.compile_all()
+        assert MockValidator().compiled == {}
+
+    def test_same_error_as_jsonschema(self):
+        self.request['field'] = 'helo i am string not number'
+        self.request['extra'] = True
+
+        schema = self.validator.decorate_schema(
+            self.validator.method_request()
+        )
+        with pytest.raises(ValidationError) as expected:
+            jsonschema.validate(self.request, schema)
+
+        with pytest.raises(ValidationError) as exc:
+            self.validator.request(self.request, self.paradigms)
+
+        assert exc.value.message == expected.value.message
+        assert list(exc.value.path) == list(expected.value.path)
+
+
+class TestValidatorPolicy(object):
+    def setup_method(self, method):
+        self.validator = MockValidator()
+        self.paradigm = MagicMock(validator=self.validator, validation={})
+        self.paradigms = {'paradigm': self.paradigm}
+        self.validator.metrics.reset()
+
+        self.invalid = {
+            'paradigm': 'paradigm',
+            'method': 'method',
+            'field': 'helo i am string not number',
+        }
+
+    def validate(self, direction):
+        self.validator.request(self.invalid, self.paradigms, direction)
+
+    def test_full(self):
+        for direction in (INBOUND, OUTBOUND):
+            with pytest.raises(ValidationError):
+                self.validate(direction)
+
+        assert self.validator.metrics.get('failed') == 2
+
+    @patch('kitten.conf.VALIDATION', 'boundary')
+    def test_boundary(self):
+        self.validate(OUTBOUND)
+        assert self.validator.metrics.get('skipped') == 1
+
+        with pytest.raises(ValidationError):
+            self.validate(INBOUND)
+
+    def test_direction_defaults_to_inbound(self):
+        self.paradigm.validation = {'method': 'boundary'}
+
+        with pytest.raises(ValidationError):
+            self.validator.request(self.invalid, self.paradigms)
+
+    @patch('kitten.conf.VALIDATION', 'off')
+    def test_off(self):
+        for direction in (INBOUND, OUTBOUND):
+            self.validate(direction)
+
+        assert self.validator.metrics.get('skipped') == 2
+        assert self.validator.compiled == {}
+
+    @patch('kitten.conf.VALIDATION', 'sample')
+    @patch('kitten.conf.VALIDATION_SAMPLE', 4)
+    @patch('random.randrange')
+    def test_sample(self, randrange):
+        randrange.side_effect = [3, 0]
+
+        self.validate(INBOUND)
+        with pytest.raises(ValidationError):
+            self.validate(INBOUND)
+
+        randrange.assert_called_with(4)
+        assert self.validator.metrics.get('skipped') == 1
+        assert self.validator.metrics.get('failed') == 1
+
+    @patch('kitten.conf.VALIDATION', 'off')
+    def test_paradigm_overrides_conf(self):
+        self.paradigm.validation = {'method': 'full'}
+
+        with pytest.raises(ValidationError):
+            self.validate(OUTBOUND)
+
+    def test_unknown_mode(self):
+        self.paradigm.validation = {'method': 'hehe'}
+
+        with pytest.raises(ValueError):
+            self.validate(INBOUND)
+
+    def test_validated_counted(self):
+        self.invalid['field'] = 1000
+        self.validate(INBOUND)
+
+        assert self.validator.metrics.get('validated') == 1
+
 
 class TestValidatorGetKnownMethods(object):
     def setup_method(self, method):
@@ -0,0 +1,250 @@
+import json
+import pytest
+
+from mock import MagicMock, patch
+
+from kitten import wire
+from kitten.wire import WireError
+
+
+class TestCodecs(object):
+    payload = {
+        'id': {'uuid': 'abc', 'kind': 'request'},
+        'paradigm': 'node',
+        'method': 'sync',
+        'nodes': ['localhost:5555', u'h\xe4st:1234'],
+    }
+
+    @pytest.mark.parametrize('name', sorted(wire.codecs))
+    def test_roundtrip(self, name):
+        codec = wire.get_codec(name)
+        assert codec.decode(codec.encode(self.payload)) == self.payload
+
+    def test_json_is_compact(self):
+        codec = wire.get_codec('json')
+        assert b' ' not in codec.encode({'a': [1, 2]})
+
+    def test_get_codec_none_is_plain_json(self):
+        assert wire.get_codec(None) is None
+
+    def test_get_codec_unknown(self):
+        with pytest.raises(WireError) as exc:
+            wire.get_codec('rot13')
+
+        assert exc.value.code == 'UNKNOWN_CODEC'
+        assert 'json' in exc.value.message
+
+    @patch('kitten.conf.CODEC', 'json')
+    def test_default_codec(self):
+        assert wire.default_codec() is wire.codecs['json']
+
+
+class TestFraming(object):
+    def setup_method(self, method):
+        self.data = {'paradigm': 'node', 'method': 'ping'}
+        self.codec = wire.get_codec('json')
+
+    def test_pack_plain_is_send_json_compatible(self):
+        frames = wire.pack(self.data)
+
+        assert len(frames) == 1
+        assert json.loads(frames[0].decode('utf-8')) == self.data
+
+    def test_pack_with_codec_splits_header(self):
+        self.data['code'] = 'OK'
+        frames = wire.pack(self.data, self.codec)
+
+        assert json.loads(frames[0].decode('utf-8')) == {
+            'codec': 'json',
+            'paradigm': 'node',
+            'method': 'ping',
+        }
+        assert self.codec.decode(frames[1]) == {'code': 'OK'}
+
+    def test_unpack_decodes_body_lazily(self):
+        self.data['code'] = 'OK'
+        codec = MagicMock(wraps=self.codec)
+        frames = wire.pack(self.data, self.codec)
+
+        message = wire.unpack(frames)
+        message.codec = codec
+
+        assert message.header == {'paradigm': 'node', 'method': 'ping'}
+        assert not message.decoded
+        assert not codec.decode.called
+
+        assert message.data == self.data
+        assert message.decoded
+        assert codec.decode.call_count == 1
+
+    def test_unpack_bad_header(self):
+        with pytest.raises(WireError) as exc:
+            wire.unpack([b'not json', b'{}'])
+
+        assert exc.value.code == 'BAD_HEADER'
+
+    def test_message_from_data(self):
+        message = wire.Message.from_data(self.data)
+
+        assert message.decoded
+        assert message.data is self.data
+        assert message.header == self.data
+
+    def test_unpack_plain(self):
+        message = wire.unpack(wire.pack(self.data))
+
+        assert message.data == self.data
+        assert message.codec is None
+
+    def test_unpack_with_codec(self):
+        message = wire.unpack(wire.pack(self.data, self.codec))
+
+        assert message.data == self.data
+        assert message.codec is self.codec
+
+    def test_unpack_too_many_frames(self):
+        with pytest.raises(WireError) as exc:
+            wire.unpack([b'json', b'{}', b'{}'])
+
+        assert exc.value.code == 'BAD_FRAMES'
+
+    def test_send(self):
+        socket = MagicMock()
+        wire.send(socket, self.data, self.codec, [b'peer', b''])
+
+        socket.send_multipart.assert_called_once_with(
+            [b'peer', b''] + wire.pack(self.data, self.codec)
+        )
+
+    def test_recv(self):
+        socket = MagicMock()
+        socket.recv_multipart.return_value = wire.pack(self.data)
+        message = wire.recv(socket)
+
+        socket.recv_multipart.assert_called_once_with(copy=False)
+        assert message.data == self.data
+        assert message.envelope == []
+
+    def test_recv_routed(self):
+        socket = MagicMock()
+        socket.recv_multipart.return_value = (
+            [b'peer', b''] + wire.pack(self.data, self.codec)
+        )
+        message = wire.recv(socket, routed=True)
+
+        assert message.data == self.data
+        assert message.envelope == [b'peer', b'']
+        assert message.codec is self.codec
+
+    def test_split(self):
+        envelope, frames = wire.split([b'a', b'b', b'', b'{}'])
+
+        assert envelope == [b'a', b'b', b'']
+        assert frames == [b'{}']
+
+    def test_split_frame_objects(self):
+        frames = [MagicMock(bytes=b'peer'), MagicMock(bytes=b''), b'{}']
+        envelope, rest = wire.split(frames)
+
+        assert envelope == [b'peer', b'']
+        assert rest == [b'{}']
+
+    def test_split_without_delimiter(self):
+        with pytest.raises(wire.WireError) as exc:
+            wire.split([b'peer', b'{}'])
+
+        assert exc.value.code == 'BAD_ENVELOPE'
+
+
+class TestCompression(object):
+    def setup_method(self, method):
+        wire.metrics.reset()
+        self.codec = wire.get_codec('json')
+        self.data = {
+            'paradigm': 'node',
+            'method': 'sync',
+            'nodes': ['10.0.0.{0}:5555'.format(x) for x in range(200)],
+        }
+
+    def header(self, frames):
+        return json.loads(frames[0].decode('utf-8'))
+
+    def test_large_body_compressed(self):
+        frames = wire.pack(self.data, self.codec)
+
+        assert self.header(frames)['compression'] == 'zlib'
+        assert len(frames[1]) < len(self.codec.encode(self.data))
+        assert wire.unpack(frames).data == self.data
+
+    def test_small_body_not_compressed(self):
+        frames = wire.pack({'paradigm': 'node', 'code': 'OK'}, self.codec)
+
+        assert 'compression' not in self.header(frames)
+        assert wire.metrics.get('compressed') == 0
+
+    @patch('kitten.conf.COMPRESSION', None)
+    def test_compression_disabled(self):
+        frames = wire.pack(self.data, self.codec)
+        assert 'compression' not in self.header(frames)
+
+    @patch('kitten.conf.COMPRESSION_THRESHOLD', 10)
+    def test_incompressible_body_sent_as_is(self):
+        # Too short for zlib to gain anything over its own overhead
+        data = {'a': 'xyz'}
+        frames = wire.pack(data, self.codec)
+
+        assert 'compression' not in self.header(frames)
+        assert wire.metrics.get('compress_skipped') == 1
+
+    def test_counters(self):
+        frames = wire.pack(self.data, self.codec)
+        wire.unpack(frames).data
+
+        counters = wire.metrics.snapshot()
+        assert counters['compressed'] == 1
+        assert counters['compress_bytes_out'] == len(frames[1])
+        assert counters['compress_bytes_in'] > counters['compress_bytes_out']
+        assert counters['compress_time'] >= 0
+        assert counters['decompress_time'] >= 0
+
+    def test_unknown_compression(self):
+        with pytest.raises(WireError) as exc:
+            wire.unpack([b'{"codec": "json", "compression": "lz4"}', b'{}'])
+
+        assert exc.value.code == 'UNKNOWN_COMPRESSION'
+
+
+class TestFormats(object):
+    def setup_method(self, method):
+        self.codec = wire.get_codec('json')
+
+    def test_roundtrip(self):
+        advertised = wire.parse_formats(wire.formats())
+
+        assert advertised['codecs'] == sorted(wire.codecs)
+        assert advertised['compression'] == sorted(wire.compressors)
+
+    def test_parse_garbage(self):
+        assert wire.parse_formats(b'') is None
+        assert wire.parse_formats(b'\xff') is None
+        assert wire.parse_formats(b'[]') is None
+
+    def test_accepts(self):
+        advertised = wire.parse_formats(wire.formats())
+
+        assert wire.accepts(advertised, self.codec)
+        assert wire.accepts(None, None)
+
+    def test_accepts_nothing_from_silent_peers(self):
+        assert not wire.accepts(None, self.codec)
+
+    def test_codec_not_listed(self):
+        advertised = {'codecs': ['msgpack'], 'compression': ['zlib']}
+        assert not wire.accepts(advertised, self.codec)
+
+    def test_compression_not_listed(self):
+        advertised = {'codecs': ['json']}
+
+        assert not wire.accepts(advertised, self.codec)
+        with patch('kitten.conf.COMPRESSION', None):
+            assert wire.accepts(advertised, self.codec)
@@ -0,0 +1,140 @@
+import gevent
+import pytest
+
+from gevent.event import Event
+from mock import patch
+
+from kitten.workers import WorkerPool
+
+
+class TestWorkerPool(object):
+    def setup_method(self, method):
+        self.pool = WorkerPool(2, 1, 8)
+        self.gate = Event()
+
+    def teardown_method(self, method):
+        self.pool.kill()
+
+    def block(self):
+        self.gate.wait()
+
+    def test_size_not_clamped(self):
+        assert WorkerPool(100, 1, 8).size == 100
+        assert WorkerPool(1, 2, 8).size == 1
+
+    def test_size_at_least_one(self):
+        with pytest.raises(ValueError):
+            WorkerPool(0, 1, 8)
+
+    def test_resize_clamped(self):
+        self.pool.resize(100)
+        assert self.pool.size == 8
+
+        self.pool.resize(0)
+        assert self.pool.size == 1
+
+    @patch('kitten.conf.POOL_SIZE', 7)
+    def test_defaults_from_conf(self):
+        assert WorkerPool().size == 7
+
+    def test_spawn_does_not_block_when_full(self):
+        for _ in range(3):
+            self.pool.spawn(self.block)
+
+        assert self.pool.active == 3
+        assert self.pool.full()
+        assert self.pool.free_count() == 0
+
+    def test_wait_available(self):
+        self.pool.spawn(self.block)
+        self.pool.spawn(self.block)
+
+        waiter = gevent.spawn(self.pool.wait_available)
+        gevent.sleep(0)
+        assert not waiter.ready()
+
+        self.gate.set()
+        waiter.join(timeout=1)
+
+        assert waiter.ready()
+        assert self.pool.active == 0
+
+    def test_run_records_latency(self):
+        self.pool.spawn(lambda: 'hehe').join()
+
+        assert self.pool.completed == 1
+        assert self.pool.latency is not None
+        assert self.pool.active == 0
+
+    def test_run_records_failures(self):
+        def fail():
+            raise ValueError('hehe')
+
+        self.pool.spawn(fail).join()
+
+        assert self.pool.completed == 1
+        assert self.pool.active == 0
+
+    def test_resize_frees_slots(self):
+        self.pool.spawn(self.block)
+        self.pool.spawn(self.block)
+        assert not self.pool.slot.is_set()
+
+        self.pool.resize(4)
+
+        assert self.pool.size == 4
+        assert self.pool.slot.is_set()
+
+    def test_resize_publishes(self):
+        self.pool.resize(5)
+        assert self.pool.metrics.get('size') == 5
+
+
+class TestWorkerPoolAdapt(object):
+    def setup_method(self, method):
+        self.pool = WorkerPool(4, 2, 32)
+
+    def test_grows_on_backlog_before_any_sample(self):
+        assert self.pool.adapt(10, 1.0) == 8
+
+    def test_keeps_size_when_idle_before_any_sample(self):
+        assert self.pool.adapt(0, 1.0) == 4
+
+    def test_little(self):
+        # 40 requests a second that take 100ms each need 4 workers, plus
+        # headroom.
+        self.pool.latency = 100
+        self.pool.completed = 40
+
+        assert self.pool.adapt(0, 1.0) == 5
+
+    def test_grows_at_most_double(self):
+        self.pool.latency = 1000
+        self.pool.completed = 100
+
+        assert self.pool.adapt(100, 1.0) == 8
+
+    def test_shrinks_gradually(self):
+        self.pool.resize(16)
+        self.pool.latency = 10
+
+        assert self.pool.adapt(0, 1.0) == 12
+        assert self.pool.adapt(0, 1.0) == 9
+
+    def test_never_below_minimum(self):
+        self.pool.latency = 10
+
+        for _ in range(10):
+            self.pool.adapt(0, 1.0)
+
+        assert self.pool.size == 2
+
+    def test_utilization(self):
+        self.pool.latency = 100
+        self.pool.busy = 2.0
+
+        self.pool.adapt(0, 1.0)
+
+        assert self.pool.utilization == pytest.approx(0.5)
+        assert self.pool.busy == 0
+        assert self.pool.metrics.get('utilization') == pytest.approx(0.5)
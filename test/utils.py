@@ -1,4 +1,11 @@
+import json
 import mock
+import zmq.green as zmq
+
+from gevent.event import AsyncResult
+
+from kitten import pool
+from kitten import wire
 
 
 def builtin(target):
@@ -25,3 +32,42 @@ def maybe_super(cls, self, key, *args, **kwargs):
     maybe = getattr(super(cls, self), key, None)
     if maybe:
         maybe(*args, **kwargs)
+
+
+def frames(data):
+    """
+    Wire frames of a plain JSON message, as recv_multipart() returns them.
+
+    """
+
+    return [json.dumps(data).encode('utf-8')]
+
+
+def sent(socket):
+    """
+    Decode the last message sent on a mocked socket.
+
+    """
+
+    return wire.unpack(socket.send_multipart.call_args[0][0]).data
+
+
+def random_port(server):
+    """
+    Make a server listen on a random port instead of its own.
+
+    Returns an AsyncResult that is set to the port once the server binds its
+    listener. Binding only then keeps the socket out of processes that the
+    server forks before it starts listening.
+
+    """
+
+    port = AsyncResult()
+
+    def get_listener():
+        socket = pool.context().socket(zmq.ROUTER)
+        port.set(socket.bind_to_random_port('tcp://127.0.0.1'))
+        return socket
+
+    server.get_listener = get_listener
+    return port
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Compare the wire codecs on realistic ping and sync payloads
+
+Prints bytes on the wire and encode/decode cost per message for every codec
+registered in kitten.wire, with plain single frame JSON as the baseline.
+"route" is the cost of decoding only the header, which is all the server
+listener needs.
+
+Framed messages are measured without compression, and again with
+conf.COMPRESSION, so that the cost of the codec and the cost of compressing
+show up apart. The header frame is most of a ping, so framing costs a few
+microseconds there; the codecs pay off on large bodies like syncs.
+
+"""
+
+import sys
+import timeit
+
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+from kitten import conf  # noqa
+from kitten import wire  # noqa
+
+
+def envelope(method, **payload):
+    data = {
+        'id': {
+            'uuid': '9b2f6c0a-8a4e-4f8e-b1d5-3e1a0f6c2d7b',
+            'to': '10.0.12.34:5555',
+            'from': '10.0.56.78:5555',
+            'kind': 'request',
+            'phase': 'payload',
+        },
+        'paradigm': 'node',
+        'method': method,
+    }
+    data.update(payload)
+    return data
+
+
+def sync_nodes(count):
+    return [
+        '10.{0}.{1}.{2}:5555'.format(x // 65536, x // 256 % 256, x % 256)
+        for x in range(count)
+    ]
+
+
+PAYLOADS = [
+    ('ping', envelope('ping')),
+    ('ping response', envelope('ping', code='OK')),
+    ('sync 100', envelope('sync', nodes=sync_nodes(100))),
+    ('sync 2000', envelope('sync', nodes=sync_nodes(2000))),
+]
+
+
+def measure(codec, data):
+    frames = wire.pack(data, codec)
+    size = sum(len(f) for f in frames)
+
+    number = max(10, 20000 // (len(str(data)) // 100 + 1))
+    encode = timeit.timeit(lambda: wire.pack(data, codec), number=number)
+    decode = timeit.timeit(lambda: wire.unpack(frames).data, number=number)
+    route = timeit.timeit(lambda: wire.unpack(frames).header, number=number)
+
+    return size, encode / number * 1e6, decode / number * 1e6, \
+        route / number * 1e6
+
+
+def main():
+    compression = conf.COMPRESSION
+
+    codecs = [('plain', None, None)]
+    for name, codec in sorted(wire.codecs.items()):
+        codecs.append((name, codec, None))
+        if compression is not None:
+            codecs.append((name + '+' + compression, codec, compression))
+
+    row = '{0:<14} {1:<13} {2:>9} {3:>12} {4:>12} {5:>12}'
+    print(row.format(
+        'payload', 'codec', 'bytes', 'encode us', 'decode us', 'route us'
+    ))
+
+    for title, data in PAYLOADS:
+        for name, codec, compressor in codecs:
+            conf.COMPRESSION = compressor
+            size, encode, decode, route = measure(codec, data)
+            print(row.format(
+                title, name, size,
+                '{0:.1f}'.format(encode),
+                '{0:.1f}'.format(decode),
+                '{0:.1f}'.format(route),
+            ))
+
+
+if __name__ == '__main__':
+    main()
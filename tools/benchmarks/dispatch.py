@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Measure the end-to-end latency of a single ping on an idle server
+
+A ping is sent to an in-process server every few milliseconds. "dispatch" is
+the time from sending it until a worker starts running it, and "total" the
+time until it has been run. The previous worker loop, which slept for 100ms
+whenever the queue was empty, is included for comparison.
+
+"""
+
+import sys
+import time
+import argparse
+
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+import gevent  # noqa
+import logbook  # noqa
+
+from gevent.event import AsyncResult  # noqa
+
+from kitten.client import KittenClient  # noqa
+from kitten.node import NodeParadigm  # noqa
+from kitten.request import KittenRequest  # noqa
+from kitten.server import KittenServer  # noqa
+
+
+class PollingServer(KittenServer):
+    def work(self):
+        if self.queue.empty():
+            gevent.sleep(0.1)
+            return True
+
+        request = self.queue.get()
+        self.pool.spawn(request.execute)
+        return True
+
+
+def measure(cls, port, count, gap):
+    # No pidfile or signal handlers for a server that lives in a benchmark
+    server = cls(argparse.Namespace(port=port))
+    server.setup = lambda: None
+    server.teardown = lambda exit=True: None
+    server.start()
+    gevent.sleep(0.1)
+
+    address = 'localhost:{0}'.format(port)
+    client = KittenClient()
+    request = {'paradigm': 'node', 'method': 'ping'}
+
+    done = [None]
+    execute = KittenRequest.execute
+
+    def traced(self):
+        started = time.time()
+        ret = execute(self)
+        done[0].set((started, time.time()))
+        return ret
+
+    KittenRequest.execute = traced
+    dispatch = []
+    total = []
+    try:
+        for _ in range(count):
+            gevent.sleep(gap)
+            done[0] = AsyncResult()
+            start = time.time()
+            client.send(address, request)
+
+            started, finished = done[0].get(timeout=1)
+            dispatch.append((started - start) * 1000)
+            total.append((finished - start) * 1000)
+    finally:
+        KittenRequest.execute = execute
+        for greenlet in (server.listener, server.worker, server.heartbeat):
+            greenlet.kill()
+
+    return sorted(dispatch), sorted(total)
+
+
+def summary(values):
+    return '{0:.2f} / {1:.2f}'.format(
+        values[len(values) // 2],
+        values[int(len(values) * 0.9)],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--gap', type=float, default=0.02,
+                        help='Seconds of idle time between pings')
+    parser.add_argument('--port', type=int, default=25555)
+    ns = parser.parse_args()
+
+    logbook.NullHandler().push_application()
+
+    # Pings are normally answered inline; this is about the queued path.
+    NodeParadigm.inline = ()
+
+    row = '{0:<10} {1:>24} {2:>24}'
+    print(row.format('worker', 'dispatch p50 / p90 ms', 'total p50 / p90 ms'))
+
+    servers = (('polling', PollingServer), ('blocking', KittenServer))
+    for offset, (name, cls) in enumerate(servers):
+        dispatch, total = measure(cls, ns.port + offset, ns.count, ns.gap)
+        print(row.format(name, summary(dispatch), summary(total)))
+
+
+if __name__ == '__main__':
+    main()
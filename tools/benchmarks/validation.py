@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Measure the cost of validating one message against its paradigm schema
+
+"uncached" is how every message used to be validated: deep copy the core
+schema, add the method schema to it, check the schema and build a validator
+for it, then validate. "compiled" validates with the jsonschema validator
+that Validator keeps, and "generated" is Validator.validate() with the
+checks from kitten.codegen.
+
+"""
+
+import sys
+import copy
+import timeit
+
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+import jsonschema  # noqa
+
+from jsonschema.exceptions import best_match  # noqa
+
+from kitten.node import NodeParadigm  # noqa
+
+
+def envelope(method, **payload):
+    data = {
+        'id': {
+            'uuid': '9b2f6c0a-8a4e-4f8e-b1d5-3e1a0f6c2d7b',
+            'to': '10.0.12.34:5555',
+            'from': '10.0.56.78:5555',
+            'kind': 'request',
+            'phase': 'payload',
+        },
+        'paradigm': 'node',
+        'method': method,
+    }
+    data.update(payload)
+    return data
+
+
+def sync_nodes(count):
+    return [
+        '10.{0}.{1}.{2}:5555'.format(x // 65536, x // 256 % 256, x % 256)
+        for x in range(count)
+    ]
+
+
+MESSAGES = [
+    ('ping request', 'request', envelope('ping')),
+    ('ping response', 'response', envelope('ping', code='OK')),
+    ('sync 100', 'request', envelope('sync', nodes=sync_nodes(100))),
+    ('sync 2000', 'request', envelope('sync', nodes=sync_nodes(2000))),
+]
+
+
+def uncached(validator, kind, data):
+    method = getattr(validator, '{0}_{1}'.format(data['method'], kind))
+
+    schema = copy.deepcopy(validator.core_schema)
+    schema['properties'].update(method())
+    jsonschema.validate(data, schema)
+
+
+def compiled(validator, kind, data):
+    method_name = '{0}_{1}'.format(data['method'], kind)
+    error = best_match(validator.compile(method_name).iter_errors(data))
+    if error is not None:
+        raise error
+
+
+def main():
+    paradigm = NodeParadigm()
+    paradigms = {'node': paradigm}
+    validator = paradigm.validator
+
+    row = '{0:<14} {1:>12} {2:>12} {3:>13}'
+    print(row.format('message', 'uncached us', 'compiled us', 'generated us'))
+
+    for title, kind, data in MESSAGES:
+        validate = getattr(validator, kind)
+        validate(data, paradigms)
+
+        number = max(10, 20000 // (len(str(data)) // 100 + 1))
+
+        def cost(func, *args):
+            return timeit.timeit(lambda: func(*args), number=number) \
+                / number * 1e6
+
+        print(row.format(
+            title,
+            '{0:.1f}'.format(cost(uncached, validator, kind, data)),
+            '{0:.1f}'.format(cost(compiled, validator, kind, data)),
+            '{0:.1f}'.format(cost(validate, data, paradigms)),
+        ))
+
+
+if __name__ == '__main__':
+    main()